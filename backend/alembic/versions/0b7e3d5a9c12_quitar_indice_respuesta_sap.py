@@ -0,0 +1,35 @@
+# PATH: backend/alembic/versions/0b7e3d5a9c12_quitar_indice_respuesta_sap.py
+
+"""Quita ix_tabla_central_respuesta_sap: la conciliación con la respuesta de SAP ya no lo usa
+
+Revision ID: 0b7e3d5a9c12
+Revises: e5b1c8d24f63
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0b7e3d5a9c12'
+down_revision: Union[str, None] = 'e5b1c8d24f63'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# actualizar_cargado_sap cruza ahora el Excel (tabla de staging) con las pendientes por
+# hash sobre ROW(...)::text, leyendo las pendientes con ix_tabla_central_pendientes; el
+# índice de 5 columnas no aparece en el plan y solo encarece cada INSERT en Tabla_Central
+def upgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS ix_tabla_central_respuesta_sap')
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE INDEX IF NOT EXISTS ix_tabla_central_respuesta_sap
+        ON "Tabla_Central" ("Employee_Number", "Date", "ProductionOrder", "OperationActivity", "HoursCent")
+        WHERE "Cargado_SAP" = false
+    """)
@@ -0,0 +1,29 @@
+# PATH: backend/alembic/versions/a9c4e1f7d302_version_sap_orders_en_imputaciones.py
+
+"""Columna SapOrdersVersion en Imputaciones (asignación SAP incremental)
+
+Revision ID: a9c4e1f7d302
+Revises: f3a8d2e6b510
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c4e1f7d302'
+down_revision: Union[str, None] = 'f3a8d2e6b510'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Sin backfill: NULL = nunca resuelta, la siguiente ejecución las reprocesa todas
+    op.add_column('Imputaciones', sa.Column('SapOrdersVersion', sa.BIGINT(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('Imputaciones', 'SapOrdersVersion')
@@ -0,0 +1,42 @@
+# PATH: backend/alembic/versions/b6e2f94c0d17_claves_tipadas_numcoche_y_horas.py
+
+"""Claves tipadas: Imputaciones.NumCocheInt y Tabla_Central.HoursCent (con backfill)
+
+Revision ID: b6e2f94c0d17
+Revises: a9c4e1f7d302
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6e2f94c0d17'
+down_revision: Union[str, None] = 'a9c4e1f7d302'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('Imputaciones', sa.Column('NumCocheInt', sa.BIGINT(), nullable=True))
+    op.add_column('Tabla_Central', sa.Column('HoursCent', sa.Integer(), nullable=True))
+
+    # Mismas reglas que imputaciones_utils.num_coche_entero / horas_centesimas
+    op.execute(r"""
+        UPDATE "Imputaciones"
+        SET "NumCocheInt" = "NumCoche"::bigint
+        WHERE "NumCoche" ~ '^\s*[+-]?\d{1,18}\s*$'
+    """)
+    op.execute("""
+        UPDATE "Tabla_Central"
+        SET "HoursCent" = round("Hours"::numeric * 100)::integer
+        WHERE "Hours" IS NOT NULL AND "Hours" NOT IN ('NaN', 'Infinity', '-Infinity')
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column('Tabla_Central', 'HoursCent')
+    op.drop_column('Imputaciones', 'NumCocheInt')
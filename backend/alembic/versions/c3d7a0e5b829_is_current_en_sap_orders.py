@@ -0,0 +1,53 @@
+# PATH: backend/alembic/versions/c3d7a0e5b829_is_current_en_sap_orders.py
+
+"""Columna IsCurrent en Sap_Orders con índice único parcial por clave lógica
+
+Revision ID: c3d7a0e5b829
+Revises: b6e2f94c0d17
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3d7a0e5b829'
+down_revision: Union[str, None] = 'b6e2f94c0d17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'Sap_Orders',
+        sa.Column('IsCurrent', sa.Boolean(), nullable=False, server_default=sa.false())
+    )
+
+    # Vigente = activa más reciente de su clave (TimestampInput DESC, NULL primero; después mayor ID),
+    # igual que sap_etl_utils.actualizar_vigencia_sap_orders
+    op.execute("""
+        UPDATE "Sap_Orders" so
+        SET "IsCurrent" = true
+        FROM (
+            SELECT DISTINCT ON ("Project", "Vertice", "CarNumber", "OperationActivity") "ID"
+            FROM "Sap_Orders"
+            WHERE "ActiveOrder" IS TRUE
+            ORDER BY "Project", "Vertice", "CarNumber", "OperationActivity", "TimestampInput" DESC, "ID" DESC
+        ) vigentes
+        WHERE so."ID" = vigentes."ID"
+    """)
+
+    # NULLS NOT DISTINCT (PostgreSQL 15+): Vertice / CarNumber NULL también forman una única clave
+    op.execute("""
+        CREATE UNIQUE INDEX uq_sap_orders_vigente
+        ON "Sap_Orders" ("Project", "Vertice", "CarNumber", "OperationActivity") NULLS NOT DISTINCT
+        WHERE "IsCurrent"
+    """)
+
+
+def downgrade() -> None:
+    op.execute('DROP INDEX IF EXISTS uq_sap_orders_vigente')
+    op.drop_column('Sap_Orders', 'IsCurrent')
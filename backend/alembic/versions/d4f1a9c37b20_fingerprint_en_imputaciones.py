@@ -0,0 +1,76 @@
+# PATH: backend/alembic/versions/d4f1a9c37b20_fingerprint_en_imputaciones.py
+
+"""Columna Fingerprint indexada en Imputaciones
+
+Revision ID: d4f1a9c37b20
+Revises: c1a2b3v20001
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+import hashlib
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4f1a9c37b20'
+down_revision: Union[str, None] = 'c1a2b3v20001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Copia de app.services.utils.imputaciones_utils.calcular_fingerprint en el momento
+# de la migración (las migraciones no deben depender del código de la app).
+COLUMNAS_FINGERPRINT = [
+    'FechaImp', 'CodEmpleado', 'Timpu', 'Proyecto', 'TipoCoche',
+    'NumCoche', 'CentroTrabajo', 'Tarea', 'TareaAsoc', 'Horas'
+]
+TAMANO_LOTE = 5000
+
+
+def _normalizar_valor(columna, valor):
+    if valor is None or (isinstance(valor, float) and valor != valor):
+        return None
+    if columna == 'FechaImp':
+        return valor.isoformat()
+    if columna == 'Horas':
+        return f"{round(float(valor), 2) + 0.0:.2f}"
+    return str(valor)
+
+
+def _calcular_fingerprint(fila) -> str:
+    valores = [_normalizar_valor(col, fila[col]) for col in COLUMNAS_FINGERPRINT]
+    serializado = json.dumps(valores, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+
+
+def upgrade() -> None:
+    op.add_column('Imputaciones', sa.Column('Fingerprint', sa.String(length=64), nullable=True))
+
+    # Rellenar las filas existentes por bloques de ID
+    conn = op.get_bind()
+    columnas = ', '.join(f'"{col}"' for col in COLUMNAS_FINGERPRINT)
+    seleccion = sa.text(
+        f'SELECT "ID", {columnas} FROM "Imputaciones" '
+        'WHERE "ID" > :ultimo ORDER BY "ID" LIMIT :limite'
+    )
+    actualizacion = sa.text('UPDATE "Imputaciones" SET "Fingerprint" = :fp WHERE "ID" = :id')
+
+    ultimo = 0
+    while True:
+        filas = conn.execute(seleccion, {"ultimo": ultimo, "limite": TAMANO_LOTE}).mappings().all()
+        if not filas:
+            break
+        conn.execute(actualizacion, [
+            {"id": fila["ID"], "fp": _calcular_fingerprint(fila)} for fila in filas
+        ])
+        ultimo = filas[-1]["ID"]
+
+    op.create_index(op.f('ix_Imputaciones_Fingerprint'), 'Imputaciones', ['Fingerprint'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_Imputaciones_Fingerprint'), table_name='Imputaciones')
+    op.drop_column('Imputaciones', 'Fingerprint')
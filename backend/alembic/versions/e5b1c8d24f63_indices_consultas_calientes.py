@@ -0,0 +1,77 @@
+# PATH: backend/alembic/versions/e5b1c8d24f63_indices_consultas_calientes.py
+
+"""Índices (parciales) para las consultas calientes de asignación, respuesta SAP, feedback y proyectos
+
+Revision ID: e5b1c8d24f63
+Revises: c3d7a0e5b829
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b1c8d24f63'
+down_revision: Union[str, None] = 'c3d7a0e5b829'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (nombre, sentencia). Los comprueba tests/test_query_plans.py con EXPLAIN.
+INDICES = [
+    # Filtro incremental (pending_imputaciones.filtro_requiere_asignacion): SapOrders activas
+    # posteriores a la versión de la imputación con su Operation / TipoIndirecto + TipoMotivo /
+    # proyecto SAP. Predicado `"ActiveOrder"` (no `IS TRUE`): es el que el planificador
+    # reconoce en las consultas del ORM (`ActiveOrder == True` → `"ActiveOrder" = true`)
+    ("ix_sap_orders_operation", """
+        CREATE INDEX IF NOT EXISTS ix_sap_orders_operation
+        ON "Sap_Orders" ("Operation", "ID")
+        WHERE "ActiveOrder"
+    """),
+    ("ix_sap_orders_gg", """
+        CREATE INDEX IF NOT EXISTS ix_sap_orders_gg
+        ON "Sap_Orders" ("TipoIndirecto", "TipoMotivo", "ID")
+        WHERE "ActiveOrder"
+    """),
+    ("ix_sap_orders_proyecto", """
+        CREATE INDEX IF NOT EXISTS ix_sap_orders_proyecto
+        ON "Sap_Orders" ("Project", "ID")
+        WHERE "ActiveOrder"
+    """),
+    # Feedback (fila de Tabla_Central de una imputación) y anti-join de pendientes
+    ("ix_tabla_central_imputacion_id", """
+        CREATE INDEX IF NOT EXISTS ix_tabla_central_imputacion_id
+        ON "Tabla_Central" (imputacion_id)
+    """),
+    # Filas pendientes de cargar en SAP (una fracción pequeña de la tabla): conteo del
+    # /start, limpieza de la asignación y borrado incremental por imputación
+    ("ix_tabla_central_pendientes", """
+        CREATE INDEX IF NOT EXISTS ix_tabla_central_pendientes
+        ON "Tabla_Central" (imputacion_id)
+        WHERE "Cargado_SAP" = false
+    """),
+    # Cruce con el Excel de respuesta de SAP (actualizar_cargado_sap), solo entre pendientes
+    ("ix_tabla_central_respuesta_sap", """
+        CREATE INDEX IF NOT EXISTS ix_tabla_central_respuesta_sap
+        ON "Tabla_Central" ("Employee_Number", "Date", "ProductionOrder", "OperationActivity", "HoursCent")
+        WHERE "Cargado_SAP" = false
+    """),
+    # Conteo de imputaciones por proyecto (routes/proyectos)
+    ("ix_imputaciones_proyecto", """
+        CREATE INDEX IF NOT EXISTS ix_imputaciones_proyecto
+        ON "Imputaciones" ("Proyecto")
+    """),
+]
+
+
+def upgrade() -> None:
+    for _, sentencia in INDICES:
+        op.execute(sentencia)
+
+
+def downgrade() -> None:
+    for nombre, _ in reversed(INDICES):
+        op.execute(f'DROP INDEX IF EXISTS {nombre}')
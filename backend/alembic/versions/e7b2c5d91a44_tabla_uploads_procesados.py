@@ -0,0 +1,40 @@
+# PATH: backend/alembic/versions/e7b2c5d91a44_tabla_uploads_procesados.py
+
+"""Tabla Uploads_Procesados (huella SHA-256 de ficheros ya procesados por pipeline)
+
+Revision ID: e7b2c5d91a44
+Revises: d4f1a9c37b20
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7b2c5d91a44'
+down_revision: Union[str, None] = 'd4f1a9c37b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'Uploads_Procesados',
+        sa.Column('ID', sa.BIGINT(), nullable=False),
+        sa.Column('Pipeline', sa.String(length=32), nullable=False),
+        sa.Column('Hash', sa.String(length=64), nullable=False),
+        sa.Column('Filename', sa.String(length=255), nullable=True),
+        sa.Column('Summary', sa.JSON(), nullable=True),
+        sa.Column('TimestampInput', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('ID'),
+        sa.UniqueConstraint('Pipeline', 'Hash', name='uq_Uploads_Procesados_Pipeline_Hash'),
+    )
+    op.create_index(op.f('ix_Uploads_Procesados_ID'), 'Uploads_Procesados', ['ID'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_Uploads_Procesados_ID'), table_name='Uploads_Procesados')
+    op.drop_table('Uploads_Procesados')
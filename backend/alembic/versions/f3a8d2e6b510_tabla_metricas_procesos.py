@@ -0,0 +1,42 @@
+# PATH: backend/alembic/versions/f3a8d2e6b510_tabla_metricas_procesos.py
+
+"""Tabla Metricas_Procesos (tiempos y volumen por etapa de cada proceso)
+
+Revision ID: f3a8d2e6b510
+Revises: e7b2c5d91a44
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a8d2e6b510'
+down_revision: Union[str, None] = 'e7b2c5d91a44'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'Metricas_Procesos',
+        sa.Column('ID', sa.BIGINT(), nullable=False),
+        sa.Column('ProcessId', sa.String(length=64), nullable=True),
+        sa.Column('Pipeline', sa.String(length=32), nullable=False),
+        sa.Column('Estado', sa.String(length=16), nullable=True),
+        sa.Column('SegundosTotales', sa.Float(), nullable=True),
+        sa.Column('Etapas', sa.JSON(), nullable=True),
+        sa.Column('TimestampInput', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('ID'),
+    )
+    op.create_index(op.f('ix_Metricas_Procesos_ID'), 'Metricas_Procesos', ['ID'], unique=False)
+    op.create_index(op.f('ix_Metricas_Procesos_ProcessId'), 'Metricas_Procesos', ['ProcessId'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_Metricas_Procesos_ProcessId'), table_name='Metricas_Procesos')
+    op.drop_index(op.f('ix_Metricas_Procesos_ID'), table_name='Metricas_Procesos')
+    op.drop_table('Metricas_Procesos')
@@ -2,40 +2,73 @@
 
 from fastapi import APIRouter, Request, UploadFile, BackgroundTasks, Query, HTTPException, File
 from fastapi.responses import StreamingResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
 import uuid
 import asyncio
-import pandas as pd
 import os
-from io import BytesIO
+import hashlib
+import tempfile
 
 from app.core.sse_manager import sse_manager
-from app.db.session import database_session
-from app.services.etl_inmemory.transformar_datos_excel_inmemory import transformar_datos_excel_inmemory
-from app.services.etl_inmemory.load_datos_excel_inmemory import load_datos_excel_inmemory
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado
+from app.core.upload_store import upload_store
+from app.services.utils.excel_por_bloques import leer_cabecera_excel
+from app.services.utils.uploads_procesados import (
+    PIPELINE_IMPUTACIONES,
+    buscar_upload_procesado,
+    registrar_upload_procesado,
+    mensaje_upload_repetido,
+)
+from app.services.etl_inmemory.procesar_imputaciones_por_bloques import procesar_imputaciones_por_bloques
 
 router = APIRouter()
 
-VALIDATED_DFS_IMPUT = {}   # token => DataFrame en memoria
-COMPLETED_FILES = {}       # process_id => path del Excel final (o bytes in memory)
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 
 @router.post("/validate-file")
-async def validate_file(file: UploadFile = File(...)):
+async def validate_file(file: UploadFile = File(...), force: bool = Query(False)):
+    """
+    Valida el Excel. Si ya se procesó un fichero idéntico (mismo SHA-256) y no se
+    pide `force`, devuelve el resultado anterior sin leerlo (already_processed).
+    """
     if not file.filename.endswith(".xlsx"):
         raise HTTPException(400, detail="El archivo debe ser .xlsx")
 
-    content = await file.read()
+    # Volcamos la subida a disco por trozos, sin tenerla entera en memoria, calculando su huella
+    sha256 = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(delete=False, prefix="upload_imputaciones_", suffix=".xlsx") as tmp:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            sha256.update(chunk)
+            tmp.write(chunk)
+        path = tmp.name
+
+    token = str(uuid.uuid4())
+    # Consulta síncrona a la BD: en el threadpool, sin bloquear el bucle de eventos (SSE)
+    previo = None if force else await run_in_threadpool(buscar_upload_procesado, PIPELINE_IMPUTACIONES, sha256.hexdigest())
+    if previo is not None:
+        os.remove(path)
+        upload_store.save_meta(token, previo=previo)
+        return {
+            "message": "Archivo ya procesado",
+            "token": token,
+            "already_processed": True,
+            "previous_summary": previo["summary"],
+            "processed_at": previo["processed_at"],
+        }
+
     try:
-        df = pd.read_excel(BytesIO(content), engine="openpyxl", dtype=str)
-        if df.empty:
+        columnas, filas_con_datos = leer_cabecera_excel(path)
+        if filas_con_datos == 0:
             raise ValueError("El Excel está vacío")
     except Exception as e:
+        os.remove(path)
         raise HTTPException(400, detail=f"Error procesando el archivo: {str(e)}")
 
-    token = str(uuid.uuid4())
-    VALIDATED_DFS_IMPUT[token] = df
+    upload_store.save_file(token, path, sha256=sha256.hexdigest(), filename=file.filename)
 
-    return {"message": "Archivo válido", "token": token}
+    return {"message": "Archivo válido", "token": token, "already_processed": False}
 
 
 @router.post("/start")
@@ -43,17 +76,20 @@ async def start_imputaciones_inmemory(
     token: str = Query(...),
     background_tasks: BackgroundTasks = None
 ):
-    if token not in VALIDATED_DFS_IMPUT:
+    meta = upload_store.acquire(token)
+    if meta is None:
         raise HTTPException(400, detail="Token no encontrado o archivo no validado")
 
     process_id = str(uuid.uuid4())
     sse_manager.start_process(process_id)
 
-    df_validado = VALIDATED_DFS_IMPUT[token]
-    # Eliminamos ya el df para no guardarlo post-run
-    del VALIDATED_DFS_IMPUT[token]
+    if "previo" in meta:
+        # Fichero idéntico ya procesado: se completa al momento con el resultado anterior
+        sse_manager.mark_completed(process_id, mensaje_upload_repetido(meta["previo"]))
+        upload_store.discard(token)
+        return {"process_id": process_id, "already_processed": True}
 
-    background_tasks.add_task(long_running_inmemory, process_id, df_validado)
+    background_tasks.add_task(long_running_inmemory, process_id, token, meta)
 
     return {"process_id": process_id}
 
@@ -95,60 +131,40 @@ async def download_imputaciones(process_id: str):
     """
     Devuelve el Excel final con las columnas extra ("Status", "error_message").
     """
-    if process_id not in COMPLETED_FILES:
+    resultado = upload_store.result(process_id)
+    if resultado is None:
         return {"error": "No se encontró un archivo final para ese process_id"}
-    
-    filepath = COMPLETED_FILES[process_id]
 
-    # Opcional: Borrar el archivo tras servirlo
-    # from fastapi.responses import FileResponse
+    # El fichero se conserva hasta que caduque (RESULT_FILES_TTL_SECONDS)
+    filepath, download_name = resultado
     response = FileResponse(
         path=filepath,
-        filename=os.path.basename(filepath),
+        filename=download_name,
         media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
     )
     return response
 
 
-def long_running_inmemory(process_id: str, df: pd.DataFrame):
+def long_running_inmemory(process_id: str, token: str, meta: dict):
     """
-    1) Transformar en memoria
+    Procesa el Excel subido por bloques de filas:
+    1) Transformar cada bloque
     2) Cargar en BD con contadores
     3) Crear Excel final con columnas Status/error_message
-    4) Ofrecer SSE summary
+    4) Ofrecer SSE summary (mensaje final + resumen de tiempos por etapa)
+    Si no hubo errores, registra la huella del fichero para no repetir la carga.
     """
+    medidor = MedidorEtapas("imputaciones", process_id)
+    summary = {"total": 0, "success": 0, "skipped": 0, "fail": 0}
     try:
-        total_filas_raw = len(df)
-        sse_manager.send_message(process_id, f"📁 Archivo con {total_filas_raw} filas recibido en memoria.")
-
-        sse_manager.send_message(process_id, "🔄 Transformando datos (inmemory)...")
-        df_transformado = transformar_datos_excel_inmemory(df)
-
-        filas_filtradas = total_filas_raw - len(df_transformado)
-        if filas_filtradas > 0:
-            sse_manager.send_message(process_id, f"🔽 {filas_filtradas} filas filtradas en transformación.")
-
-        sse_manager.send_message(process_id, "💾 Cargando datos en la BD (inmemory)...")
-
-        summary = {
-            "total": len(df_transformado),
-            "success": 0,
-            "skipped": 0,
-            "fail": 0
-        }
-
-        df_result = load_datos_excel_inmemory(df_transformado, sse_process_id=process_id, summary=summary)
-
-        # Guardar df_result en un Excel temporal
-        import tempfile
-        import time
-        tmpdir = tempfile.gettempdir()
-        filename = f"imputaciones_{process_id}_{int(time.time())}.xlsx"
-        filepath = os.path.join(tmpdir, filename)
-        df_result.to_excel(filepath, index=False)
+        path_excel = upload_store.file_path(token)
+        filepath = procesar_imputaciones_por_bloques(
+            path_excel, process_id, summary, medidor=medidor,
+            cancelacion=TokenCancelacion.para_proceso_sse(process_id),
+        )
 
-        # Guardar en el diccionario
-        COMPLETED_FILES[process_id] = filepath
+        # Registrar el Excel final para su descarga
+        upload_store.save_result(process_id, filepath)
 
         # Mensaje final
         partes = [f"Filas: {summary['total']}"]
@@ -158,6 +174,18 @@ def long_running_inmemory(process_id: str, df: pd.DataFrame):
         if summary['fail'] > 0:
             partes.append(f"errores: {summary['fail']}")
         mensaje_final = f"Proceso finalizado. {', '.join(partes)}."
+        if summary['fail'] == 0:
+            registrar_upload_procesado(
+                PIPELINE_IMPUTACIONES, meta["sha256"], meta["filename"], {**summary, "mensaje": mensaje_final}
+            )
+        sse_manager.send_summary(process_id, medidor.finalizar("completed"))
         sse_manager.mark_completed(process_id, mensaje_final)
+    except ProcesoCancelado:
+        # El SSE ya recibió el evento 'cancelled'; los lotes confirmados se conservan
+        medidor.finalizar("cancelled")
+        print(f"[agregar_imputaciones] Proceso {process_id} cancelado. Filas ya confirmadas en BD: {summary['success']}")
     except Exception as e:
+        sse_manager.send_summary(process_id, medidor.finalizar("error"))
         sse_manager.mark_error(process_id, f"Error: {str(e)}")
+    finally:
+        upload_store.discard(token)
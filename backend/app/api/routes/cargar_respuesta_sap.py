@@ -2,57 +2,92 @@
 
 from fastapi import APIRouter, UploadFile, File, BackgroundTasks, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from tempfile import NamedTemporaryFile
-from shutil import copyfileobj
-import uuid, asyncio
+import uuid, asyncio, os, hashlib
 
 import pandas as pd
-from io import BytesIO
 
 from app.core.sse_manager import sse_manager
+from app.core.upload_store import upload_store
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado
 from app.services.sap_response_handling.actualizar_cargado_sap import procesar_respuesta_sap
+from app.services.utils.uploads_procesados import (
+    PIPELINE_RESPUESTA_SAP,
+    buscar_upload_procesado,
+    registrar_upload_procesado,
+    mensaje_upload_repetido,
+)
 
 router = APIRouter(
     tags=["cargar-respuesta-sap"],
 )
 
-# Almacenamos el binario en memoria → token:string ➜ bytes
-VALIDATED_FILES: dict[str, bytes] = {}
+UPLOAD_CHUNK_BYTES = 1024 * 1024
 
 
 # ---------- 1) VALIDAR ----------
 @router.post("/validate-file")
-async def validate_file(file: UploadFile = File(...)):
+async def validate_file(file: UploadFile = File(...), force: bool = Query(False)):
     if not file.filename.endswith((".xlsx", ".xls")):
         raise HTTPException(status_code=400, detail="El archivo debe ser .xlsx / .xls")
 
-    content = await file.read()
+    # Volcamos la subida a disco por trozos; el almacén la conserva hasta start/discard/TTL
+    sha256 = hashlib.sha256()
+    with NamedTemporaryFile(delete=False, prefix="upload_respuesta_sap_", suffix=".xlsx") as tmp:
+        while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+            sha256.update(chunk)
+            tmp.write(chunk)
+        path = tmp.name
+
+    # Misma respuesta ya procesada (mismo SHA-256) → se devuelve el resultado anterior salvo `force`
+    token = str(uuid.uuid4())
+    previo = None if force else await run_in_threadpool(buscar_upload_procesado, PIPELINE_RESPUESTA_SAP, sha256.hexdigest())
+    if previo is not None:
+        os.remove(path)
+        upload_store.save_meta(token, previo=previo)
+        return {
+            "message": "Archivo ya procesado",
+            "token": token,
+            "already_processed": True,
+            "previous_summary": previo["summary"],
+            "processed_at": previo["processed_at"],
+        }
 
     try:
         # Simple check: ¿se puede abrir con pandas?
-        pd.read_excel(BytesIO(content), engine="openpyxl", dtype=str)
+        pd.read_excel(path, engine="openpyxl", dtype=str)
     except Exception as e:
+        os.remove(path)
         raise HTTPException(status_code=400, detail=f"Error procesando el archivo: {e}")
 
-    token = str(uuid.uuid4())
-    VALIDATED_FILES[token] = content
-    return {"message": "Archivo válido", "token": token}
+    upload_store.save_file(token, path, sha256=sha256.hexdigest(), filename=file.filename)
+    return {"message": "Archivo válido", "token": token, "already_processed": False}
 
 
 # ---------- 2) START ----------
 @router.post("/start")
 async def start_process(
     token: str = Query(...),
+    solo_afectadas: bool = Query(False),
     background_tasks: BackgroundTasks = None,
 ):
-    if token not in VALIDATED_FILES:
+    meta = upload_store.acquire(token)
+    if meta is None:
         raise HTTPException(status_code=400, detail="Token no encontrado o archivo no validado")
 
     process_id = str(uuid.uuid4())
     sse_manager.start_process(process_id)
 
+    if "previo" in meta:
+        # Fichero idéntico ya procesado: se completa al momento con el resultado anterior
+        sse_manager.mark_completed(process_id, mensaje_upload_repetido(meta["previo"]))
+        upload_store.discard(token)
+        return {"process_id": process_id, "already_processed": True}
+
     # Lanza la tarea en segundo plano
-    background_tasks.add_task(long_running_task, process_id, VALIDATED_FILES[token], token)
+    background_tasks.add_task(long_running_task, process_id, token, meta, solo_afectadas)
     return {"process_id": process_id}
 
 
@@ -89,30 +124,40 @@ def cancel_process(process_id: str):
 # ---------- 5) DESCARTAR ----------
 @router.post("/discard")
 def discard_file(token: str = Query(...)):
-    if token in VALIDATED_FILES:
-        del VALIDATED_FILES[token]
+    if upload_store.discard(token):
         return {"message": "Archivo descartado"}
     return {"message": "No se encontró un archivo con ese token"}
 
 
 # ---------- LONG‑RUNNING ----------
-def long_running_task(process_id: str, file_bytes: bytes, token: str):
+def long_running_task(process_id: str, token: str, meta: dict, solo_afectadas: bool = False):
+    medidor = MedidorEtapas("respuesta_sap", process_id)
     try:
-        sse_manager.send_message(process_id, "🔄 Creando archivo temporal…")
-        with NamedTemporaryFile(delete=False, suffix=".xlsx") as tmp:
-            copyfileobj(BytesIO(file_bytes), tmp)
-            tmp_path = tmp.name
+        path_excel = upload_store.file_path(token)
+        if path_excel is None:
+            raise ValueError("El archivo validado ha caducado o fue descartado")
 
         sse_manager.send_message(process_id, "⚙️ Procesando respuesta SAP…")
-        ok = procesar_respuesta_sap(tmp_path)
-
-        # Limpiar token en memoria
-        VALIDATED_FILES.pop(token, None)
+        ok = procesar_respuesta_sap(
+            path_excel, medidor, TokenCancelacion.para_proceso_sse(process_id), solo_afectadas
+        )
+        sse_manager.send_summary(process_id, medidor.finalizar("completed" if ok else "error"))
 
         if ok:
-            sse_manager.mark_completed(process_id, "✅ Procesamiento completado correctamente.")
+            mensaje_final = "✅ Procesamiento completado correctamente."
+            registrar_upload_procesado(
+                PIPELINE_RESPUESTA_SAP, meta["sha256"], meta["filename"], {"mensaje": mensaje_final}
+            )
+            sse_manager.mark_completed(process_id, mensaje_final)
         else:
             sse_manager.mark_error(process_id, "❌ Error al procesar la respuesta SAP.")
+    except ProcesoCancelado:
+        # Las marcas Cargado_SAP se han deshecho; no se ha limpiado nada
+        medidor.finalizar("cancelled")
+        print(f"[cargar_respuesta_sap] Proceso {process_id} cancelado. Cambios deshechos.")
     except Exception as e:
-        VALIDATED_FILES.pop(token, None)
+        sse_manager.send_summary(process_id, medidor.finalizar("error"))
         sse_manager.mark_error(process_id, f"❌ Error: {e}")
+    finally:
+        # Limpiar token y fichero del almacén
+        upload_store.discard(token)
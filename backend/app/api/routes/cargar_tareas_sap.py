@@ -2,15 +2,26 @@
 
 from fastapi import APIRouter, Request, UploadFile, BackgroundTasks, Query, HTTPException, File
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 import uuid
 import asyncio
+import hashlib
 import pandas as pd
 from io import BytesIO
 
 from app.core.sse_manager import sse_manager
+from app.core.upload_store import upload_store
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado
 from app.db.session import database_session
 from app.models.models import SapOrders
 from app.services.sap_etl_utils import verificar_columnas_excel, transformar_datos_sap, cargar_datos_sap_en_db
+from app.services.utils.uploads_procesados import (
+    PIPELINE_TAREAS_SAP,
+    buscar_upload_procesado,
+    registrar_upload_procesado,
+    mensaje_upload_repetido,
+)
 
 import os
 import uuid
@@ -19,43 +30,63 @@ import pandas as pd
 router = APIRouter()
 
 REQUIRED_COLUMNS = ["Operation Activity", "Effectivity", "Order"]
-VALIDATED_DFS  = {}  # dict[str, bytes]
 
 @router.post("/validate-file")
-async def validate_file(file: UploadFile = File(...)):
+async def validate_file(file: UploadFile = File(...), force: bool = Query(False)):
+    """
+    Valida el Excel. Si ya se procesó un fichero idéntico (mismo SHA-256) y no se
+    pide `force`, devuelve el resultado anterior sin parsearlo (already_processed).
+    """
     if not file.filename.endswith(".xlsx"):
         raise HTTPException(status_code=400, detail="El archivo debe ser .xlsx")
 
     # Leer en memoria
     content = await file.read()
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    token = str(uuid.uuid4())
+    previo = None if force else await run_in_threadpool(buscar_upload_procesado, PIPELINE_TAREAS_SAP, sha256)
+    if previo is not None:
+        upload_store.save_meta(token, previo=previo)
+        return {
+            "message": "Archivo ya procesado",
+            "token": token,
+            "already_processed": True,
+            "previous_summary": previo["summary"],
+            "processed_at": previo["processed_at"],
+        }
+
     try:
         df = pd.read_excel(BytesIO(content), engine="openpyxl", dtype=str)
         verificar_columnas_excel(df, REQUIRED_COLUMNS)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Error procesando el archivo: {str(e)}")
 
-    # Guardar DF en memoria (no bytes)
-    token = str(uuid.uuid4())
-    VALIDATED_DFS[token] = df
+    # Guardar DF validado en el almacén (spool en disco + caché en memoria)
+    upload_store.save_frame(token, df, sha256=sha256, filename=file.filename)
 
-    return {"message": "Archivo válido", "token": token}
+    return {"message": "Archivo válido", "token": token, "already_processed": False}
 
 @router.post("/start")
 async def start_carga_tareas_sap(
     token: str = Query(...),
     background_tasks: BackgroundTasks = None
 ):
-    if token not in VALIDATED_DFS:
+    meta = upload_store.acquire(token)
+    if meta is None:
         raise HTTPException(status_code=400, detail="Token no encontrado o archivo no validado")
 
     process_id = str(uuid.uuid4())
     sse_manager.start_process(process_id)
 
-    # Recuperamos el DF validado
-    df_validado = VALIDATED_DFS[token]
+    if "previo" in meta:
+        # Fichero idéntico ya procesado: se completa al momento con el resultado anterior
+        sse_manager.mark_completed(process_id, mensaje_upload_repetido(meta["previo"]))
+        upload_store.discard(token)
+        return {"process_id": process_id, "already_processed": True}
 
-    # Lanzas la tarea en segundo plano
-    background_tasks.add_task(long_running_task, process_id, df_validado, token)
+    # Lanzas la tarea en segundo plano (el DF se recupera del almacén)
+    background_tasks.add_task(long_running_task, process_id, token, meta)
 
     return {"process_id": process_id}
 
@@ -95,37 +126,55 @@ async def cancel_process(process_id: str):
     return {"message": "Proceso no encontrado"}
 
 
-def long_running_task(process_id: str, df_excel: pd.DataFrame, token: str):
+def long_running_task(process_id: str, token: str, meta: dict):
+    medidor = MedidorEtapas("tareas_sap", process_id)
+    cancelacion = TokenCancelacion.para_proceso_sse(process_id)
     try:
-        sse_manager.send_message(process_id, f"📈 DataFrame con {len(df_excel)} filas recuperado de memoria.")
+        with medidor.etapa("lectura_almacen") as etapa:
+            df_excel = upload_store.load_frame(token)
+            if df_excel is None:
+                raise ValueError("El archivo validado ha caducado o fue descartado")
+            etapa.filas_salida = len(df_excel)
+        sse_manager.send_message(process_id, f"📈 DataFrame con {len(df_excel)} filas recuperado del almacén.")
 
         sse_manager.send_message(process_id, "🔄 Transformando datos SAP...")
-        df_transformed = transformar_datos_sap(df_excel)
+        with medidor.etapa("transformacion", filas_entrada=len(df_excel)) as etapa:
+            df_transformed = transformar_datos_sap(df_excel)
+            etapa.filas_salida = len(df_transformed)
 
+        cancelacion.comprobar()
         sse_manager.send_message(process_id, "💾 Insertando en la base de datos...")
-        with database_session as db:
-            nuevos = cargar_datos_sap_en_db(df_transformed, db, process_id)
+        with database_session as db, medidor.etapa("carga_bd", filas_entrada=len(df_transformed)) as etapa:
+            nuevos = cargar_datos_sap_en_db(df_transformed, db, process_id, cancelacion)
+            etapa.filas_salida = nuevos
             if nuevos > 0:
                 sse_manager.send_message(process_id, f"🟢 Insertados {nuevos} nuevos registros en SAPOrders.")
             else:
                 sse_manager.send_message(process_id, "🟡 No se encontraron registros nuevos para insertar.")
 
-        # Al final, eliminamos de la memoria para no ocupar espacio
-        if token in VALIDATED_DFS:
-            del VALIDATED_DFS[token]
-
-        sse_manager.mark_completed(process_id, f"🏁 Proceso finalizado. Insertados {nuevos} nuevos registros en SAP_Orders.")
+        mensaje_final = f"🏁 Proceso finalizado. Insertados {nuevos} nuevos registros en SAP_Orders."
+        registrar_upload_procesado(
+            PIPELINE_TAREAS_SAP, meta["sha256"], meta["filename"],
+            {"total": len(df_excel), "insertados": nuevos, "mensaje": mensaje_final},
+        )
+        sse_manager.send_summary(process_id, medidor.finalizar("completed"))
+        sse_manager.mark_completed(process_id, mensaje_final)
+    except ProcesoCancelado:
+        # No se ha confirmado nada en SapOrders
+        medidor.finalizar("cancelled")
+        print(f"[cargar_tareas_sap] Proceso {process_id} cancelado. Inserción deshecha.")
     except Exception as e:
-        if token in VALIDATED_DFS:
-            del VALIDATED_DFS[token]
+        sse_manager.send_summary(process_id, medidor.finalizar("error"))
         sse_manager.mark_error(process_id, f"Error: {str(e)}")
+    finally:
+        # Al final, eliminamos del almacén (memoria y disco)
+        upload_store.discard(token)
 
 @router.post("/discard")
 def discard_file(token: str = Query(...)):
     """
-    Descarta el archivo validado de la memoria, si existe.
+    Descarta el archivo validado del almacén, si existe.
     """
-    if token in VALIDATED_DFS:
-        del VALIDATED_DFS[token]
+    if upload_store.discard(token):
         return {"message": "Archivo descartado"}
     return {"message": "No se encontró un archivo con ese token"}
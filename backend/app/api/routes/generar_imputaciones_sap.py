@@ -1,15 +1,24 @@
 # PATH: backend/app/api/routes/generar_imputaciones_sap.py
 
-from fastapi import APIRouter, Depends, Request, BackgroundTasks, HTTPException, Query
+from fastapi import APIRouter, Depends, Request, HTTPException, Query
 from fastapi.responses import StreamingResponse, Response
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 import uuid
 import time
 import asyncio
+import json
 import traceback
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.orm import Session
 
-from app.db.session import get_db
+from app.db.session import get_db, JobsSessionLocal
+from app.db.bloqueos import CLAVE_ASIGNACION_SAP, intentar_bloqueo_transaccion
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado
+from app.core.registro_progreso import RegistroProgreso, clave_informe
+from app.core.config import get_config
+from app.core.upload_store import upload_store
 
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import FileResponse
@@ -17,13 +26,28 @@ import os
 
 from app.models.models import TablaCentral
 from app.services.generar_imputaciones_sap.assign_sap_orders import run_assign_sap_orders_inmemory
+from app.services.generar_imputaciones_sap.assign_sap_orders_sql import run_assign_sap_orders_sql
 from app.services.generar_imputaciones_sap.pending_imputaciones import get_imputaciones_pendientes, get_imputaciones_pendientes_count
+from app.services.generar_imputaciones_sap.generar_csv import nombre_mass_upload
+from app.services.generar_imputaciones_sap.cache_mass_upload import cache_mass_upload, leer_marca
 
 
 router = APIRouter()
 
+# process_id -> { status, logs, summary, matched_count, expires }. Al terminar, cada
+# ejecución caduca a los RESULT_FILES_TTL_SECONDS, como su informe (ver _purgar_sesiones)
 SESSIONS: Dict[str, Dict[str, Any]] = {}
-COMPLETED_FILES = {}  # process_id => "/tmp/... .xlsx" o "C:/temporal/..."
+# Motores de asignación disponibles (?motor=...)
+MOTORES_ASIGNACION = {
+    "memoria": run_assign_sap_orders_inmemory,  # bucle Python con índices en memoria (log por imputación)
+    "sql": run_assign_sap_orders_sql,           # una sola sentencia INSERT ... SELECT en PostgreSQL
+}
+
+# Las asignaciones corren en su propio hilo (no en el threadpool compartido de los
+# endpoints síncronos) y de una en una: en este proceso lo garantiza ASIGNACION_EN_CURSO;
+# entre procesos/servidores, el advisory lock que toma cada ejecución.
+EJECUTOR_ASIGNACION = ThreadPoolExecutor(max_workers=1, thread_name_prefix="asignacion_sap")
+ASIGNACION_EN_CURSO = threading.Lock()
 # ================== ENDPOINTS ===================
 
 
@@ -38,46 +62,86 @@ def list_pending_imputaciones(db: Session = Depends(get_db)):
     return get_imputaciones_pendientes(db)
 
 @router.get("/download")
-def download_sap_csv_zip(db: Session = Depends(get_db)):
+def download_sap_csv_zip(
+    max_filas: Optional[int] = Query(None, ge=0),
+    db: Session = Depends(get_db)
+):
     """
-    Genera un .zip con CSV + XLSX y lo devuelve.
+    Devuelve un .zip con CSV + XLSX. Si Tabla_Central no ha cambiado desde la última
+    generación (misma marca), se sirve el ZIP en caché; si no, se genera y envía por
+    trozos mientras se guarda para las siguientes descargas.
+    `max_filas` (por defecto MASS_UPLOAD_MAX_ROWS; 0 => sin límite) parte las filas en
+    varios CSV + XLSX de como mucho ese número de filas, con un manifiesto; no se
+    admiten valores por debajo de MASS_UPLOAD_MIN_ROWS.
     """
-    from app.services.generar_imputaciones_sap.generar_csv import generate_zip_with_csv_and_xlsx
-    zip_path = generate_zip_with_csv_and_xlsx(db)
-
-    if not zip_path or not os.path.exists(zip_path):
+    config = get_config()
+    if max_filas is None:
+        max_filas = config.MASS_UPLOAD_MAX_ROWS
+    elif 0 < max_filas < config.MASS_UPLOAD_MIN_ROWS:
+        raise HTTPException(
+            400, detail=f"max_filas debe ser 0 (sin partes) o al menos {config.MASS_UPLOAD_MIN_ROWS}."
+        )
+    marca = leer_marca(db)
+    cacheado = cache_mass_upload.obtener(marca, max_filas)   # si la marca ha cambiado, expulsa el anterior
+    if marca.pendientes == 0:
         raise HTTPException(404, detail="No se pudo generar el ZIP (quizá sin registros).")
-
-    return FileResponse(
-        path=zip_path,
-        filename=os.path.basename(zip_path),
-        media_type="application/octet-stream"
+    if cacheado:
+        path, download_name = cacheado
+        return FileResponse(path=path, filename=download_name, media_type="application/octet-stream")
+
+    nombre_base = nombre_mass_upload()
+    return StreamingResponse(
+        cache_mass_upload.stream(nombre_base, max_filas),
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{nombre_base}.zip"'}
     )
 
 
 @router.post("/start")
 def start_process_sap(
-    background_tasks: BackgroundTasks,
     force: bool = Query(False),
+    motor: str = Query("memoria"),
+    completo: bool = Query(False),
     db: Session = Depends(get_db)
 ):
+    if motor not in MOTORES_ASIGNACION:
+        raise HTTPException(400, detail=f"Motor '{motor}' no válido. Opciones: {', '.join(MOTORES_ASIGNACION)}")
+
     if not force:
         pending_count = db.query(TablaCentral).filter(TablaCentral.Cargado_SAP == False).count()
         if pending_count > 0:
+            # El motor SQL siempre recalcula completo; el de memoria, solo si se pide
+            if completo or motor == "sql":
+                consecuencia = "se eliminarán y podrían generar duplicados en SAP."
+            else:
+                consecuencia = ("se conservan las asignaciones existentes, pero las de imputaciones "
+                                "afectadas por SapOrders nuevas se eliminarán y reasignarán, y podrían "
+                                "generar duplicados en SAP.")
             raise HTTPException(
                 status_code=409,
                 detail={
-                    "message": f"Hay {pending_count} filas pendientes de respuesta SAP. Si continúas, se eliminarán y podrían generar duplicados en SAP.",
+                    "message": f"Hay {pending_count} filas pendientes de respuesta SAP. Si continúas, {consecuencia}",
                     "pending_count": pending_count
                 }
             )
 
+    if not ASIGNACION_EN_CURSO.acquire(blocking=False):
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Ya hay una asignación de SAP Orders en curso. Espera a que termine."}
+        )
+
+    _purgar_sesiones()
     process_id = str(uuid.uuid4())
     SESSIONS[process_id] = {
         "status": "in-progress",
-        "logs": [],
+        "logs": RegistroProgreso(process_id),
     }
-    background_tasks.add_task(_bg_assign_sap, process_id, db)
+    try:
+        EJECUTOR_ASIGNACION.submit(_bg_assign_sap, process_id, motor, completo)
+    except Exception:
+        ASIGNACION_EN_CURSO.release()
+        raise
     return {"process_id": process_id}
 
 
@@ -94,25 +158,38 @@ def cancel_process(process_id: str):
 
 @router.get("/events/{process_id}")
 async def sse_events(request: Request, process_id: str):
-    if process_id not in SESSIONS:
+    """
+    Envía los mensajes generales nuevos (por número de secuencia) y, cuando cambian,
+    los contadores en un evento `progress`. Las líneas de detalle por imputación no
+    se envían: están en /report/{process_id}.
+    """
+    session = SESSIONS.get(process_id)
+    if not session:
         raise HTTPException(404, detail="process_id no encontrado")
-    last_idx = 0
+    logs: RegistroProgreso = session["logs"]
+    last_seq = 0
+    last_version = -1
 
     async def event_generator():
-        nonlocal last_idx
+        nonlocal last_seq, last_version
         while True:
             if await request.is_disconnected():
                 break
 
-            session = SESSIONS[process_id]
-            logs = session["logs"]
+            eventos, last_seq = logs.eventos_desde(last_seq)
+            for _, _, mensaje in eventos:
+                yield f"event: message\ndata: {mensaje}\n\n"
 
-            while last_idx < len(logs):
-                yield f"event: message\ndata: {logs[last_idx]}\n\n"
-                last_idx += 1
+            version, contadores = logs.snapshot_contadores()
+            if version != last_version:
+                last_version = version
+                progreso = {"contadores": contadores, "detalle": logs.ultimos_detalles(5)}
+                yield f"event: progress\ndata: {json.dumps(progreso, ensure_ascii=False)}\n\n"
 
             if session["status"] in ["completed", "cancelled", "error"]:
-                final_data = logs[-1] if logs else ""
+                if session.get("summary"):
+                    yield f"event: summary\ndata: {json.dumps(session['summary'], ensure_ascii=False, default=str)}\n\n"
+                final_data = logs.ultimo()
                 if session["status"] == "completed":
                     mc = session.get("matched_count", 0)
                     final_data = f"{mc}"
@@ -124,32 +201,85 @@ async def sse_events(request: Request, process_id: str):
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 
+@router.get("/report/{process_id}")
+def download_report(process_id: str):
+    """
+    Informe completo de la ejecución (mensajes generales y una línea por imputación).
+    Disponible durante la ejecución y hasta que caduca (RESULT_FILES_TTL_SECONDS).
+    """
+    session = SESSIONS.get(process_id)
+    if session:
+        session["logs"].volcar()
+    informe = upload_store.result(clave_informe(process_id))
+    if not informe or not os.path.exists(informe[0]):
+        raise HTTPException(404, detail="Informe no encontrado o caducado")
+    path, download_name = informe
+    return FileResponse(path=path, filename=download_name, media_type="text/plain")
+
+
 # ================== BACKGROUND TASK ===================
 
-def _bg_assign_sap(process_id: str, db: Session):
+def _bg_assign_sap(process_id: str, motor: str = "memoria", completo: bool = False):
+    """
+    Ejecuta la asignación con una sesión propia (pool de trabajos), no la de la petición.
+    Se ejecuta en EJECUTOR_ASIGNACION y libera ASIGNACION_EN_CURSO al terminar.
+    """
     logs = SESSIONS[process_id]["logs"]
+    medidor = MedidorEtapas("asignacion_sap", process_id)
     try:
-        logs.append("Iniciando la asignación de SAP Orders en TablaCentral...")
+        with JobsSessionLocal() as db:
+            # Toda la ejecución es una transacción: el lock se libera con su commit/rollback
+            if not intentar_bloqueo_transaccion(db, CLAVE_ASIGNACION_SAP):
+                SESSIONS[process_id]["status"] = "error"
+                logs.error("⛔ Ya hay otra asignación de SAP Orders en curso (otro proceso o servidor). Inténtalo cuando termine.")
+                return
+
+            modo = "completo" if completo else "incremental"
+            logs.append(f"Iniciando la asignación de SAP Orders en TablaCentral (motor: {motor}, modo: {modo})...")
 
-        # Llamada principal
-        matched = run_assign_sap_orders_inmemory(db, logs)
+            # Llamada principal
+            cancelacion = TokenCancelacion(lambda: SESSIONS[process_id]["status"] == "cancelled")
+            matched = MOTORES_ASIGNACION[motor](db, logs, medidor, cancelacion, completo=completo)
 
         if matched and matched > 0:
             logs.append(f"✅ Proceso completado con {matched} asignaciones. Ya puedes descargar el ZIP.")
         else:
-            logs.append("⚠️ Proceso completado pero sin asignaciones. Revisa los logs para más detalle.")
+            logs.aviso("⚠️ Proceso completado pero sin asignaciones. Revisa el informe (/report) para más detalle.")
+        SESSIONS[process_id]["summary"] = medidor.finalizar("completed")
         SESSIONS[process_id]["status"] = "completed"
         SESSIONS[process_id]["matched_count"] = matched or 0
+        if matched:
+            # Deja el ZIP generado para la descarga; va detrás en la cola, así que nunca
+            # se solapa con otra asignación de este proceso
+            EJECUTOR_ASIGNACION.submit(cache_mass_upload.precalentar)
+
+    except ProcesoCancelado:
+        # El estado ya es 'cancelled' (lo fija /cancel); solo se registran las métricas
+        SESSIONS[process_id]["summary"] = medidor.finalizar("cancelled")
 
     except Exception as e:
+        SESSIONS[process_id]["summary"] = medidor.finalizar("error")
         SESSIONS[process_id]["status"] = "error"
         tb = traceback.format_exc()
-        logs.append(f"❌ Error en _bg_assign_sap: {str(e)}\n{tb}")
+        logs.error(f"❌ Error en _bg_assign_sap: {str(e)}")
+        logs.detalle(tb)
         print(f"[generar_imputaciones_sap] ERROR: {str(e)}\n{tb}", flush=True)
 
+    finally:
+        logs.cerrar()
+        SESSIONS[process_id]["expires"] = time.monotonic() + get_config().RESULT_FILES_TTL
+        ASIGNACION_EN_CURSO.release()
+
 
 # ================== HELPERS ===================
 
+def _purgar_sesiones():
+    """Quita de SESSIONS las ejecuciones terminadas cuyo plazo (el del informe) ha vencido."""
+    ahora = time.monotonic()
+    for pid, session in list(SESSIONS.items()):
+        if session.get("expires") is not None and session["expires"] <= ahora:
+            SESSIONS.pop(pid, None)
+
 def add_log(pid, msg):
     if pid in SESSIONS and SESSIONS[pid]["status"] == "in-progress":
         SESSIONS[pid]["logs"].append(msg)
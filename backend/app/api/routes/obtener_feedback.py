@@ -10,7 +10,11 @@ from fastapi import (
     File,
 )
 from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 from app.core.sse_manager import sse_manager
+from app.core.upload_store import upload_store
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado
 from io import BytesIO
 import pandas as pd, uuid, asyncio
 
@@ -18,11 +22,6 @@ from app.services.feedback.feedback_processor import procesar_feedback_completo
 
 router = APIRouter()
 
-# token -> { df, filename }
-VALIDATED_FEEDBACK = {}
-# process_id -> { path, download_name }
-TEMP_FILES = {}
-
 # ---------------------------------------------------------------------
 @router.post("/validate-file")
 async def validate_feedback_file(file: UploadFile = File(...)):
@@ -38,7 +37,7 @@ async def validate_feedback_file(file: UploadFile = File(...)):
         raise HTTPException(400, f"Error procesando el archivo: {e}")
 
     token = str(uuid.uuid4())
-    VALIDATED_FEEDBACK[token] = {"df": df, "filename": file.filename}
+    upload_store.save_frame(token, df, filename=file.filename)
     return {"message": "Archivo de feedback válido", "token": token}
 
 # ---------------------------------------------------------------------
@@ -47,18 +46,17 @@ async def start_feedback_process(
     token: str = Query(...),
     background_tasks: BackgroundTasks = None,
 ):
-    if token not in VALIDATED_FEEDBACK:
+    meta = upload_store.acquire(token)
+    if meta is None:
         raise HTTPException(400, "Token no encontrado o archivo no validado")
 
     process_id = str(uuid.uuid4())
     sse_manager.start_process(process_id)
 
-    payload = VALIDATED_FEEDBACK[token]
     background_tasks.add_task(
         long_running_feedback_task,
         process_id,
-        payload["df"],
-        payload["filename"],
+        meta["filename"],
         token,
     )
     return {"process_id": process_id}
@@ -92,33 +90,51 @@ async def cancel_feedback_process(process_id: str):
 # ---------------------------------------------------------------------
 @router.get("/download/{process_id}")
 async def download_feedback_file(process_id: str):
-    if process_id not in TEMP_FILES:
+    resultado = upload_store.result(process_id)
+    if resultado is None:
         raise HTTPException(404, "Archivo no encontrado")
 
-    info = TEMP_FILES.pop(process_id)   # elimina después de servir
-    return FileResponse(info["path"], filename=info["download_name"])
+    path, download_name = resultado
+    # elimina después de servir
+    return FileResponse(
+        path,
+        filename=download_name,
+        background=BackgroundTask(upload_store.discard_result, process_id),
+    )
 
 # ---------------------------------------------------------------------
-async def long_running_feedback_task(
+# Función síncrona: BackgroundTasks la ejecuta en el threadpool, así el bucle de
+# eventos sigue atendiendo /events y /cancel mientras se procesa.
+def long_running_feedback_task(
     process_id: str,
-    df: pd.DataFrame,
     original_filename: str,
     token: str,
 ):
+    medidor = MedidorEtapas("feedback", process_id)
     try:
+        df = upload_store.load_frame(token)
+        if df is None:
+            raise ValueError("El archivo validado ha caducado o fue descartado")
         sse_manager.send_message(
             process_id, f"📄 Procesando archivo con {len(df)} filas…"
         )
 
         path, download_name = procesar_feedback_completo(
-            df, process_id, original_filename
+            df, process_id, original_filename, medidor,
+            TokenCancelacion.para_proceso_sse(process_id),
         )
-        TEMP_FILES[process_id] = {"path": path, "download_name": download_name}
+        upload_store.save_result(process_id, path, download_name)
+
+        sse_manager.send_summary(process_id, medidor.finalizar("completed"))
 
         sse_manager.mark_completed(
             process_id, "✅ Feedback procesado. Listo para descargar."
         )
+    except ProcesoCancelado:
+        medidor.finalizar("cancelled")
+        print(f"[obtener_feedback] Proceso {process_id} cancelado.")
     except Exception as e:
+        sse_manager.send_summary(process_id, medidor.finalizar("error"))
         sse_manager.mark_error(process_id, f"❌ Error: {e}")
     finally:
-        VALIDATED_FEEDBACK.pop(token, None)
+        upload_store.discard(token)
@@ -0,0 +1,40 @@
+# PATH: backend/app/core/cancelacion.py
+
+from typing import Callable, Optional
+
+from app.core.sse_manager import sse_manager
+
+
+class ProcesoCancelado(Exception):
+    """El usuario canceló el proceso; se lanza en el siguiente punto de control."""
+
+
+class TokenCancelacion:
+    """
+    Token de cancelación cooperativa que se pasa a los servicios de larga duración.
+    No guarda estado propio: consulta el flag que ya mantienen las rutas
+    (sse_manager o el dict SESSIONS), así que `/cancel/{process_id}` no cambia.
+    Los servicios llaman a `comprobar()` entre filas / lotes / bloques.
+    """
+
+    def __init__(self, esta_cancelado: Optional[Callable[[], bool]] = None):
+        self._esta_cancelado = esta_cancelado
+
+    @classmethod
+    def para_proceso_sse(cls, process_id: str) -> "TokenCancelacion":
+        def esta_cancelado():
+            state = sse_manager.get_state(process_id)
+            return bool(state and state["cancelled"])
+        return cls(esta_cancelado)
+
+    @property
+    def cancelado(self) -> bool:
+        return self._esta_cancelado is not None and self._esta_cancelado()
+
+    def comprobar(self):
+        if self.cancelado:
+            raise ProcesoCancelado("Proceso cancelado por el usuario")
+
+
+# Token que nunca se cancela (valor por defecto de los servicios)
+SIN_CANCELACION = TokenCancelacion()
@@ -10,6 +10,27 @@ class Config:
         self.POSTGRES_SERVER = os.getenv("POSTGRES_SERVER", "localhost")
         self.POSTGRES_PORT = os.getenv("POSTGRES_PORT", "5432")
         self.POSTGRES_DB = os.getenv("POSTGRES_DB", "mydatabase")
+        # Nº de imputaciones por INSERT/commit en la carga de imputaciones
+        self.IMPUTACIONES_BATCH_SIZE = int(os.getenv("IMPUTACIONES_BATCH_SIZE", "1000"))
+        # Filas por bloque al leer/transformar/cargar Excels de imputaciones
+        self.IMPUTACIONES_CHUNK_ROWS = int(os.getenv("IMPUTACIONES_CHUNK_ROWS", "20000"))
+        # Segundos que se reutiliza la caché de Extraciclos sin releer la tabla
+        self.EXTRACICLOS_CACHE_TTL = float(os.getenv("EXTRACICLOS_CACHE_TTL", "300"))
+        # Almacén de subidas validadas: directorio de spool (vacío => directorio temporal del sistema),
+        # presupuesto de memoria para DataFrames y caducidad de tokens / ficheros de resultado
+        self.UPLOAD_STORE_DIR = os.getenv("UPLOAD_STORE_DIR", "")
+        self.UPLOAD_STORE_MAX_MEMORY_MB = int(os.getenv("UPLOAD_STORE_MAX_MEMORY_MB", "256"))
+        self.UPLOAD_STORE_TTL = float(os.getenv("UPLOAD_STORE_TTL_SECONDS", "3600"))
+        self.RESULT_FILES_TTL = float(os.getenv("RESULT_FILES_TTL_SECONDS", "86400"))
+        # Pool de conexiones propio de los trabajos largos en segundo plano (asignación SAP)
+        self.JOBS_DB_POOL_SIZE = int(os.getenv("JOBS_DB_POOL_SIZE", "2"))
+        self.JOBS_DB_MAX_OVERFLOW = int(os.getenv("JOBS_DB_MAX_OVERFLOW", "1"))
+        self.JOBS_DB_POOL_RECYCLE = int(os.getenv("JOBS_DB_POOL_RECYCLE_SECONDS", "1800"))
+        # Carga masiva SAP: máximo de filas por CSV/XLSX (0 => un solo fichero), mínimo
+        # admitido para ese máximo y nº de procesos que generan las partes en paralelo
+        self.MASS_UPLOAD_MAX_ROWS = int(os.getenv("MASS_UPLOAD_MAX_ROWS", "0"))
+        self.MASS_UPLOAD_MIN_ROWS = int(os.getenv("MASS_UPLOAD_MIN_ROWS", "10000"))
+        self.MASS_UPLOAD_WORKERS = int(os.getenv("MASS_UPLOAD_WORKERS", "4"))
 
     def get_connection_string(self):
         return (
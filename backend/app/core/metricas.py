@@ -0,0 +1,150 @@
+# PATH: backend/app/core/metricas.py
+
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Contador de sentencias SQL de la etapa activa en el contexto actual (hilo / tarea)
+_sentencias_sql: ContextVar[Optional[list]] = ContextVar("sentencias_sql", default=None)
+# Marca de fin para MedidorEtapas.iterar
+_FIN = object()
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _contar_sentencia(conn, cursor, statement, parameters, context, executemany):
+    contador = _sentencias_sql.get()
+    if contador is not None:
+        contador[0] += 1
+
+
+class Etapa:
+    """Acumulado de una etapa (puede medirse varias veces, p. ej. una vez por bloque)."""
+
+    def __init__(self, nombre: str):
+        self.nombre = nombre
+        self.segundos = 0.0
+        self.filas_entrada = None
+        self.filas_salida = None
+        self.sentencias_sql = 0
+        self.llamadas = 0
+
+    def sumar_filas(self, entrada: Optional[int] = None, salida: Optional[int] = None):
+        if entrada is not None:
+            self.filas_entrada = (self.filas_entrada or 0) + entrada
+        if salida is not None:
+            self.filas_salida = (self.filas_salida or 0) + salida
+
+    def a_dict(self) -> dict:
+        filas = self.filas_entrada if self.filas_entrada is not None else self.filas_salida
+        return {
+            "etapa": self.nombre,
+            "segundos": round(self.segundos, 3),
+            "filas_entrada": self.filas_entrada,
+            "filas_salida": self.filas_salida,
+            "filas_por_segundo": round(filas / self.segundos, 1) if filas and self.segundos > 0 else None,
+            "sentencias_sql": self.sentencias_sql,
+            "llamadas": self.llamadas,
+        }
+
+
+class _MedicionEnCurso:
+    """Lo que recibe el `with`: permite anotar las filas de esta medición."""
+
+    def __init__(self):
+        self.filas_entrada = None
+        self.filas_salida = None
+
+
+class MedidorEtapas:
+    """
+    Cronómetro por etapas de un proceso en segundo plano.
+    - `etapa(nombre)` mide tiempo de pared, filas de entrada/salida y nº de sentencias SQL.
+    - `iterar(nombre, iterable)` mide el tiempo de producir cada elemento (p. ej. lectura por bloques).
+    - `finalizar(estado)` devuelve el resumen y lo guarda en Metricas_Procesos.
+    """
+
+    def __init__(self, pipeline: str, process_id: Optional[str] = None):
+        self.pipeline = pipeline
+        self.process_id = process_id
+        self.etapas = {}
+        self._inicio = time.perf_counter()
+
+    def _etapa(self, nombre: str) -> Etapa:
+        if nombre not in self.etapas:
+            self.etapas[nombre] = Etapa(nombre)
+        return self.etapas[nombre]
+
+    @contextmanager
+    def etapa(self, nombre: str, filas_entrada: Optional[int] = None) -> Iterator[_MedicionEnCurso]:
+        medicion = _MedicionEnCurso()
+        medicion.filas_entrada = filas_entrada
+        contador_padre = _sentencias_sql.get()
+        contador = [0]
+        token = _sentencias_sql.set(contador)
+        inicio = time.perf_counter()
+        try:
+            yield medicion
+        finally:
+            segundos = time.perf_counter() - inicio
+            _sentencias_sql.reset(token)
+            if contador_padre is not None:
+                # Las sentencias de una etapa anidada también cuentan para la etapa que la contiene
+                contador_padre[0] += contador[0]
+            acumulado = self._etapa(nombre)
+            acumulado.segundos += segundos
+            acumulado.sentencias_sql += contador[0]
+            acumulado.llamadas += 1
+            acumulado.sumar_filas(medicion.filas_entrada, medicion.filas_salida)
+
+    def iterar(self, nombre: str, iterable: Iterable):
+        """Recorre `iterable` cronometrando cada `next()`; las filas son len(elemento)."""
+        iterador = iter(iterable)
+        while True:
+            with self.etapa(nombre) as medicion:
+                elemento = next(iterador, _FIN)
+                if elemento is not _FIN:
+                    medicion.filas_salida = len(elemento)
+            if elemento is _FIN:
+                return
+            yield elemento
+
+    def resumen(self, estado: str = "completed") -> dict:
+        return {
+            "pipeline": self.pipeline,
+            "process_id": self.process_id,
+            "estado": estado,
+            "segundos_totales": round(time.perf_counter() - self._inicio, 3),
+            "etapas": [e.a_dict() for e in self.etapas.values()],
+        }
+
+    def finalizar(self, estado: str = "completed", persistir: bool = True) -> dict:
+        """Cierra la medición y guarda el resumen (un fallo al guardar no afecta al proceso)."""
+        resumen = self.resumen(estado)
+        if persistir:
+            try:
+                _guardar_resumen(resumen)
+            except Exception as e:
+                print(f"[metricas] No se pudo guardar el resumen de {self.pipeline}: {e}\n{traceback.format_exc()}")
+        return resumen
+
+
+def _guardar_resumen(resumen: dict):
+    from app.db.session import database_session
+    from app.models.models import MetricasProcesos
+
+    with database_session as db:
+        db.add(MetricasProcesos(
+            ProcessId=resumen["process_id"],
+            Pipeline=resumen["pipeline"],
+            Estado=resumen["estado"],
+            SegundosTotales=resumen["segundos_totales"],
+            Etapas=resumen["etapas"],
+            TimestampInput=datetime.now(timezone.utc),
+        ))
+        db.commit()
@@ -0,0 +1,122 @@
+# PATH: backend/app/core/registro_progreso.py
+
+import os
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.core.upload_store import upload_store
+
+NIVEL_DETALLE = "detalle"
+NIVEL_INFO = "info"
+NIVEL_AVISO = "aviso"
+NIVEL_ERROR = "error"
+
+
+class RegistroProgreso:
+    """
+    Log de progreso de un proceso largo con memoria acotada, independiente del tamaño
+    de la ejecución:
+      - Mensajes generales (info / aviso / error) en un buffer circular de
+        `max_eventos` con número de secuencia, para que el SSE envíe solo lo nuevo.
+      - Líneas de detalle (una por fila procesada): solo las `max_detalles` últimas
+        en memoria; todas se vuelcan al informe descargable.
+      - Contadores agregados (asignadas, descartadas por motivo...) que se actualizan
+        en el sitio y se envían por SSE como un único evento.
+    El informe completo (todos los niveles) se escribe en un fichero del spool de
+    `upload_store`, registrado como resultado `clave_informe(process_id)` (caduca con
+    RESULT_FILES_TTL_SECONDS).
+
+    Mantiene `append(str)` para que el código que escribía en una lista siga funcionando.
+    """
+
+    def __init__(self, process_id: str, max_eventos: int = 500, max_detalles: int = 200):
+        self.process_id = process_id
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._eventos = deque(maxlen=max_eventos)     # (seq, nivel, mensaje)
+        self._detalles = deque(maxlen=max_detalles)   # mensajes
+        self.contadores: Dict[str, int] = {}
+        self.version_contadores = 0
+        self._ruta_informe = os.path.join(upload_store.spool_dir, f"informe_{process_id}.txt")
+        self._informe = open(self._ruta_informe, "w", encoding="utf-8")
+        upload_store.save_result(clave_informe(process_id), self._ruta_informe, f"informe_asignacion_{process_id}.txt")
+
+    # ---------- Escritura ----------
+    def append(self, mensaje: str):
+        self.info(mensaje)
+
+    def info(self, mensaje: str):
+        self._registrar(NIVEL_INFO, mensaje)
+
+    def aviso(self, mensaje: str):
+        self._registrar(NIVEL_AVISO, mensaje)
+
+    def error(self, mensaje: str):
+        self._registrar(NIVEL_ERROR, mensaje)
+
+    def detalle(self, mensaje: str):
+        with self._lock:
+            self._detalles.append(mensaje)
+            self._escribir_informe(NIVEL_DETALLE, mensaje)
+
+    def contar(self, clave: str, n: int = 1):
+        with self._lock:
+            self.contadores[clave] = self.contadores.get(clave, 0) + n
+            self.version_contadores += 1
+
+    def fijar(self, clave: str, valor: int):
+        with self._lock:
+            self.contadores[clave] = valor
+            self.version_contadores += 1
+
+    def cerrar(self):
+        """Cierra el informe; se puede seguir descargando hasta que caduque."""
+        with self._lock:
+            if not self._informe.closed:
+                self._informe.close()
+
+    # ---------- Lectura ----------
+    def eventos_desde(self, seq: int) -> Tuple[List[Tuple[int, str, str]], int]:
+        """
+        Mensajes generales con secuencia > `seq` y el último número de secuencia.
+        Si el cliente se ha quedado atrás más que el buffer, recibe solo los que quedan.
+        """
+        with self._lock:
+            return [e for e in self._eventos if e[0] > seq], self._seq
+
+    def ultimos_detalles(self, n: Optional[int] = None) -> List[str]:
+        with self._lock:
+            detalles = list(self._detalles)
+        return detalles[-n:] if n else detalles
+
+    def ultimo(self) -> str:
+        with self._lock:
+            return self._eventos[-1][2] if self._eventos else ""
+
+    def snapshot_contadores(self) -> Tuple[int, Dict[str, int]]:
+        with self._lock:
+            return self.version_contadores, dict(self.contadores)
+
+    def volcar(self):
+        """Vuelca a disco lo escrito hasta ahora (para descargar el informe en curso)."""
+        with self._lock:
+            if not self._informe.closed:
+                self._informe.flush()
+
+    # ---------- Internos ----------
+    def _registrar(self, nivel: str, mensaje: str):
+        with self._lock:
+            self._seq += 1
+            self._eventos.append((self._seq, nivel, mensaje))
+            self._escribir_informe(nivel, mensaje)
+
+    def _escribir_informe(self, nivel: str, mensaje: str):
+        if not self._informe.closed:
+            self._informe.write(f"{datetime.now():%H:%M:%S} [{nivel}] {mensaje}\n")
+
+
+def clave_informe(process_id: str) -> str:
+    """Clave del informe en upload_store (los resultados se indexan por process_id)."""
+    return f"{process_id}:informe"
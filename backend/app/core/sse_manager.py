@@ -1,6 +1,7 @@
 # PATH: backend/app/core/sse_manager.py
 
 import asyncio
+import json
 from collections import defaultdict, deque
 
 class SSEManager:
@@ -34,6 +35,12 @@ class SSEManager:
             # Añadimos un evento con tipo 'message'
             state["queue"].append(("message", message))
 
+    def send_summary(self, process_id: str, summary: dict):
+        """Push del resumen estructurado (JSON) del proceso; se envía antes del evento final."""
+        state = self.process_states.get(process_id)
+        if state:
+            state["queue"].append(("summary", json.dumps(summary, ensure_ascii=False, default=str)))
+
     def mark_completed(self, process_id: str, message: str = "Proceso completado", result_file: str = None):
         """Marca el proceso como completado y notifica por SSE."""
         state = self.process_states.get(process_id)
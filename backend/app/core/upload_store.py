@@ -0,0 +1,230 @@
+# PATH: backend/app/core/upload_store.py
+
+import os
+import re
+import fcntl
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow.feather as feather
+
+from app.core.config import get_config
+
+# Fichero de cada spool sobre el que su proceso mantiene un flock mientras vive
+LOCK_SPOOL = ".lock"
+# Nombre de los spools que crea UploadStore ("<pid>_<uuid8>"): la limpieza no toca nada más
+PATRON_SPOOL = re.compile(r"\d+_[0-9a-f]{8}")
+
+
+class UploadStore:
+    """
+    Almacén compartido de subidas validadas (token) y ficheros de resultado (process_id).
+    - Los DataFrames se vuelcan a un fichero Feather/Arrow en el spool y se releen
+      con memory_map; en memoria solo se conservan mientras quepan en el presupuesto
+      global (`max_memory_bytes`), expulsando el menos usado recientemente (LRU).
+    - Los ficheros subidos y los de resultado se guardan en el spool.
+    - Cada token caduca a los `ttl` segundos y cada resultado a los `result_ttl`
+      salvo que esté en uso (acquire). La limpieza se hace en cada operación.
+    """
+
+    def __init__(self, base_dir: str, max_memory_bytes: int, ttl: float, result_ttl: float):
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self._lock = threading.RLock()
+        # token -> { path, kind, meta, expires, in_use }
+        self._entries = {}
+        # token -> (DataFrame, bytes) en orden LRU
+        self._frames = OrderedDict()
+        self._frames_bytes = 0
+        # process_id -> { path, download_name, expires }
+        self._results = {}
+
+        # Un subdirectorio por arranque de proceso (pid + uuid: en un contenedor el pid
+        # se repite en cada reinicio). Mientras el proceso vive mantiene un flock sobre
+        # su fichero LOCK_SPOOL; los de procesos que ya no existen se borran al arrancar.
+        self.spool_dir = os.path.join(base_dir, f"{os.getpid()}_{uuid.uuid4().hex[:8]}")
+        os.makedirs(self.spool_dir)
+        self._lock_spool = open(os.path.join(self.spool_dir, LOCK_SPOOL), "w")
+        fcntl.flock(self._lock_spool, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._limpiar_spools_antiguos(base_dir)
+
+    # ---------- Subidas validadas ----------
+    def save_frame(self, token: str, df: pd.DataFrame, **meta):
+        """Guarda un DataFrame validado (spool Feather + caché en memoria)."""
+        path = os.path.join(self.spool_dir, f"{token}.feather")
+        feather.write_feather(
+            df.reset_index(drop=True).rename(columns=str), path, compression="uncompressed"
+        )
+        with self._lock:
+            self._purge()
+            self._entries[token] = {
+                "path": path, "kind": "frame", "meta": meta,
+                "expires": time.monotonic() + self.ttl, "in_use": False,
+            }
+            self._cache_frame(token, df)
+
+    def save_file(self, token: str, src_path: str, **meta):
+        """Mueve un fichero subido al spool y lo asocia al token."""
+        path = os.path.join(self.spool_dir, f"{token}{os.path.splitext(src_path)[1]}")
+        shutil.move(src_path, path)
+        with self._lock:
+            self._purge()
+            self._entries[token] = {
+                "path": path, "kind": "file", "meta": meta,
+                "expires": time.monotonic() + self.ttl, "in_use": False,
+            }
+
+    def save_meta(self, token: str, **meta):
+        """Registra un token sin datos asociados (p. ej. un fichero ya procesado)."""
+        with self._lock:
+            self._purge()
+            self._entries[token] = {
+                "path": None, "kind": "meta", "meta": meta,
+                "expires": time.monotonic() + self.ttl, "in_use": False,
+            }
+
+    def __contains__(self, token: str) -> bool:
+        with self._lock:
+            self._purge()
+            return token in self._entries
+
+    def acquire(self, token: str):
+        """Marca el token como en uso (no caduca hasta `discard`). Devuelve su meta o None."""
+        with self._lock:
+            self._purge()
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            entry["in_use"] = True
+            return entry["meta"]
+
+    def load_frame(self, token: str):
+        """Devuelve el DataFrame del token (de memoria o del spool) o None."""
+        with self._lock:
+            self._purge()
+            entry = self._entries.get(token)
+            if entry is None or entry["kind"] != "frame":
+                return None
+            if token in self._frames:
+                self._frames.move_to_end(token)
+                return self._frames[token][0]
+            path = entry["path"]
+
+        df = feather.read_table(path, memory_map=True).to_pandas()
+        with self._lock:
+            if token in self._entries:
+                self._cache_frame(token, df)
+        return df
+
+    def file_path(self, token: str):
+        with self._lock:
+            self._purge()
+            entry = self._entries.get(token)
+            return entry["path"] if entry else None
+
+    def discard(self, token: str) -> bool:
+        """Elimina el token, su fichero de spool y su copia en memoria."""
+        with self._lock:
+            entry = self._entries.pop(token, None)
+            self._uncache_frame(token)
+        if entry is None:
+            return False
+        self._remove_file(entry["path"])
+        return True
+
+    # ---------- Ficheros de resultado ----------
+    def save_result(self, process_id: str, path: str, download_name: str = None):
+        with self._lock:
+            self._purge()
+            self._results[process_id] = {
+                "path": path,
+                "download_name": download_name or os.path.basename(path),
+                "expires": time.monotonic() + self.result_ttl,
+            }
+
+    def result(self, process_id: str):
+        """Devuelve (path, download_name) o None si no existe o ha caducado."""
+        with self._lock:
+            self._purge()
+            info = self._results.get(process_id)
+            return (info["path"], info["download_name"]) if info else None
+
+    def discard_result(self, process_id: str):
+        with self._lock:
+            info = self._results.pop(process_id, None)
+        if info:
+            self._remove_file(info["path"])
+
+    # ---------- Internos ----------
+    def _cache_frame(self, token, df):
+        self._uncache_frame(token)
+        size = int(df.memory_usage(deep=True).sum())
+        if size > self.max_memory_bytes:
+            return
+        self._frames[token] = (df, size)
+        self._frames_bytes += size
+        while self._frames_bytes > self.max_memory_bytes:
+            _, (_, old_size) = self._frames.popitem(last=False)
+            self._frames_bytes -= old_size
+
+    def _uncache_frame(self, token):
+        cached = self._frames.pop(token, None)
+        if cached:
+            self._frames_bytes -= cached[1]
+
+    def _purge(self):
+        now = time.monotonic()
+        for token in [t for t, e in self._entries.items() if e["expires"] <= now and not e["in_use"]]:
+            entry = self._entries.pop(token)
+            self._uncache_frame(token)
+            self._remove_file(entry["path"])
+        for process_id in [p for p, r in self._results.items() if r["expires"] <= now]:
+            self._remove_file(self._results.pop(process_id)["path"])
+
+    @staticmethod
+    def _remove_file(path):
+        if path is None:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _limpiar_spools_antiguos(self, base_dir):
+        """
+        Borra los spools de procesos que ya no existen (su flock está libre). Los de
+        otros workers vivos no se tocan. Un spool sin LOCK_SPOOL (un worker que aún lo
+        está creando) solo se borra si es más antiguo que el TTL. UPLOAD_STORE_DIR puede
+        ser un directorio compartido: solo se consideran los nombres con PATRON_SPOOL.
+        """
+        limite = time.time() - max(self.ttl, self.result_ttl)
+        for nombre in os.listdir(base_dir):
+            ruta = os.path.join(base_dir, nombre)
+            if ruta == self.spool_dir or not PATRON_SPOOL.fullmatch(nombre) or not os.path.isdir(ruta):
+                continue
+            try:
+                with open(os.path.join(ruta, LOCK_SPOOL), "r+") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except FileNotFoundError:
+                if os.path.getmtime(ruta) >= limite:
+                    continue
+            except BlockingIOError:
+                continue   # su proceso sigue vivo
+            shutil.rmtree(ruta, ignore_errors=True)
+
+
+config = get_config()
+
+# Instancia global de UploadStore
+upload_store = UploadStore(
+    base_dir=config.UPLOAD_STORE_DIR or os.path.join(tempfile.gettempdir(), "upload_store"),
+    max_memory_bytes=config.UPLOAD_STORE_MAX_MEMORY_MB * 1024 * 1024,
+    ttl=config.UPLOAD_STORE_TTL,
+    result_ttl=config.RESULT_FILES_TTL,
+)
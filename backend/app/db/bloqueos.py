@@ -0,0 +1,25 @@
+# PATH: backend/app/db/bloqueos.py
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+# Claves de advisory locks de PostgreSQL (bigint arbitrario, único por tipo de trabajo)
+CLAVE_ASIGNACION_SAP = 7_211_001
+CLAVE_CARGA_SAP_ORDERS = 7_211_002
+
+
+def intentar_bloqueo_transaccion(db: Session, clave: int) -> bool:
+    """
+    Intenta tomar un advisory lock de transacción (`pg_try_advisory_xact_lock`) sin esperar.
+    Devuelve False si otra conexión (de este u otro proceso/servidor) ya lo tiene.
+    Se libera solo al hacer commit o rollback de la transacción actual de `db`.
+    """
+    return bool(db.execute(text("SELECT pg_try_advisory_xact_lock(:clave)"), {"clave": clave}).scalar())
+
+
+def bloquear_transaccion(db: Session, clave: int):
+    """
+    Toma un advisory lock de transacción (`pg_advisory_xact_lock`), esperando si otra
+    conexión lo tiene. Se libera al hacer commit o rollback.
+    """
+    db.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": clave})
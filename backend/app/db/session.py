@@ -10,6 +10,18 @@ engine = create_engine(config.get_connection_string())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 session = scoped_session(SessionLocal)
 
+# Engine aparte para los trabajos largos en segundo plano (asignación SAP): su pool no
+# compite con el de las peticiones, comprueba la conexión antes de usarla (un trabajo
+# puede llegar tras un rato sin actividad) y la recicla periódicamente.
+jobs_engine = create_engine(
+    config.get_connection_string(),
+    pool_size=config.JOBS_DB_POOL_SIZE,
+    max_overflow=config.JOBS_DB_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=config.JOBS_DB_POOL_RECYCLE,
+)
+JobsSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=jobs_engine)
+
 # generador que crea una nueva sesión cuando se invoca y la cierra cuando ya no se necesita. Al usar scoped_session, garantizas que la sesión será única por cada hilo o solicitud, lo que es útil para aplicaciones web.
 
 def get_db():
@@ -1,6 +1,6 @@
 # PATH: backend/app/models/models.py
 
-from sqlalchemy import Column, Integer, String, Float, Date, Boolean, ForeignKey, event, DateTime
+from sqlalchemy import Column, Integer, String, Float, Date, Boolean, ForeignKey, event, DateTime, JSON, UniqueConstraint
 from datetime import datetime, timezone
 from sqlalchemy.dialects.postgresql import BIGINT
 from sqlalchemy.ext.declarative import declarative_base
@@ -19,6 +19,8 @@ class Imputaciones(Base):
     Proyecto = Column(String(255), ForeignKey('Projects_Dictionary.ProyectoBaan'))
     TipoCoche = Column(String)
     NumCoche = Column(String)
+    # NumCoche como entero (imputaciones_utils.num_coche_entero); NULL si vacío o no numérico
+    NumCocheInt = Column(BIGINT, nullable=True)
     CentroTrabajo = Column(String(32))
     Tarea = Column(String)
     TareaAsoc = Column(String)
@@ -28,6 +30,11 @@ class Imputaciones(Base):
     TipoImput = Column(String(2), ForeignKey("TiposOrdenes.TipoOrden"), nullable=True)
     AreaTarea = Column(String(64), ForeignKey('Extraciclos.AreaTarea'), nullable=True)
     area_id = Column(String(32), ForeignKey('Areas.CentroTrabajo'))
+    # Huella de la clave natural (ver services/utils/imputaciones_utils.calcular_fingerprint)
+    Fingerprint = Column(String(64), nullable=True, index=True)
+    # Max(Sap_Orders.ID) con el que se resolvió por última vez la asignación SAP
+    # (asignada o descartada). NULL = nunca resuelta. Ver assign_sap_orders (modo incremental).
+    SapOrdersVersion = Column(BIGINT, nullable=True)
 
     # Relaciones
     tabla_central = relationship("TablaCentral", uselist=False, back_populates="imputacion")
@@ -55,6 +62,9 @@ class SapOrders(Base):
     TipoIndirecto = Column(String)
     TipoMotivo = Column(String)
     ActiveOrder = Column(Boolean, default=True)
+    # Fila vigente de su clave (Project, Vertice, CarNumber, OperationActivity): la activa más
+    # reciente. La mantiene sap_etl_utils.actualizar_vigencia_sap_orders (índice único parcial)
+    IsCurrent = Column(Boolean, nullable=False, default=False)
     TimestampInput = Column(DateTime, nullable=True, default=lambda: datetime.now(timezone.utc))
 
     # Relaciones
@@ -74,6 +84,8 @@ class TablaCentral(Base):
   Operation = Column(String)
   OperationActivity = Column(String)
   Hours = Column(Float)
+  # Hours en centésimas enteras (imputaciones_utils.horas_centesimas): clave de cruce con la respuesta SAP
+  HoursCent = Column(Integer, nullable=True)
   Cargado_SAP = Column(Boolean, default=False)
   TimestampInput = Column(DateTime, nullable=True, default=lambda: datetime.now(timezone.utc))
 
@@ -126,3 +138,26 @@ class TiposOrdenes(Base):
     # Relación con SapOrders (1:N)
     sap_orders = relationship("SapOrders", back_populates="tipo_orden", lazy="select")
 
+class UploadsProcesados(Base):
+    __tablename__ = "Uploads_Procesados"
+    __table_args__ = (
+        UniqueConstraint("Pipeline", "Hash", name="uq_Uploads_Procesados_Pipeline_Hash"),
+    )
+
+    ID = Column(BIGINT, primary_key=True, index=True)
+    Pipeline = Column(String(32), nullable=False)  # Ej: 'tareas_sap', 'imputaciones', 'respuesta_sap'
+    Hash = Column(String(64), nullable=False)      # SHA-256 (hex) de los bytes del fichero subido
+    Filename = Column(String(255))
+    Summary = Column(JSON)                         # Resultado del último procesamiento
+    TimestampInput = Column(DateTime, nullable=True, default=lambda: datetime.now(timezone.utc))
+
+class MetricasProcesos(Base):
+    __tablename__ = "Metricas_Procesos"
+
+    ID = Column(BIGINT, primary_key=True, index=True)
+    ProcessId = Column(String(64), index=True)
+    Pipeline = Column(String(32), nullable=False)  # Ej: 'imputaciones', 'tareas_sap', 'asignacion_sap'...
+    Estado = Column(String(16))                    # completed / error / cancelled
+    SegundosTotales = Column(Float)
+    Etapas = Column(JSON)                          # Lista de etapas (ver app/core/metricas.py)
+    TimestampInput = Column(DateTime, nullable=True, default=lambda: datetime.now(timezone.utc))
@@ -1,27 +1,27 @@
 # PATH: backend/app/services/etl_inmemory/_load_datos_excel.py
 
+import hashlib
+
 import pandas as pd
-from app.models.models import Extraciclos
+from sqlalchemy import func
+from app.models.models import Imputaciones
+from app.services.utils.imputaciones_utils import calcular_fingerprint, num_coche_entero, intercambiar_tareas as _intercambiar_tareas
+from app.services.utils.extraciclos_cache import extraciclos_cache
 
-def intercambiar_tareas(df):
-    # Intercambiar valores de 'Tarea' y 'TareaAsoc' solo si 'TareaAsoc' no está en blanco ni es nulo
-    for index, row in df.iterrows():
-        if pd.notna(row['TareaAsoc']) and row['TareaAsoc'] != '':
-            # Asegúrate de que 'TareaAsoc' sea una cadena antes de llamar a replace
-            tarea_asoc_str = str(row['TareaAsoc'])
-            tarea_asoc_str = tarea_asoc_str.replace('.0', '')
-            row['TareaAsoc'] = tarea_asoc_str
-            # Intercambio de valores
-            df.at[index, 'Tarea'], df.at[index, 'TareaAsoc'] = row['TareaAsoc'], row['Tarea']
+# Columnas que identifican una imputación (mismo orden que la agrupación de duplicados)
+COLUMNAS_CLAVE = ['CodEmpleado', 'FechaImp', 'Timpu', 'Horas', 'Proyecto', 'TipoCoche', 'NumCoche', 'CentroTrabajo', 'Tarea', 'TareaAsoc', 'TipoMotivo', 'TipoIndirecto']
 
-    return df
+def intercambiar_tareas(df):
+    # Intercambiar valores de 'Tarea' y 'TareaAsoc' solo si 'TareaAsoc' no está en blanco ni es nulo,
+    # quitando los '.0' de 'TareaAsoc' antes del intercambio
+    return _intercambiar_tareas(df, quitar_decimal=True)
 
 
 def verificar_duplicados(df):
     # Asegurarse de que los NaN no afecten la agrupación, reemplazándolos con un valor temporal
     # Esto es opcional y depende de si esperas NaN en tus columnas clave
     # Si decides reemplazar NaN, asegúrate de usar un valor que no se encuentre en tus datos
-    cols = ['CodEmpleado', 'FechaImp', 'Timpu', 'Horas', 'Proyecto', 'TipoCoche', 'NumCoche', 'CentroTrabajo', 'Tarea', 'TareaAsoc', 'TipoMotivo', 'TipoIndirecto']
+    cols = COLUMNAS_CLAVE
     df_temp = df.fillna('ValorTemporalParaNaN')
 
     # Ahora realiza el conteo de duplicados
@@ -37,8 +37,93 @@ def verificar_duplicados(df):
     return df
 
 
+def _valor_clave(valor):
+    # NaN/NaT se tratan como NULL para que la clave sea hashable y comparable
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    return valor
+
+
+def clave_natural(row):
+    """
+    Tupla con los valores de COLUMNAS_CLAVE de una fila (Series o dict).
+    None equivale a NULL, igual que en el filtro `columna == None` de SQLAlchemy.
+    """
+    return tuple(_valor_clave(row.get(col)) for col in COLUMNAS_CLAVE)
+
+
+def huella_clave(clave):
+    """Resumen compacto (16 bytes) de una clave natural, para contar claves de ficheros grandes."""
+    return hashlib.blake2b(repr(clave).encode('utf-8'), digest_size=16).digest()
+
+
+def acumular_conteos_claves(df, conteos):
+    """Suma a `conteos` ({huella_clave: n}) las claves naturales de las filas de df."""
+    for _, row in df.iterrows():
+        huella = huella_clave(clave_natural(row))
+        conteos[huella] = conteos.get(huella, 0) + 1
+    return conteos
+
+
+def cargar_conteos_existentes(df, session, tamano_consulta=1000):
+    """
+    Devuelve {clave_natural: nº de imputaciones en BD} para las filas del lote.
+    Busca por la columna indexada Fingerprint (en bloques de `tamano_consulta`
+    huellas) y agrupa por la clave completa, de modo que el conteo es el mismo
+    que daría filtrar por las 12 columnas.
+    """
+    if df.empty:
+        return {}
+
+    huellas = list({calcular_fingerprint(row) for _, row in df.iterrows()})
+    columnas = [getattr(Imputaciones, col) for col in COLUMNAS_CLAVE]
+
+    conteos = {}
+    for i in range(0, len(huellas), tamano_consulta):
+        filas = (
+            session.query(*columnas, func.count(Imputaciones.ID))
+            .filter(Imputaciones.Fingerprint.in_(huellas[i:i + tamano_consulta]))
+            .group_by(*columnas)
+            .all()
+        )
+        for fila in filas:
+            clave = tuple(_valor_clave(v) for v in fila[:-1])
+            conteos[clave] = conteos.get(clave, 0) + fila[-1]
+    return conteos
+
+
 def existe_combinacion_area_tarea(centro_trabajo, tarea, session):
-  return session.query(Extraciclos).filter(
-      Extraciclos.CentroTrabajo == centro_trabajo,
-      Extraciclos.TareaBaan == tarea
-  ).first() is not None
\ No newline at end of file
+  return extraciclos_cache.existe_combinacion(centro_trabajo, tarea, session)
+
+
+def construir_imputacion(row, session):
+    """
+    Diccionario de columnas de Imputaciones para una fila del Excel transformado,
+    listo para un INSERT en bloque.
+    """
+    combinacion_valida = existe_combinacion_area_tarea(
+        row.get('CentroTrabajo'),
+        row.get('TareaAsoc'),
+        session
+    )
+    area_tarea = f"{row.get('CentroTrabajo')}-{row.get('TareaAsoc')}" if combinacion_valida else None
+
+    return dict(
+        CodEmpleado=row.get('CodEmpleado'),
+        FechaImp=row.get('FechaImp'),
+        Timpu=row.get('Timpu'),
+        Horas=row.get('Horas'),
+        Proyecto=row.get('Proyecto'),
+        TipoCoche=row.get('TipoCoche'),
+        NumCoche=row.get('NumCoche'),
+        NumCocheInt=num_coche_entero(row.get('NumCoche')),
+        CentroTrabajo=row.get('CentroTrabajo'),
+        Tarea=row.get('Tarea'),
+        TareaAsoc=row.get('TareaAsoc'),
+        area_id=row.get('CentroTrabajo'),
+        TipoMotivo=row.get('TipoMotivo'),
+        TipoIndirecto=row.get('TipoIndirecto'),
+        AreaTarea=area_tarea,
+        TipoImput=row.get('TipoImput'),
+        Fingerprint=calcular_fingerprint(row)
+    )
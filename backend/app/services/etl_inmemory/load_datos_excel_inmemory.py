@@ -1,25 +1,47 @@
 # PATH: backend/app/services/etl_inmemory/load_datos_excel_inmemory.py
 
-def load_datos_excel_inmemory(df, db_session=None, sse_process_id=None, summary=None):
+def load_datos_excel_inmemory(df, db_session=None, sse_process_id=None, summary=None, batch_size=None,
+                              conteos_duplicados=None, cancelacion=None):
     """
     Procesa el DF, inserta en BD, anota Status y error_message en cada fila.
     Devuelve df_result con columns extra => 'Status', 'error_message'
+
+    Si df es un bloque de un fichero mayor, `conteos_duplicados` ({huella_clave: n},
+    ver acumular_conteos_claves) aporta las repeticiones de cada clave en el
+    fichero completo; si no, se calculan sobre el propio df.
+
+    Las filas aceptadas se insertan en bloque (executemany) y se confirman cada
+    `batch_size` inserciones. Si un lote falla, se deshace y se reprocesa fila a
+    fila con savepoints para marcar como FAIL solo las filas problemáticas.
+
+    Si `cancelacion` (TokenCancelacion) se activa, se lanza ProcesoCancelado antes
+    de la siguiente fila: los lotes ya confirmados se conservan y el lote en curso
+    (aún no enviado a la BD) se descarta.
     """
     import pandas as pd
     from datetime import datetime
-    from sqlalchemy import func
-    from sqlalchemy.exc import IntegrityError
+    from sqlalchemy import insert
+    from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
+    from app.core.config import get_config
+    from app.core.cancelacion import SIN_CANCELACION
     from app.db.session import database_session
     from app.models.models import Imputaciones
     from ._load_datos_excel import (
         verificar_duplicados,
-        existe_combinacion_area_tarea
+        clave_natural,
+        huella_clave,
+        cargar_conteos_existentes,
+        construir_imputacion,
     )
     from app.core.sse_manager import sse_manager
 
     if summary is None:
         summary = {"total": len(df), "success": 0, "skipped": 0, "fail": 0}
+    if batch_size is None:
+        batch_size = get_config().IMPUTACIONES_BATCH_SIZE
+    if cancelacion is None:
+        cancelacion = SIN_CANCELACION
 
     # Creamos dos columnas extra en df => 'Status' y 'error_message'
     df["Status"] = None
@@ -29,89 +51,108 @@ def load_datos_excel_inmemory(df, db_session=None, sse_process_id=None, summary=
     if sse_process_id:
         sse_manager.send_message(sse_process_id, "📥 Preparando datos...")
 
-    df=verificar_duplicados(df)
+    if conteos_duplicados is None:
+        df=verificar_duplicados(df)
+    else:
+        df["dup_count"] = [conteos_duplicados[huella_clave(clave_natural(row))] for _, row in df.iterrows()]
 
     nuevos_registros = 0
     errores = []
 
+    def _marcar(index, status, msg):
+        df.at[index, "Status"] = status
+        df.at[index, "error_message"] = msg
+        if status == "OK":
+            summary["success"] += 1
+        elif status == "SKIPPED":
+            summary["skipped"] += 1
+        else:
+            summary["fail"] += 1
+            errores.append(f"Fila {index+2}: {msg}")
+
+    def _mensaje_error(e):
+        if isinstance(e, IntegrityError):
+            return f"error de integridad ({str(e.orig).splitlines()[0]})"
+        return f"error inesperado: {str(e)}"
+
     session = db_session or database_session
     with session as db:
+        # Conteos ya presentes en BD por clave natural, cargados de una vez para todo el lote.
+        # Se actualizan tras cada inserción para que las filas repetidas vean el mismo
+        # conteo que daría la consulta fila a fila.
+        conteos_existentes = cargar_conteos_existentes(df, db)
+
+        def _evaluar(row):
+            """Devuelve (clave, existing_count, wanted_count, mapping|None)."""
+            clave = clave_natural(row)
+            existing_count = conteos_existentes.get(clave, 0)
+            wanted_count = int(row.get('dup_count', 1))
+            if existing_count < wanted_count:
+                return clave, existing_count, wanted_count, construir_imputacion(row, db)
+            return clave, existing_count, wanted_count, None
+
+        def _reprocesar_fila_a_fila(lote, conteos_previos):
+            """Repite las decisiones del lote con un savepoint por inserción."""
+            conteos_existentes.update(conteos_previos)
+            insertadas = 0
+            for index, row in lote:
+                try:
+                    clave, existing_count, wanted_count, mapping = _evaluar(row)
+                    if mapping is None:
+                        _marcar(index, "SKIPPED", f"Ya hay {existing_count} en BD, wanted={wanted_count}")
+                        continue
+                    with db.begin_nested():
+                        db.execute(insert(Imputaciones), [mapping])
+                    conteos_existentes[clave] = existing_count + 1
+                    insertadas += 1
+                    _marcar(index, "OK", "")
+                except Exception as e:
+                    _marcar(index, "FAIL", _mensaje_error(e))
+            db.commit()
+            return insertadas
+
+        def _volcar_lote(lote, mappings, resultados, conteos_previos):
+            """Inserta el lote en bloque; si falla, lo reprocesa fila a fila."""
+            if mappings:
+                try:
+                    db.execute(insert(Imputaciones), mappings)
+                    db.commit()
+                except SQLAlchemyError:
+                    db.rollback()
+                    return _reprocesar_fila_a_fila(lote, conteos_previos)
+            for index, status, msg in resultados:
+                _marcar(index, status, msg)
+            return len(mappings)
+
+        lote, mappings, resultados, conteos_previos = [], [], [], {}
         for index, row in df.iterrows():
+            cancelacion.comprobar()
+            lote.append((index, row))
             try:
-                existing_count = db.query(func.count(Imputaciones.ID)).filter(
-                    Imputaciones.CodEmpleado == row.get('CodEmpleado'),
-                    Imputaciones.FechaImp == row.get('FechaImp'),
-                    Imputaciones.Timpu == row.get('Timpu'),
-                    Imputaciones.Horas == row.get('Horas'),
-                    Imputaciones.Proyecto == row.get('Proyecto'),
-                    Imputaciones.TipoCoche == row.get('TipoCoche'),
-                    Imputaciones.NumCoche == row.get('NumCoche'),
-                    Imputaciones.CentroTrabajo == row.get('CentroTrabajo'),
-                    Imputaciones.Tarea == row.get('Tarea'),
-                    Imputaciones.TareaAsoc == row.get('TareaAsoc'),
-                    Imputaciones.TipoMotivo == row.get('TipoMotivo'),
-                    Imputaciones.TipoIndirecto == row.get('TipoIndirecto')
-                ).scalar()
-
-                wanted_count = int(row.get('dup_count', 1))
-
-                if existing_count < wanted_count:
-                    # Insertar
-                    combinacion_valida = existe_combinacion_area_tarea(
-                        row.get('CentroTrabajo'),
-                        row.get('TareaAsoc'),
-                        db
-                    )
-                    area_tarea = f"{row.get('CentroTrabajo')}-{row.get('TareaAsoc')}" if combinacion_valida else None
-
-                    imputacion = Imputaciones(
-                        CodEmpleado=row.get('CodEmpleado'),
-                        FechaImp=row.get('FechaImp'),
-                        Timpu=row.get('Timpu'),
-                        Horas=row.get('Horas'),
-                        Proyecto=row.get('Proyecto'),
-                        TipoCoche=row.get('TipoCoche'),
-                        NumCoche=row.get('NumCoche'),
-                        CentroTrabajo=row.get('CentroTrabajo'),
-                        Tarea=row.get('Tarea'),
-                        TareaAsoc=row.get('TareaAsoc'),
-                        area_id=row.get('CentroTrabajo'),
-                        TipoMotivo=row.get('TipoMotivo'),
-                        TipoIndirecto=row.get('TipoIndirecto'),
-                        AreaTarea=area_tarea,
-                        TipoImput=row.get('TipoImput')
-                    )
-                    db.add(imputacion)
-                    db.commit()
-
-                    nuevos_registros += 1
-                    summary["success"] += 1
-                    df.at[index, "Status"] = "OK"
-                    df.at[index, "error_message"] = ""
-                else:
-                    df.at[index, "Status"] = "SKIPPED"
-                    df.at[index, "error_message"] = f"Ya hay {existing_count} en BD, wanted={wanted_count}"
-                    summary["skipped"] += 1
-
-            except IntegrityError as e:
-                db.rollback()
-                msg = f"error de integridad ({str(e.orig).splitlines()[0]})"
-                errores.append(f"Fila {index+2}: {msg}")
-                summary["fail"] += 1
-                df.at[index, "Status"] = "FAIL"
-                df.at[index, "error_message"] = msg
-                # if sse_process_id:
-                #     sse_manager.send_message(sse_process_id, f"❌ Fila {index+2}: {msg}")
-
+                clave, existing_count, wanted_count, mapping = _evaluar(row)
             except Exception as e:
                 db.rollback()
-                msg = f"error inesperado: {str(e)}"
-                errores.append(f"Fila {index+2}: {msg}")
-                summary["fail"] += 1
-                df.at[index, "Status"] = "FAIL"
-                df.at[index, "error_message"] = msg
-                # if sse_process_id:
-                #     sse_manager.send_message(sse_process_id, f"❌ Fila {index+2}: {msg}")
+                resultados.append((index, "FAIL", _mensaje_error(e)))
+                continue
+
+            if mapping is None:
+                resultados.append((index, "SKIPPED", f"Ya hay {existing_count} en BD, wanted={wanted_count}"))
+                continue
+
+            # Se cuenta como insertada de forma provisional; si el lote falla se restaura
+            conteos_previos.setdefault(clave, existing_count)
+            conteos_existentes[clave] = existing_count + 1
+            mappings.append(mapping)
+            resultados.append((index, "OK", ""))
+
+            if len(mappings) >= batch_size:
+                nuevos_registros += _volcar_lote(lote, mappings, resultados, conteos_previos)
+                lote, mappings, resultados, conteos_previos = [], [], [], {}
+                if sse_process_id:
+                    sse_manager.send_message(sse_process_id, f"💾 {nuevos_registros} registros insertados...")
+
+        if lote:
+            nuevos_registros += _volcar_lote(lote, mappings, resultados, conteos_previos)
 
     print(f"Proceso finalizado. Nuevos registros: {nuevos_registros}")
     if sse_process_id:
@@ -0,0 +1,132 @@
+# PATH: backend/app/services/etl_inmemory/procesar_imputaciones_por_bloques.py
+
+import os
+import tempfile
+import time
+
+import pandas as pd
+from openpyxl import Workbook
+
+from app.core.config import get_config
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, SIN_CANCELACION
+from app.core.sse_manager import sse_manager
+from app.services.utils.excel_por_bloques import iterar_bloques_excel, contar_filas_excel
+from .transformar_datos_excel_inmemory import transformar_datos_excel_inmemory
+from .load_datos_excel_inmemory import load_datos_excel_inmemory
+from ._load_datos_excel import acumular_conteos_claves
+
+
+def _valor_excel(valor):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    return valor
+
+
+def procesar_imputaciones_por_bloques(path_excel: str, process_id: str, summary: dict, filas_por_bloque: int = None,
+                                      medidor: MedidorEtapas = None, cancelacion: TokenCancelacion = None) -> str:
+    """
+    Transforma y carga un Excel de imputaciones de cualquier tamaño por bloques de filas:
+
+    1) Lee la hoja en modo streaming, transforma cada bloque, cuenta las claves
+       naturales del fichero completo (para `dup_count`) y deja el bloque
+       transformado en un fichero temporal.
+    2) Carga cada bloque en BD (deduplicación + inserción en lotes) y escribe sus
+       filas con Status/error_message en el Excel de resultado (write-only).
+
+    La memoria queda acotada por el tamaño del bloque. Devuelve la ruta del Excel final.
+    Los tiempos de cada etapa se acumulan en `medidor`.
+
+    `cancelacion` se comprueba entre bloques y entre filas de la carga; al cancelar
+    se lanza ProcesoCancelado, los lotes ya confirmados en BD se conservan y no se
+    genera Excel de resultado.
+    """
+    if filas_por_bloque is None:
+        filas_por_bloque = get_config().IMPUTACIONES_CHUNK_ROWS
+    if medidor is None:
+        medidor = MedidorEtapas("imputaciones", process_id)
+    if cancelacion is None:
+        cancelacion = SIN_CANCELACION
+
+    total_filas_raw = 0
+    conteos_claves = {}
+    bloques = []
+
+    filas_estimadas = contar_filas_excel(path_excel)
+    if filas_estimadas:
+        sse_manager.send_message(process_id, f"📁 Archivo con ~{filas_estimadas} filas. Leyendo por bloques de {filas_por_bloque}...")
+
+    with tempfile.TemporaryDirectory(prefix=f"imputaciones_{process_id}_") as spool_dir:
+        # ---------- 1) Lectura + transformación ----------
+        bloques_excel = medidor.iterar("lectura_excel", iterar_bloques_excel(path_excel, filas_por_bloque))
+        for n_bloque, df_raw in enumerate(bloques_excel, start=1):
+            cancelacion.comprobar()
+            total_filas_raw += len(df_raw)
+            with medidor.etapa("transformacion", filas_entrada=len(df_raw)) as etapa:
+                df_bloque = transformar_datos_excel_inmemory(df_raw)
+                etapa.filas_salida = len(df_bloque)
+            del df_raw
+            if df_bloque.empty:
+                continue
+
+            with medidor.etapa("spool_bloques", filas_entrada=len(df_bloque)):
+                acumular_conteos_claves(df_bloque, conteos_claves)
+                ruta_bloque = os.path.join(spool_dir, f"bloque_{n_bloque:05d}.pkl")
+                df_bloque.to_pickle(ruta_bloque)
+            bloques.append(ruta_bloque)
+            summary["total"] += len(df_bloque)
+            sse_manager.send_message(
+                process_id, f"🔄 Bloque {n_bloque}: {total_filas_raw} filas leídas, {summary['total']} válidas tras transformar."
+            )
+
+        if total_filas_raw == 0:
+            raise ValueError("El Excel está vacío")
+
+        filas_filtradas = total_filas_raw - summary["total"]
+        if filas_filtradas > 0:
+            sse_manager.send_message(process_id, f"🔽 {filas_filtradas} filas filtradas en transformación.")
+
+        # ---------- 2) Carga + Excel de resultado ----------
+        sse_manager.send_message(process_id, "💾 Cargando datos en la BD por bloques...")
+        filename = f"imputaciones_{process_id}_{int(time.time())}.xlsx"
+        filepath = os.path.join(tempfile.gettempdir(), filename)
+
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet()
+        cabecera_escrita = False
+
+        try:
+            for n_bloque, ruta_bloque in enumerate(bloques, start=1):
+                cancelacion.comprobar()
+                with medidor.etapa("spool_bloques"):
+                    df_bloque = pd.read_pickle(ruta_bloque)
+                    os.remove(ruta_bloque)
+
+                insertadas_antes = summary["success"]
+                with medidor.etapa("carga_bd", filas_entrada=len(df_bloque)) as etapa:
+                    df_result = load_datos_excel_inmemory(
+                        df_bloque, summary=summary, conteos_duplicados=conteos_claves, cancelacion=cancelacion
+                    )
+                    etapa.filas_salida = summary["success"] - insertadas_antes
+
+                with medidor.etapa("escritura_excel", filas_entrada=len(df_result)):
+                    if not cabecera_escrita:
+                        ws.append(list(df_result.columns))
+                        cabecera_escrita = True
+                    for fila in df_result.itertuples(index=False, name=None):
+                        ws.append([_valor_excel(v) for v in fila])
+
+                sse_manager.send_message(
+                    process_id,
+                    f"📦 Bloque {n_bloque}/{len(bloques)} cargado: "
+                    f"{summary['success']} insertadas, {summary['skipped']} duplicadas, {summary['fail']} errores."
+                )
+        except BaseException:
+            # Cierra el fichero temporal del Excel a medio escribir (cancelación / error)
+            ws.close()
+            raise
+
+        with medidor.etapa("escritura_excel"):
+            wb.save(filepath)
+
+    return filepath
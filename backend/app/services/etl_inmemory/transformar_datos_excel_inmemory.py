@@ -3,8 +3,8 @@
 def transformar_datos_excel_inmemory(df):
     import pandas as pd
     import numpy as np
-    from app.db.session import database_session
-    from app.models.models import Extraciclos
+    from app.services.utils.extraciclos_cache import extraciclos_cache
+    from app.services.utils.imputaciones_utils import intercambiar_tareas
 
     print("Datos cargados a df (inmemory). Comenzando transformaciones...")
 
@@ -75,8 +75,7 @@ def transformar_datos_excel_inmemory(df):
             axis=1
         )
 
-    with database_session as db:
-        extraciclos = db.query(Extraciclos).all()
+    extraciclos = extraciclos_cache.todos()
 
     if extraciclos:
         extraciclos_df = pd.DataFrame([
@@ -87,6 +86,9 @@ def transformar_datos_excel_inmemory(df):
 
     if not extraciclos_df.empty and 'AreaTarea' in df.columns:
         merged = df.merge(extraciclos_df, on='AreaTarea', how='left')
+        # AreaTarea es la PK de Extraciclos: mismas filas y orden; se conserva el índice
+        # (nº de fila del Excel) para los mensajes de error de la carga
+        merged.index = df.index
         cond_tipoimput_null = merged['TipoImput'].isna()
         cond_tipocnc_notnull = merged['TipoCNC'].notna()
         merged.loc[cond_tipoimput_null & cond_tipocnc_notnull, 'TipoImput'] = (
@@ -119,14 +121,9 @@ def transformar_datos_excel_inmemory(df):
     #    HAZLO AQUÍ, antes de convertir a str, para que la condición sea más limpia
     # ----------------------------------------------------------------------
     if 'TareaAsoc' in df.columns and 'Tarea' in df.columns:
-        for index, row in df.iterrows():
-            # TareaAsoc está como None (o int/float si venía del Excel)
-            # Verificamos si es un valor real
-            if row['TareaAsoc'] is not None and str(row['TareaAsoc']).strip() != '':
-                # Intercambio
-                old_tarea = row['Tarea']
-                df.at[index, 'Tarea']    = row['TareaAsoc']
-                df.at[index, 'TareaAsoc'] = old_tarea
+        # TareaAsoc está como None (o int/float si venía del Excel);
+        # solo se intercambia si tiene un valor real (no vacío ni espacios)
+        df = intercambiar_tareas(df, espacios_como_vacio=True)
 
     # ----------------------------------------------------------------------
     # 6) Conversión de tipos numéricos
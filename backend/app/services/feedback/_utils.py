@@ -1,6 +1,7 @@
 # PATH: backend/app/services/feedback/_utils.py
 
 import pandas as pd
+from app.services.utils.imputaciones_utils import intercambiar_tareas as _intercambiar_tareas
 
 def change_dtypes(df):
     # Con dtype=str en read_excel, los campos ya son str.
@@ -32,8 +33,5 @@ def is_null(value) -> bool:
 
 def intercambiar_tareas(df):
     # Intercambiar valores de 'Tarea' y 'TareaAsoc' solo si 'TareaAsoc' no está en blanco ni es nulo
-    for index, row in df.iterrows():
-        if not is_null(row['TareaAsoc']) and row['TareaAsoc'] != '':
-            df.at[index, 'Tarea'], df.at[index, 'TareaAsoc'] = row['TareaAsoc'], row['Tarea']
-
-    return df
\ No newline at end of file
+    # (el texto 'nan' cuenta como nulo, igual que en is_null)
+    return _intercambiar_tareas(df, texto_nan_como_nulo=True)
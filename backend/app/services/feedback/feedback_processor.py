@@ -9,23 +9,33 @@ from sqlalchemy.orm import Session
 from app.db.session import database_session
 from app.models.models import Imputaciones, TablaCentral
 from app.core.sse_manager import sse_manager
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, SIN_CANCELACION
 from app.services.feedback._utils import change_dtypes, intercambiar_tareas, _filtrar_fechas_parseables, is_null
+from app.services.utils.imputaciones_utils import calcular_fingerprint
 
 # ==== Procesamiento Completo ====
 
 def procesar_feedback_completo(
     df: pd.DataFrame,
     process_id: str,
-    original_filename: str
+    original_filename: str,
+    medidor: MedidorEtapas = None,
+    cancelacion: TokenCancelacion = SIN_CANCELACION,
 ):
-    sse_manager.send_message(process_id, "🔍 Filtrando fechas parseables…")
-    df = _filtrar_fechas_parseables(df)
+    if medidor is None:
+        medidor = MedidorEtapas("feedback", process_id)
 
-    sse_manager.send_message(process_id, "⚙️ Ajustando tipos de datos…")
-    df = change_dtypes(df)
+    with medidor.etapa("transformacion", filas_entrada=len(df)) as etapa:
+        sse_manager.send_message(process_id, "🔍 Filtrando fechas parseables…")
+        df = _filtrar_fechas_parseables(df)
 
-    sse_manager.send_message(process_id, "🔄 Intercambiando tareas…")
-    df = intercambiar_tareas(df)
+        sse_manager.send_message(process_id, "⚙️ Ajustando tipos de datos…")
+        df = change_dtypes(df)
+
+        sse_manager.send_message(process_id, "🔄 Intercambiando tareas…")
+        df = intercambiar_tareas(df)
+        etapa.filas_salida = len(df)
 
     # columnas resultado
     for col in (
@@ -39,8 +49,10 @@ def procesar_feedback_completo(
 
     sse_manager.send_message(process_id, "📡 Consultando la base de datos…")
 
-    with database_session as db:
+    with database_session as db, medidor.etapa("consulta_bd", filas_entrada=len(df)):
         for idx, row in df.iterrows():
+            # Solo lectura: al cancelar no hay nada que deshacer ni fichero que generar
+            cancelacion.comprobar()
             estado, imp_id, sap_ord, sap_opact, sap_eff = _obtener_estado_imputacion(
                 db, df, row
             )
@@ -67,8 +79,9 @@ def procesar_feedback_completo(
     temp_file = tempfile.NamedTemporaryFile(
         delete=False, prefix=f"feedback_{base}_", suffix=".xlsx"
     )
-    df.to_excel(temp_file.name, index=False)
-    _colorear_celdas_según_estado(temp_file.name)
+    with medidor.etapa("escritura_excel", filas_entrada=len(df)):
+        df.to_excel(temp_file.name, index=False)
+        _colorear_celdas_según_estado(temp_file.name)
 
     sse_manager.send_message(process_id, "✅ Archivo generado correctamente.")
     return temp_file.name, f"feedback_{base}.xlsx"
@@ -92,18 +105,19 @@ def _obtener_estado_imputacion(db: Session, df: pd.DataFrame, row: pd.Series):
 
     ids_ya_asignados = set(df['Imputacion_ID'].dropna().unique())
 
-    query = db.query(Imputaciones).filter(
-        Imputaciones.FechaImp == fecha_imp,
-        Imputaciones.CodEmpleado == cod_empleado,
-        Imputaciones.Timpu == timpu,
-        Imputaciones.Proyecto == proyecto,
-        Imputaciones.TipoCoche == tipo_coche,
-        Imputaciones.NumCoche == num_coche,
-        Imputaciones.CentroTrabajo == centro_trabajo,
-        Imputaciones.Tarea == tarea,
-        Imputaciones.TareaAsoc == tarea_asoc,
-        Imputaciones.Horas == horas
-    )
+    fingerprint = calcular_fingerprint({
+        'FechaImp': fecha_imp,
+        'CodEmpleado': cod_empleado,
+        'Timpu': timpu,
+        'Proyecto': proyecto,
+        'TipoCoche': tipo_coche,
+        'NumCoche': num_coche,
+        'CentroTrabajo': centro_trabajo,
+        'Tarea': tarea,
+        'TareaAsoc': tarea_asoc,
+        'Horas': horas,
+    })
+    query = db.query(Imputaciones).filter(Imputaciones.Fingerprint == fingerprint)
 
     imputacion = next((imp for imp in query.all() if imp.ID not in ids_ya_asignados), None)
 
@@ -1,135 +1,218 @@
-from typing import List
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
-from app.models.models import (
-    Imputaciones, TablaCentral, Extraciclos
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado, SIN_CANCELACION
+from app.core.registro_progreso import RegistroProgreso
+from app.models.models import TablaCentral, Imputaciones
+from app.services.utils.imputaciones_utils import horas_centesimas
+from app.services.generar_imputaciones_sap.pending_imputaciones import (
+    get_imputaciones_pendientes_modelos,
+    get_version_sap_orders,
+    filtro_requiere_asignacion,
+    marcar_version_pendientes,
 )
-from app.services.generar_imputaciones_sap.pending_imputaciones import get_imputaciones_pendientes
+from .utils._indice_sap_orders import IndiceSapOrders
 from .utils._assign_sap_orders import (
-    obtener_operation_via_db,
+    obtener_operation,
     obtener_proyecto_sap,
-    obtener_sap_order_id_y_production_order_via_db,
+    obtener_sap_order_id_y_production_order,
     obtener_sap_order_gg
 )
 
-def run_assign_sap_orders_inmemory(db: Session, logs: List[str]):
+# Filas de Tabla_Central por INSERT multi-fila (executemany)
+TAMANO_LOTE_INSERCION = 5000
+
+def run_assign_sap_orders_inmemory(db: Session, logs: RegistroProgreso, medidor: MedidorEtapas = None,
+                                   cancelacion: TokenCancelacion = SIN_CANCELACION, completo: bool = False):
     """
-    1) Limpia Tabla_Central de filas previas con Cargado_SAP=False.
-    2) Obtiene las imputaciones pendientes.
-    3) Para cada imputación:
+    1) Selecciona las imputaciones a resolver y limpia sus filas de Tabla_Central con Cargado_SAP=False:
+        - Incremental (por defecto): solo las pendientes nuevas o con SapOrders
+          posteriores a su SapOrdersVersion que les puedan afectar. El resto de
+          filas pendientes de Tabla_Central se conservan.
+        - Completo (`completo=True`): borra todas las filas con Cargado_SAP=False y
+          resuelve todas las pendientes desde cero.
+    2) Carga una vez los índices en memoria de SapOrders activas, Areas,
+       ProjectsDictionary y Extraciclos.
+    3) Para cada imputación (resuelta en memoria, sin consultas por fila):
         - Busca coincidencia GG.
         - Si no hay GG: resuelve operation/operationActivity.
         - Traduce proyecto BAAN → SAP.
         - Busca match exacto (proyecto + vértice + coche + OA).
         - Si no hay match en cualquier paso → DESCARTA la imputación.
-    """
+    4) Guarda en todas las pendientes la versión de SapOrders usada.
+    Los tiempos de cada etapa se acumulan en `medidor`. En `logs` quedan los mensajes
+    generales, una línea de detalle por imputación y los contadores
+    (asignadas / descartadas por motivo) que se actualizan en cada imputación.
 
-    logs.append("🧹 Eliminando imputaciones previas con Cargado_SAP=False en Tabla_Central...")
-    deleted = db.query(TablaCentral).filter(TablaCentral.Cargado_SAP == False).delete()
-    db.commit()
-    logs.append(f"🗑️ {deleted} filas eliminadas de Tabla_Central.")
+    El borrado previo y las nuevas filas se confirman juntas al final. Si se cancela
+    (`cancelacion`, comprobado en cada imputación), se deshace todo y Tabla_Central
+    queda como estaba antes de empezar.
+
+    Las filas nuevas se acumulan en un buffer y se escriben con INSERT por lotes
+    (TAMANO_LOTE_INSERCION) dentro de la misma transacción: quien lea Tabla_Central
+    (p. ej. /download) ve la ejecución anterior o la nueva completa, nunca una parcial.
+
+    Devuelve el número de filas de Tabla_Central listas para el ZIP (nuevas + conservadas).
+    """
+    if medidor is None:
+        medidor = MedidorEtapas("asignacion_sap")
+    try:
+        return _asignar(db, logs, medidor, cancelacion, completo)
+    except ProcesoCancelado:
+        db.rollback()
+        logs.append("↩️ Cambios deshechos: Tabla_Central queda como antes de la ejecución.")
+        raise
+
+
+def _asignar(db: Session, logs: RegistroProgreso, medidor: MedidorEtapas, cancelacion: TokenCancelacion, completo: bool):
+
+    version = get_version_sap_orders(db)
+
+    if completo:
+        logs.append("🧹 Eliminando imputaciones previas con Cargado_SAP=False en Tabla_Central...")
+        with medidor.etapa("limpieza_tabla_central") as etapa:
+            deleted = db.query(TablaCentral).filter(TablaCentral.Cargado_SAP == False).delete()
+            etapa.filas_salida = deleted
+        logs.append(f"🗑️ {deleted} filas eliminadas de Tabla_Central.")
+
+        logs.append("🔎 Buscando imputaciones pendientes en BD...")
+        with medidor.etapa("lectura_pendientes") as etapa:
+            imps_pendientes = get_imputaciones_pendientes_modelos(db)
+            etapa.filas_salida = len(imps_pendientes)
+        conservadas = 0
+    else:
+        logs.append(f"🔎 Modo incremental: buscando imputaciones pendientes nuevas o afectadas por SapOrders nuevas (versión {version})...")
+        with medidor.etapa("lectura_pendientes") as etapa:
+            imps_pendientes = get_imputaciones_pendientes_modelos(db, solo_requieren_asignacion=True)
+            etapa.filas_salida = len(imps_pendientes)
+
+        with medidor.etapa("limpieza_tabla_central") as etapa:
+            a_reprocesar = db.query(Imputaciones.ID).filter(filtro_requiere_asignacion())
+            deleted = db.query(TablaCentral).filter(
+                TablaCentral.Cargado_SAP == False,
+                TablaCentral.imputacion_id.in_(a_reprocesar)
+            ).delete(synchronize_session=False)
+            etapa.filas_salida = deleted
+            conservadas = db.query(TablaCentral).filter(TablaCentral.Cargado_SAP == False).count()
+        logs.append(f"🗑️ {deleted} filas eliminadas de Tabla_Central para reprocesar; {conservadas} asignaciones previas se conservan.")
 
-    logs.append("🔎 Buscando imputaciones pendientes en BD...")
-    imps_pendientes = get_imputaciones_pendientes(db)
     if not imps_pendientes:
-        logs.append("No hay imputaciones pendientes.")
-        return 0
+        marcar_version_pendientes(db, version)
+        db.commit()
+        logs.append("No hay imputaciones pendientes." if completo else "No hay imputaciones nuevas ni afectadas por SapOrders nuevas.")
+        return conservadas
 
     logs.append(f"Encontradas {len(imps_pendientes)} imputaciones pendientes.")
-    extraciclos_all = db.query(Extraciclos).all()
-
-    # Contadores de resultado
-    matched_count = 0
-    discarded_no_operation = 0
-    discarded_no_project = 0
-    discarded_no_sap_match = 0
-    discarded_not_found = 0
-
-    for i_dict in imps_pendientes:
-        imp_id = i_dict["id"]
-        imp = db.query(Imputaciones).filter(Imputaciones.ID == imp_id).first()
-        if not imp:
-            logs.append(f"❌ Imputación ID={imp_id} no se encontró en BD.")
-            discarded_not_found += 1
-            continue
-
-        logs.append(f"🔧 Procesando imputación ID={imp_id}...")
-
-        # -----------------------------------------------------------
-        # 1) Intento por TipoIndirecto + TipoMotivo => GG
-        # -----------------------------------------------------------
-        so_indirecto = obtener_sap_order_gg(imp, db, logs)
-        if so_indirecto:
-            sap_id = so_indirecto.ID
-            prod_order = so_indirecto.Order
-            op = so_indirecto.Operation
-            op_act = so_indirecto.OperationActivity
-        else:
-            # -----------------------------------------------------------
-            # 2) Obtener operation, operationActivity
-            # -----------------------------------------------------------
-            op, op_act = obtener_operation_via_db(imp, db, extraciclos_all, logs)
 
-            if op is None or op_act is None:
-                logs.append(f"⚠️ Imputación ID={imp_id} DESCARTADA: sin operation/operationActivity (Tarea={imp.Tarea}, TareaAsoc={imp.TareaAsoc}).")
-                discarded_no_operation += 1
-                continue
+    with medidor.etapa("carga_indices") as etapa:
+        indice = IndiceSapOrders.cargar(db)
+        etapa.filas_salida = len(indice.por_clave_exacta)
+
+    # Contadores de resultado (se ven en vivo por SSE)
+    for contador in ("procesadas", "asignadas", "sin_operation", "sin_proyecto", "sin_match"):
+        logs.fijar(contador, 0)
+    logs.fijar("pendientes", len(imps_pendientes))
+    logs.fijar("conservadas", conservadas)
+
+    buffer = []
+
+    with medidor.etapa("asignacion", filas_entrada=len(imps_pendientes)) as etapa_asignacion:
+        for imp in imps_pendientes:
+            cancelacion.comprobar()
+            imp_id = imp.ID
+
+            logs.contar("procesadas")
+            logs.detalle(f"🔧 Procesando imputación ID={imp_id}...")
 
             # -----------------------------------------------------------
-            # 3) Traducir proyecto BAAN → SAP
+            # 1) Intento por TipoIndirecto + TipoMotivo => GG
             # -----------------------------------------------------------
-            proyecto_sap = obtener_proyecto_sap(imp.Proyecto, db)
-            if not proyecto_sap:
-                logs.append(f"⚠️ Imputación ID={imp_id} DESCARTADA: proyecto SAP no encontrado para '{imp.Proyecto}'.")
-                discarded_no_project += 1
-                continue
+            so_indirecto = obtener_sap_order_gg(imp, indice, logs)
+            if so_indirecto:
+                sap_id = so_indirecto.ID
+                prod_order = so_indirecto.Order
+                op = so_indirecto.Operation
+                op_act = so_indirecto.OperationActivity
+            else:
+                # -----------------------------------------------------------
+                # 2) Obtener operation, operationActivity
+                # -----------------------------------------------------------
+                op, op_act = obtener_operation(imp, indice, logs)
+
+                if op is None or op_act is None:
+                    logs.detalle(f"⚠️ Imputación ID={imp_id} DESCARTADA: sin operation/operationActivity (Tarea={imp.Tarea}, TareaAsoc={imp.TareaAsoc}).")
+                    logs.contar("sin_operation")
+                    continue
+
+                # -----------------------------------------------------------
+                # 3) Traducir proyecto BAAN → SAP
+                # -----------------------------------------------------------
+                proyecto_sap = obtener_proyecto_sap(imp.Proyecto, indice)
+                if not proyecto_sap:
+                    logs.detalle(f"⚠️ Imputación ID={imp_id} DESCARTADA: proyecto SAP no encontrado para '{imp.Proyecto}'.")
+                    logs.contar("sin_proyecto")
+                    continue
+
+                # -----------------------------------------------------------
+                # 4) Match exacto (proyecto + vértice + coche + OA)
+                # -----------------------------------------------------------
+                so_id, so_order = obtener_sap_order_id_y_production_order(
+                    indice, proyecto_sap, imp, op_act, logs
+                )
+                if so_id is None:
+                    logs.detalle(f"⚠️ Imputación ID={imp_id} DESCARTADA: sin coincidencia exacta en SAP (Proy={proyecto_sap}, Vert={imp.TipoCoche}, Coche={imp.NumCoche}, OA={op_act}).")
+                    logs.contar("sin_match")
+                    continue
+
+                sap_id = so_id
+                prod_order = so_order
 
             # -----------------------------------------------------------
-            # 4) Match exacto (proyecto + vértice + coche + OA)
+            # 5) Insertar en Tabla_Central
             # -----------------------------------------------------------
-            so_id, so_order = obtener_sap_order_id_y_production_order_via_db(
-                db, proyecto_sap, imp, op_act, logs
+            # SapOrders.Order puede contener "2000097595.0" (float como string)
+            # TablaCentral.ProductionOrder es BIGINT => limpiar decimal
+            try:
+                clean_prod_order = int(float(prod_order)) if prod_order else None
+            except (ValueError, TypeError):
+                clean_prod_order = None
+
+            buffer.append(dict(
+                imputacion_id=imp_id,
+                sap_order_id=sap_id,
+                Employee_Number=imp.CodEmpleado,
+                Date=imp.FechaImp,
+                HourType="Production Direct Hour",
+                ProductionOrder=clean_prod_order,
+                Operation=op,
+                OperationActivity=op_act,
+                Hours=imp.Horas,
+                HoursCent=horas_centesimas(imp.Horas),
+                Cargado_SAP=False,
+            ))
+            if len(buffer) >= TAMANO_LOTE_INSERCION:
+                db.execute(insert(TablaCentral), buffer)
+                buffer = []
+
+            logs.contar("asignadas")
+            logs.detalle(
+                f"✅ Imputación ID={imp_id} insertada => SapOrder={sap_id}."
             )
-            if so_id is None:
-                logs.append(f"⚠️ Imputación ID={imp_id} DESCARTADA: sin coincidencia exacta en SAP (Proy={proyecto_sap}, Vert={imp.TipoCoche}, Coche={imp.NumCoche}, OA={op_act}).")
-                discarded_no_sap_match += 1
-                continue
-
-            sap_id = so_id
-            prod_order = so_order
-
-        # -----------------------------------------------------------
-        # 5) Insertar en Tabla_Central
-        # -----------------------------------------------------------
-        # SapOrders.Order puede contener "2000097595.0" (float como string)
-        # TablaCentral.ProductionOrder es BIGINT => limpiar decimal
-        try:
-            clean_prod_order = int(float(prod_order)) if prod_order else None
-        except (ValueError, TypeError):
-            clean_prod_order = None
-
-        new_row = TablaCentral(
-            imputacion_id=imp_id,
-            sap_order_id=sap_id,
-            Employee_Number=imp.CodEmpleado,
-            Date=imp.FechaImp,
-            HourType="Production Direct Hour",
-            ProductionOrder=clean_prod_order,
-            Operation=op,
-            OperationActivity=op_act,
-            Hours=imp.Horas,
-            Cargado_SAP=False,
-        )
-        db.add(new_row)
+        if buffer:
+            db.execute(insert(TablaCentral), buffer)
+        cancelacion.comprobar()
+        marcar_version_pendientes(db, version)
         db.commit()
-
-        matched_count += 1
-        logs.append(
-            f"✅ Imputación ID={imp_id} insertada => SapOrder={sap_id}."
-        )
+        contadores = logs.snapshot_contadores()[1]
+        matched_count = contadores["asignadas"]
+        etapa_asignacion.filas_salida = matched_count
 
     # Resumen final
+    discarded_no_operation = contadores["sin_operation"]
+    discarded_no_project = contadores["sin_proyecto"]
+    discarded_no_sap_match = contadores["sin_match"]
     total = len(imps_pendientes)
-    total_discarded = discarded_not_found + discarded_no_operation + discarded_no_project + discarded_no_sap_match
+    total_discarded = discarded_no_operation + discarded_no_project + discarded_no_sap_match
     logs.append(f"📊 RESUMEN: {matched_count}/{total} asignadas, {total_discarded} descartadas.")
     if discarded_no_operation > 0:
         logs.append(f"   - Sin operation/operationActivity: {discarded_no_operation}")
@@ -137,9 +220,9 @@ def run_assign_sap_orders_inmemory(db: Session, logs: List[str]):
         logs.append(f"   - Sin proyecto SAP: {discarded_no_project}")
     if discarded_no_sap_match > 0:
         logs.append(f"   - Sin coincidencia exacta en SAP: {discarded_no_sap_match}")
-    if discarded_not_found > 0:
-        logs.append(f"   - No encontradas en BD: {discarded_not_found}")
-    if matched_count == 0:
-        logs.append("⚠️ ATENCIÓN: Ninguna imputación pudo ser asignada. No se generará ZIP.")
+    if conservadas > 0:
+        logs.append(f"   - Asignaciones previas conservadas: {conservadas}")
+    if matched_count + conservadas == 0:
+        logs.aviso("⚠️ ATENCIÓN: Ninguna imputación pudo ser asignada. No se generará ZIP.")
 
-    return matched_count
+    return matched_count + conservadas
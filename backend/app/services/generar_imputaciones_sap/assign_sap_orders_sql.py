@@ -0,0 +1,211 @@
+# PATH: backend/app/services/generar_imputaciones_sap/assign_sap_orders_sql.py
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado, SIN_CANCELACION
+from app.core.registro_progreso import RegistroProgreso
+from app.models.models import TablaCentral
+
+# -------------------------------------------------------------------------------------
+# Cascada completa GG → Extraciclos/Operation → match exacto en una sola sentencia.
+# Reproduce las reglas de `run_assign_sap_orders_inmemory`:
+#   - Por cada clave se elige la SapOrder activa más reciente
+#     (TimestampInput DESC, NULL primero como en PostgreSQL; a igualdad, mayor ID).
+#     Para la clave exacta es la fila vigente (IsCurrent, índice único parcial):
+#     un acceso por índice sin ordenar. GG y Operation ordenan entre las activas.
+#   - Las claves se comparan como las búsquedas en diccionario del motor en memoria:
+#     NULL coincide con NULL. Donde la clave puede ser NULL se usa IS NOT DISTINCT FROM
+#     o, en el cruce por Tarea, ROW(...)::text (NULL-safe y cruzable por hash).
+#   - El coche se compara por la clave tipada NumCocheInt; un NumCoche informado
+#     pero no numérico (NumCocheInt NULL) no coincide con ninguna orden.
+# El INSERT va en una CTE de modificación de datos; el SELECT final devuelve el
+# número de insertadas y los descartes por motivo en la misma ida a la BD.
+# -------------------------------------------------------------------------------------
+_SQL_ASIGNACION = text(r"""
+WITH
+activas AS (
+    SELECT "ID", "Order", "Operation", "OperationActivity", "Project", "Vertice",
+           "CarNumber", "TipoIndirecto", "TipoMotivo", "TimestampInput"
+    FROM "Sap_Orders"
+    WHERE "ActiveOrder" = true
+),
+por_gg AS (
+    SELECT DISTINCT ON ("TipoIndirecto", "TipoMotivo", "Operation") *
+    FROM activas
+    ORDER BY "TipoIndirecto", "TipoMotivo", "Operation", "TimestampInput" DESC, "ID" DESC
+),
+por_operation AS (
+    SELECT DISTINCT ON ("Operation") *
+    FROM activas
+    ORDER BY "Operation", "TimestampInput" DESC, "ID" DESC
+),
+pendientes AS (
+    SELECT i.*,
+           (i."NumCoche" IS NOT NULL AND i."NumCocheInt" IS NULL) AS num_coche_invalido
+    FROM "Imputaciones" i
+    WHERE NOT EXISTS (SELECT 1 FROM "Tabla_Central" tc WHERE tc.imputacion_id = i."ID")
+),
+-- Versión de SapOrders usada (ver pending_imputaciones.get_version_sap_orders)
+versionadas AS (
+    UPDATE "Imputaciones" i
+    SET "SapOrdersVersion" = (SELECT coalesce(max("ID"), 0) FROM "Sap_Orders")
+    FROM pendientes p
+    WHERE i."ID" = p."ID"
+),
+-- 1) GG: TipoIndirecto + TipoMotivo con la Operation del área (OpGG)
+con_gg AS (
+    SELECT p.*, gg."ID" AS gg_id, gg."Order" AS gg_order,
+           gg."Operation" AS gg_op, gg."OperationActivity" AS gg_oa
+    FROM pendientes p
+    LEFT JOIN "Areas" a
+           ON a."CentroTrabajo" = p."CentroTrabajo"
+          AND p."TipoMotivo" <> '' AND p."TipoIndirecto" <> ''
+          AND a."OpGG" <> ''
+    LEFT JOIN por_gg gg
+           ON gg."TipoIndirecto" = p."TipoIndirecto"
+          AND gg."TipoMotivo" = p."TipoMotivo"
+          AND gg."Operation" = a."OpGG"
+),
+-- 2) Operation / OperationActivity: Extraciclos (si TareaAsoc) o por Tarea
+con_operacion AS (
+    SELECT c.*,
+           CASE WHEN ex."AreaTarea" IS NOT NULL THEN split_part(ex."OASAP", '-', 1) ELSE op."Operation" END AS op,
+           CASE WHEN ex."AreaTarea" IS NOT NULL THEN ex."OASAP" ELSE op."OperationActivity" END AS oa
+    FROM con_gg c
+    LEFT JOIN "Extraciclos" ex
+           ON ex."AreaTarea" = c."AreaTarea"
+          AND c."TareaAsoc" <> '' AND ex."OASAP" <> ''
+    LEFT JOIN por_operation op
+           ON ROW(op."Operation")::text = ROW(c."Tarea")::text
+),
+-- 3) Proyecto BAAN → SAP y 4) match exacto (proyecto + vértice + coche + OA)
+resueltas AS (
+    SELECT c."ID", c."CodEmpleado", c."FechaImp", c."Horas",
+           c.gg_id, c.gg_order, c.gg_op, c.gg_oa, c.op, c.oa,
+           ex."ID" AS exacta_id, ex."Order" AS exacta_order,
+           CASE
+               WHEN c.gg_id IS NOT NULL THEN 'ok'
+               WHEN c.op IS NULL OR c.oa IS NULL THEN 'sin_operation'
+               WHEN pd."ProyectoSap" IS NULL THEN 'sin_proyecto'
+               WHEN ex."ID" IS NULL THEN 'sin_match'
+               ELSE 'ok'
+           END AS motivo
+    FROM con_operacion c
+    LEFT JOIN "Projects_Dictionary" pd
+           ON pd."ProyectoBaan" = c."Proyecto"
+          AND pd."ProyectoSap" <> ''
+    LEFT JOIN "Sap_Orders" ex
+           ON ex."IsCurrent"
+          AND ex."Project" = pd."ProyectoSap"
+          AND ex."OperationActivity" = c.oa
+          AND ex."Vertice" IS NOT DISTINCT FROM c."TipoCoche"
+          AND NOT c.num_coche_invalido
+          AND ex."CarNumber" IS NOT DISTINCT FROM c."NumCocheInt"
+),
+insertadas AS (
+    INSERT INTO "Tabla_Central" (
+        imputacion_id, sap_order_id, "Employee_Number", "Date", "HourType",
+        "ProductionOrder", "Operation", "OperationActivity", "Hours", "HoursCent",
+        "Cargado_SAP", "TimestampInput"
+    )
+    SELECT r."ID",
+           COALESCE(r.gg_id, r.exacta_id),
+           r."CodEmpleado",
+           r."FechaImp",
+           'Production Direct Hour',
+           -- SapOrders.Order puede contener "2000097595.0": se trunca a BIGINT
+           CASE WHEN o.orden ~ '^\s*[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?\s*$'
+                THEN trunc(o.orden::double precision)::bigint END,
+           CASE WHEN r.gg_id IS NOT NULL THEN r.gg_op ELSE r.op END,
+           CASE WHEN r.gg_id IS NOT NULL THEN r.gg_oa ELSE r.oa END,
+           r."Horas",
+           round(r."Horas"::numeric * 100)::integer,
+           false,
+           timezone('utc', now())
+    FROM resueltas r
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN r.gg_id IS NOT NULL THEN r.gg_order ELSE r.exacta_order END AS orden
+    ) o
+    WHERE r.motivo = 'ok'
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM resueltas) AS total,
+    (SELECT count(*) FROM insertadas) AS asignadas,
+    (SELECT count(*) FROM resueltas WHERE motivo = 'sin_operation') AS sin_operation,
+    (SELECT count(*) FROM resueltas WHERE motivo = 'sin_proyecto') AS sin_proyecto,
+    (SELECT count(*) FROM resueltas WHERE motivo = 'sin_match') AS sin_match
+""")
+
+
+def run_assign_sap_orders_sql(db: Session, logs: RegistroProgreso, medidor: MedidorEtapas = None,
+                              cancelacion: TokenCancelacion = SIN_CANCELACION, completo: bool = True):
+    """
+    Motor alternativo a `run_assign_sap_orders_inmemory` que resuelve toda la
+    cascada dentro de PostgreSQL con una única sentencia INSERT ... SELECT
+    (DISTINCT ON por clave + LEFT JOINs), sin traer las imputaciones a Python.
+    Pensado para backlogs grandes; no genera un log por imputación, solo el resumen
+    con los descartes por motivo.
+
+    Siempre recalcula completo (`completo` se acepta por compatibilidad con el motor
+    en memoria); deja guardada la SapOrdersVersion en las imputaciones pendientes
+    para que una ejecución incremental posterior no las reprocese.
+
+    Igual que el motor en memoria, el borrado previo y las nuevas filas se confirman
+    juntas; si se cancela antes del commit, se deshace todo.
+    """
+    if medidor is None:
+        medidor = MedidorEtapas("asignacion_sap")
+    if not completo:
+        logs.append("ℹ️ El motor SQL no tiene modo incremental: se recalcula todo.")
+    try:
+        return _asignar_sql(db, logs, medidor, cancelacion)
+    except ProcesoCancelado:
+        db.rollback()
+        logs.append("↩️ Cambios deshechos: Tabla_Central queda como antes de la ejecución.")
+        raise
+
+
+def _asignar_sql(db: Session, logs: RegistroProgreso, medidor: MedidorEtapas, cancelacion: TokenCancelacion):
+
+    logs.append("🧹 Eliminando imputaciones previas con Cargado_SAP=False en Tabla_Central...")
+    with medidor.etapa("limpieza_tabla_central") as etapa:
+        deleted = db.query(TablaCentral).filter(TablaCentral.Cargado_SAP == False).delete()
+        etapa.filas_salida = deleted
+    logs.append(f"🗑️ {deleted} filas eliminadas de Tabla_Central.")
+
+    cancelacion.comprobar()
+    logs.append("🧮 Resolviendo imputaciones pendientes en la BD (motor SQL)...")
+    with medidor.etapa("asignacion_sql") as etapa:
+        conteos = db.execute(_SQL_ASIGNACION).one()
+        etapa.filas_entrada = conteos.total
+        etapa.filas_salida = conteos.asignadas
+        cancelacion.comprobar()
+        db.commit()
+
+    total = conteos.total
+    matched_count = conteos.asignadas
+    logs.fijar("pendientes", total)
+    logs.fijar("procesadas", total)
+    logs.fijar("asignadas", matched_count)
+    logs.fijar("sin_operation", conteos.sin_operation)
+    logs.fijar("sin_proyecto", conteos.sin_proyecto)
+    logs.fijar("sin_match", conteos.sin_match)
+    if not total:
+        logs.append("No hay imputaciones pendientes.")
+        return 0
+
+    # Resumen final (mismo formato que el motor en memoria)
+    total_discarded = conteos.sin_operation + conteos.sin_proyecto + conteos.sin_match
+    logs.append(f"📊 RESUMEN: {matched_count}/{total} asignadas, {total_discarded} descartadas.")
+    if conteos.sin_operation > 0:
+        logs.append(f"   - Sin operation/operationActivity: {conteos.sin_operation}")
+    if conteos.sin_proyecto > 0:
+        logs.append(f"   - Sin proyecto SAP: {conteos.sin_proyecto}")
+    if conteos.sin_match > 0:
+        logs.append(f"   - Sin coincidencia exacta en SAP: {conteos.sin_match}")
+    if matched_count == 0:
+        logs.aviso("⚠️ ATENCIÓN: Ninguna imputación pudo ser asignada. No se generará ZIP.")
+
+    return matched_count
@@ -0,0 +1,141 @@
+# PATH: backend/app/services/generar_imputaciones_sap/cache_mass_upload.py
+
+import os
+import threading
+import time
+import uuid
+from typing import Callable, Iterator, NamedTuple, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.core.config import get_config
+from app.core.upload_store import upload_store
+from app.db.session import SessionLocal, JobsSessionLocal
+from app.models.models import TablaCentral
+from app.services.generar_imputaciones_sap.generar_csv import nombre_mass_upload, stream_zip_with_csv_and_xlsx
+
+# Segundos que se conserva un ZIP expulsado antes de borrarlo (ver CacheMassUpload)
+PLAZO_BORRADO = 60
+
+
+class MarcaTablaCentral(NamedTuple):
+    """
+    Marca de agua barata del contenido del ZIP de carga masiva (filas con Cargado_SAP = False):
+      - max_id: cualquier asignación inserta filas nuevas (IDs mayores).
+      - pendientes: la respuesta de SAP y las limpiezas cambian cuántas quedan pendientes.
+    Las filas de Tabla_Central no se editan salvo para marcar Cargado_SAP, así que si
+    ninguna de las dos cambia, el ZIP sería el mismo.
+    """
+    max_id: int
+    pendientes: int
+
+
+def leer_marca(db: Session) -> MarcaTablaCentral:
+    # max(ID) por la clave primaria y el conteo por ix_tabla_central_pendientes (index-only)
+    pendientes = select(func.count()).select_from(TablaCentral).where(TablaCentral.Cargado_SAP == False)
+    max_id, n = db.execute(select(func.max(TablaCentral.ID), pendientes.scalar_subquery())).one()
+    return MarcaTablaCentral(max_id or 0, n)
+
+
+class CacheMassUpload:
+    """
+    Último ZIP de carga masiva generado, con la marca de Tabla_Central de la que sale.
+    - Se sirve tal cual mientras la marca no cambie (descargas repetidas).
+    - Se rellena al descargar (el ZIP se copia al spool mientras se envía) y al
+      terminar una asignación (`precalentar`).
+    - En cuanto la marca cambia, el fichero deja de servirse y se borra pasados
+      PLAZO_BORRADO segundos: una descarga que ya lo recibió de `obtener` tiene tiempo
+      de abrirlo (una vez abierto, borrarlo no corta la descarga).
+    - La clave incluye el máximo de filas por parte: otro reparto es otro ZIP.
+    Los ficheros viven en el spool de `upload_store` (se limpia al reiniciar).
+    """
+
+    def __init__(self, directorio: str):
+        self.directorio = directorio
+        self._lock = threading.Lock()
+        # ((marca, max_filas), ruta, nombre_descarga) se sustituye de una vez
+        self._actual = None
+        # (ruta, instante de retirada) de ZIPs expulsados pendientes de borrar
+        self._retirados = []
+
+    def obtener(self, marca: MarcaTablaCentral, max_filas: int) -> Optional[Tuple[str, str]]:
+        """
+        (ruta, nombre_descarga) si hay un ZIP para `marca` con ese reparto en partes;
+        si es de otra marca u otro reparto, lo expulsa.
+        """
+        with self._lock:
+            actual = self._actual
+            if actual is not None and actual[0] == (marca, max_filas) and os.path.exists(actual[1]):
+                return actual[1], actual[2]
+            if actual is not None:
+                self._actual = None
+                self._retirados.append((actual[1], time.monotonic()))
+        self._borrar_retirados()
+        return None
+
+    def _guardar(self, clave: Tuple[MarcaTablaCentral, int], ruta: str, nombre_descarga: str):
+        with self._lock:
+            anterior, self._actual = self._actual, (clave, ruta, nombre_descarga)
+            if anterior and anterior[1] != ruta:
+                self._retirados.append((anterior[1], time.monotonic()))
+        self._borrar_retirados()
+
+    def _borrar_retirados(self):
+        limite = time.monotonic() - PLAZO_BORRADO
+        with self._lock:
+            vencidos = [ruta for ruta, instante in self._retirados if instante <= limite]
+            self._retirados = [(ruta, instante) for ruta, instante in self._retirados if instante > limite]
+        for ruta in vencidos:
+            _borrar(ruta)
+
+    def stream(self, nombre_base: str, max_filas: int,
+               abrir_sesion: Callable[[], Session] = SessionLocal) -> Iterator[bytes]:
+        """
+        Genera el ZIP por trozos (stream_zip_with_csv_and_xlsx) y a la vez lo copia al
+        spool; si termina entero, queda en caché con la marca leída en la misma
+        instantánea (REPEATABLE READ) que las filas. Si se corta, se borra la copia.
+        """
+        ruta = os.path.join(self.directorio, f"{nombre_base}_{uuid.uuid4().hex[:8]}.zip")
+        completo = False
+        try:
+            with abrir_sesion() as db, open(ruta, "wb") as copia:
+                db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+                marca = leer_marca(db)
+                for trozo in stream_zip_with_csv_and_xlsx(nombre_base, db, max_filas):
+                    copia.write(trozo)
+                    yield trozo
+            completo = True
+        finally:
+            if completo:
+                self._guardar((marca, max_filas), ruta, nombre_base + ".zip")
+            else:
+                _borrar(ruta)
+
+    def precalentar(self):
+        """
+        Genera y guarda el ZIP (con el reparto configurado) si hay filas pendientes y
+        no está ya en caché (tras una asignación).
+        """
+        try:
+            max_filas = get_config().MASS_UPLOAD_MAX_ROWS
+            with JobsSessionLocal() as db:
+                marca = leer_marca(db)
+            if self.obtener(marca, max_filas) or marca.pendientes == 0:
+                return
+            for _ in self.stream(nombre_mass_upload(), max_filas, JobsSessionLocal):
+                pass
+        except Exception as e:
+            # Es solo una optimización: la descarga lo generará si hace falta
+            print(f"[cache_mass_upload] No se pudo precalentar el ZIP: {e}", flush=True)
+
+
+def _borrar(ruta: str):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+# Instancia global de CacheMassUpload
+cache_mass_upload = CacheMassUpload(upload_store.spool_dir)
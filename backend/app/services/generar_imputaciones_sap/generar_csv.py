@@ -1,16 +1,53 @@
 # PATH: backend/app/services/generar_imputaciones_sap/generar_csv.py
 
+import io
 import os
 import csv
-import pandas as pd
-from datetime import datetime
+import json
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime
+from typing import Iterator, List, NamedTuple, Optional
+from sqlalchemy import func, select, text
 from sqlalchemy.orm import Session
+from app.core.config import get_config
+from app.db.session import SessionLocal
 from app.models.models import TablaCentral
-from zipfile import ZipFile
-from openpyxl.utils import get_column_letter
+from zipfile import ZipFile, ZIP_DEFLATED
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 
-def fetch_data(db: Session) -> pd.DataFrame:
-    query = db.query(
+# Filas por lote del cursor de servidor al generar el ZIP
+TAMANO_LOTE_LECTURA = 5000
+# Bytes por trozo al copiar el XLSX terminado a su entrada del ZIP
+TAMANO_BLOQUE_COPIA = 1024 * 1024
+
+FORMATO_FECHA_CSV = "%d/%m/%Y"
+FORMATO_FECHA_XLSX = "DD/MM/YYYY"
+
+# Columnas del fichero de carga masiva de SAP, en orden
+COLUMNAS_MASS_UPLOAD = [
+    "Employee_Number",
+    "Date",
+    "HourType",
+    "Project",
+    "Wbs",
+    "Cost Center",
+    "Activity Type",
+    "ProductionOrder",
+    "Operation",
+    "OperationActivity",
+    "Hours",
+    "Status",
+    "Serial Number",
+]
+
+def _consulta_pendientes(id_desde: Optional[int] = None, id_hasta: Optional[int] = None):
+    consulta = select(
         TablaCentral.Employee_Number,
         TablaCentral.Date,
         TablaCentral.HourType,
@@ -18,11 +55,13 @@ def fetch_data(db: Session) -> pd.DataFrame:
         TablaCentral.Operation,
         TablaCentral.OperationActivity,
         TablaCentral.Hours
-    ).filter(TablaCentral.Cargado_SAP == False)
-
-    result = db.execute(query.statement)
-    df = pd.DataFrame(result.fetchall(), columns=result.keys())
-    return df
+    ).where(TablaCentral.Cargado_SAP == False).order_by(TablaCentral.ID)
+    # Siempre en orden de ID: el CSV y el XLSX salen de pasadas distintas y deben listar
+    # las filas igual (y cada generación dar el mismo fichero)
+    if id_desde is not None:
+        # Una parte del ZIP: su rango de la clave primaria
+        consulta = consulta.where(TablaCentral.ID.between(id_desde, id_hasta))
+    return consulta
 
 def map_hourtype(op_act, original_hourtype):
     if isinstance(op_act, str):
@@ -34,92 +73,306 @@ def map_hourtype(op_act, original_hourtype):
             return 5
     return original_hourtype
 
-def generate_zip_with_csv_and_xlsx(db: Session) -> str:
+def nombre_mass_upload() -> str:
+    """Nombre base (sin extensión) del ZIP y de los ficheros que contiene."""
+    return f"mass_upload_{datetime.now():%Y%m%d_%H%M%S}"
+
+def _lotes_pendientes(db: Session, id_desde: Optional[int] = None, id_hasta: Optional[int] = None):
+    """Filas pendientes en lotes, con un cursor de servidor (no se cargan todas)."""
+    consulta = _consulta_pendientes(id_desde, id_hasta)
+    resultado = db.execute(consulta.execution_options(yield_per=TAMANO_LOTE_LECTURA))
+    yield from resultado.partitions()
+
+def _fila_mass_upload(fila) -> list:
     """
-    Genera un ZIP con dos ficheros (CSV + XLSX) a partir de las filas de TablaCentral
-    donde Cargado_SAP == False.
+    Fila de TablaCentral → valores en el orden de COLUMNAS_MASS_UPLOAD (Date como date).
+    Las columnas vacías van como None: campo vacío en el CSV y celda sin escribir en el XLSX.
+    """
+    employee, fecha, hourtype, production_order, operation, op_act, hours = fila
+    return [
+        employee,
+        fecha,
+        map_hourtype(op_act, hourtype),
+        None, None, None, None,  # Project, Wbs, Cost Center, Activity Type: vacías
+        production_order,
+        operation,
+        op_act,
+        hours,
+        None, None,              # Status, Serial Number: vacías
+    ]
 
-    •  El CSV usa ‘;’ como separador y codificación cp1252 (idéntico a antes).
-    •  Se **elimina** la comilla simple que se añadía delante de
-        ProductionOrder, Operation y OperationActivity.
+def _fila_csv(fila) -> list:
+    valores = _fila_mass_upload(fila)
+    if valores[1] is not None:
+        valores[1] = valores[1].strftime(FORMATO_FECHA_CSV)
+    return valores
+
+
+class _SalidaZip:
+    """
+    Destino de ZipFile sin seek: guarda lo que escribe el ZIP hasta que el
+    generador lo entrega. ZipFile detecta que no es posicionable y escribe los
+    tamaños/CRC de cada entrada detrás de sus datos (data descriptor).
     """
-    data = fetch_data(db)
-    if data.empty:
-        return None
 
-    # 1) Asegurar que Date sea datetime64 para formateo correcto en CSV y XLSX
-    data["Date"] = pd.to_datetime(data["Date"])
+    def __init__(self):
+        self._partes = []
 
-    # 2) Columnas extra vacías
-    for col in [
-        "Project",
-        "Wbs",
-        "Cost Center",
-        "Activity Type",
-        "Status",
-        "Serial Number",
-    ]:
-        data[col] = ""
+    def write(self, datos) -> int:
+        self._partes.append(bytes(datos))
+        return len(datos)
 
-    # 3) Ajustar HourType según OperationActivity
-    data["HourType"] = [
-        map_hourtype(a, h) for a, h in zip(data["OperationActivity"], data["HourType"])
-    ]
+    def flush(self):
+        pass
 
-    # 4) Columnas finales y reordenación
-    cols_final = [
-        "Employee_Number",
-        "Date",
-        "HourType",
-        "Project",
-        "Wbs",
-        "Cost Center",
-        "Activity Type",
-        "ProductionOrder",
-        "Operation",
-        "OperationActivity",
-        "Hours",
-        "Status",
-        "Serial Number",
-    ]
-    data_final = data[cols_final]
-
-    # 5) Rutas temporales
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    base_name = f"mass_upload_{timestamp}"
-    tmp_dir = os.path.join(os.getcwd(), "tmp_csv_sap")
-    os.makedirs(tmp_dir, exist_ok=True)
-
-    csv_path = os.path.join(tmp_dir, base_name + ".csv")
-    xlsx_path = os.path.join(tmp_dir, base_name + ".xlsx")
-    zip_path = os.path.join(tmp_dir, base_name + ".zip")
-
-    # 6) Guardar CSV con fechas dd/mm/YYYY
-    data_final.to_csv(
-        csv_path,
-        sep=";",
-        encoding="cp1252",
-        index=False,
-        lineterminator="\r\n",
-        quoting=csv.QUOTE_MINIMAL,
-        date_format="%d/%m/%Y",
-    )
-
-    # 7) Guardar XLSX con fechas como celdas de fecha reales (formato DD/MM/YYYY)
-    with pd.ExcelWriter(xlsx_path, engine="openpyxl",
-                        date_format="DD/MM/YYYY",
-                        datetime_format="DD/MM/YYYY") as writer:
-        data_final.to_excel(writer, index=False)
-        ws = writer.sheets["Sheet1"]
-        # Buscar la columna "Date" y forzar el number_format en todas sus celdas
-        date_col_idx = cols_final.index("Date") + 1  # 1-based
-        date_col_letter = get_column_letter(date_col_idx)
-        for cell in ws[date_col_letter][1:]:  # skip header
-            cell.number_format = "DD/MM/YYYY"
-
-    # 8) Empaquetar ZIP
-    with ZipFile(zip_path, "w") as z:
-        z.write(csv_path, arcname=os.path.basename(csv_path))
-        z.write(xlsx_path, arcname=os.path.basename(xlsx_path))
-
-    return zip_path
+    def vaciar(self) -> bytes:
+        datos = b"".join(self._partes)
+        self._partes = []
+        return datos
+
+
+class ParteMassUpload(NamedTuple):
+    """Rango de IDs de Tabla_Central (pendientes) que va en un mismo CSV/XLSX."""
+    numero: int
+    filas: int
+    id_desde: int
+    id_hasta: int
+    fecha_desde: Optional[date]
+    fecha_hasta: Optional[date]
+
+
+def stream_zip_with_csv_and_xlsx(nombre_base: str, db: Session = None,
+                                 max_filas: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Genera por trozos un ZIP (deflate) con CSV + XLSX a partir de las filas de
+    TablaCentral donde Cargado_SAP == False, para devolverlo con StreamingResponse.
+
+    •  El CSV usa ‘;’ como separador, codificación cp1252, fin de línea \\r\\n y
+       fechas dd/mm/YYYY (idéntico a antes).
+    •  Con `max_filas` (por defecto MASS_UPLOAD_MAX_ROWS; 0 => sin límite; nunca
+       menos de MASS_UPLOAD_MIN_ROWS) y más
+       pendientes que ese límite, las filas se reparten por rangos de ID en varias
+       partes CSV + XLSX que se generan en paralelo (ver _escribir_partes_en_zip) y el
+       ZIP lleva además un manifiesto. Si caben en una, el ZIP es el de siempre.
+    •  Sin partes, las filas se leen con un cursor de servidor en lotes de
+       TAMANO_LOTE_LECTURA y cada lote se escribe en la entrada del ZIP y se entrega.
+
+    Sin `db` abre su propia sesión (REPEATABLE READ): se consume desde el hilo que envía
+    la respuesta, después de que termine el endpoint (no puede usar la sesión de la petición).
+    """
+    if db is None:
+        with SessionLocal() as db:
+            # Una sola instantánea para los rangos de las partes y para lo que leen
+            db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+            yield from stream_zip_with_csv_and_xlsx(nombre_base, db, max_filas)
+        return
+
+    config = get_config()
+    if max_filas is None:
+        max_filas = config.MASS_UPLOAD_MAX_ROWS
+    if max_filas > 0:
+        # Cada parte es una tarea del pool y dos ficheros temporales: no menos de MASS_UPLOAD_MIN_ROWS filas
+        max_filas = max(max_filas, config.MASS_UPLOAD_MIN_ROWS)
+    partes = _partes_pendientes(db, max_filas) if max_filas > 0 else []
+
+    salida = _SalidaZip()
+    with ZipFile(salida, "w", compression=ZIP_DEFLATED) as zf:
+        if len(partes) > 1:
+            pasos = _escribir_partes_en_zip(db, zf, nombre_base, partes, max_filas)
+        else:
+            pasos = _escribir_fichero_unico_en_zip(db, zf, nombre_base)
+        try:
+            for _ in pasos:
+                yield salida.vaciar()
+        finally:
+            # Si se corta a mitad, cerrar antes la entrada abierta (ZipFile no se cierra con ella)
+            pasos.close()
+    yield salida.vaciar()
+
+
+def _escribir_fichero_unico_en_zip(db: Session, zf: ZipFile, nombre_base: str):
+    with zf.open(nombre_base + ".csv", "w") as entrada:
+        yield from _escribir_csv(_lotes_pendientes(db), entrada)
+    yield
+
+    with tempfile.TemporaryFile() as tmp:
+        yield from _escribir_xlsx(_lotes_pendientes(db), tmp)
+        tmp.seek(0)
+        yield from _copiar_a_zip(tmp, zf, nombre_base + ".xlsx")
+
+
+def _escribir_csv(lotes, destino):
+    """Escribe el CSV en `destino` (binario); cede el control (yield) tras cada lote."""
+    texto = io.TextIOWrapper(destino, encoding="cp1252", newline="")
+    writer = csv.writer(texto, delimiter=";", lineterminator="\r\n", quoting=csv.QUOTE_MINIMAL)
+    writer.writerow(COLUMNAS_MASS_UPLOAD)
+
+    for lote in lotes:
+        writer.writerows(_fila_csv(fila) for fila in lote)
+        texto.flush()
+        yield
+    texto.flush()
+    texto.detach()
+
+
+def _escribir_xlsx(lotes, destino):
+    """
+    XLSX con fechas como celdas de fecha reales (formato DD/MM/YYYY), escrito con un
+    Workbook write-only de openpyxl: cada fila se serializa al añadirla, sin mantener
+    el libro en memoria. El formato de fecha va en una única celda plantilla que se
+    reutiliza en todas las filas (un solo estilo, sin recorrer la columna después).
+
+    Cede el control (yield) tras cada lote; al final guarda el libro en `destino`
+    (ruta o fichero binario).
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    fecha = WriteOnlyCell(ws)
+    fecha.number_format = FORMATO_FECHA_XLSX
+
+    ws.append(COLUMNAS_MASS_UPLOAD)
+    for lote in lotes:
+        for fila in lote:
+            valores = _fila_mass_upload(fila)
+            fecha.value = valores[1]
+            valores[1] = fecha
+            ws.append(valores)
+        yield
+    wb.save(destino)
+
+
+def _copiar_a_zip(origen, zf: ZipFile, nombre: str):
+    """Copia un fichero ya generado a una entrada del ZIP por bloques, cediendo tras cada uno."""
+    with zf.open(nombre, "w") as entrada:
+        while bloque := origen.read(TAMANO_BLOQUE_COPIA):
+            entrada.write(bloque)
+            yield
+
+
+# ---------- Partes generadas en paralelo ----------
+
+def _partes_pendientes(db: Session, max_filas: int) -> List[ParteMassUpload]:
+    """
+    Reparte las pendientes, por orden de ID, en bloques de `max_filas` filas: cada
+    parte es un rango [id_desde, id_hasta] que se lee después por la clave primaria.
+    Una sola consulta (row_number + GROUP BY) da los rangos y los datos del manifiesto.
+    """
+    numeradas = select(
+        TablaCentral.ID,
+        TablaCentral.Date,
+        ((func.row_number().over(order_by=TablaCentral.ID) - 1) // max_filas).label("parte"),
+    ).where(TablaCentral.Cargado_SAP == False).subquery()
+    filas = db.execute(
+        select(
+            numeradas.c.parte,
+            func.count(),
+            func.min(numeradas.c.ID),
+            func.max(numeradas.c.ID),
+            func.min(numeradas.c.Date),
+            func.max(numeradas.c.Date),
+        ).group_by(numeradas.c.parte).order_by(numeradas.c.parte)
+    ).all()
+    return [ParteMassUpload(parte + 1, *resto) for parte, *resto in filas]
+
+
+_ejecutor_partes = None
+_ejecutor_partes_lock = threading.Lock()
+
+
+def _obtener_ejecutor_partes() -> ProcessPoolExecutor:
+    """
+    Pool de procesos (no hilos: generar CSV y sobre todo XLSX es CPU en Python) que se
+    crea la primera vez que se necesita. `spawn`: los procesos no heredan las
+    conexiones ni los hilos del servidor; cada uno abre su propio engine.
+    """
+    global _ejecutor_partes
+    with _ejecutor_partes_lock:
+        if _ejecutor_partes is None:
+            _ejecutor_partes = ProcessPoolExecutor(
+                max_workers=get_config().MASS_UPLOAD_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _ejecutor_partes
+
+
+def _descartar_ejecutor_partes():
+    global _ejecutor_partes
+    with _ejecutor_partes_lock:
+        _ejecutor_partes = None
+
+
+def _escribir_partes_en_zip(db: Session, zf: ZipFile, nombre_base: str,
+                            partes: List[ParteMassUpload], max_filas: int):
+    """
+    Manifiesto + una pareja CSV/XLSX por parte. Las partes se generan a la vez en el
+    pool de procesos, cada una en un fichero temporal, y se copian al ZIP en orden
+    según van estando. Todas leen la misma instantánea que esta sesión
+    (pg_export_snapshot): el ZIP es coherente aunque Tabla_Central cambie mientras tanto.
+    `db` debe estar en REPEATABLE READ para que `partes` (el manifiesto) salga de esa
+    misma instantánea; en READ COMMITTED cada sentencia vería una distinta.
+    """
+    total = len(partes)
+    nombres = [f"{nombre_base}_parte{p.numero:03d}_de_{total:03d}" for p in partes]
+    manifiesto = {
+        "nombre": nombre_base,
+        "max_filas_por_parte": max_filas,
+        "filas": sum(p.filas for p in partes),
+        "partes": [
+            {
+                "parte": p.numero,
+                "csv": nombre + ".csv",
+                "xlsx": nombre + ".xlsx",
+                "filas": p.filas,
+                "id_desde": p.id_desde,
+                "id_hasta": p.id_hasta,
+                "fecha_desde": p.fecha_desde.isoformat() if p.fecha_desde else None,
+                "fecha_hasta": p.fecha_hasta.isoformat() if p.fecha_hasta else None,
+            }
+            for p, nombre in zip(partes, nombres)
+        ],
+    }
+    zf.writestr(nombre_base + "_manifest.json", json.dumps(manifiesto, ensure_ascii=False, indent=2))
+    yield
+
+    # La instantánea se puede importar mientras siga abierta la transacción de `db`
+    instantanea = db.execute(text("SELECT pg_export_snapshot()")).scalar()
+    directorio = tempfile.mkdtemp(prefix=nombre_base + "_")
+    futuros = []
+    try:
+        ejecutor = _obtener_ejecutor_partes()
+        for p, nombre in zip(partes, nombres):
+            ruta = os.path.join(directorio, nombre)
+            futuros.append(ejecutor.submit(_generar_parte, instantanea, p.id_desde, p.id_hasta, ruta))
+
+        for futuro, nombre in zip(futuros, nombres):
+            ruta = futuro.result()
+            for extension in (".csv", ".xlsx"):
+                with open(ruta + extension, "rb") as origen:
+                    yield from _copiar_a_zip(origen, zf, nombre + extension)
+                os.remove(ruta + extension)
+    except BrokenProcessPool:
+        # Un proceso murió (p. ej. sin memoria): el siguiente ZIP creará un pool nuevo
+        _descartar_ejecutor_partes()
+        raise
+    finally:
+        # Si se corta (cliente desconectado, error), las partes que aún no empezaron no se generan
+        for futuro in futuros:
+            futuro.cancel()
+        shutil.rmtree(directorio, ignore_errors=True)
+
+
+def _generar_parte(instantanea: str, id_desde: int, id_hasta: int, ruta: str) -> str:
+    """
+    Se ejecuta en un proceso del pool: escribe `ruta`.csv y `ruta`.xlsx con las
+    pendientes del rango de IDs, leídas en la instantánea exportada por el proceso principal.
+    """
+    with SessionLocal() as db:
+        db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        db.execute(text("SET TRANSACTION SNAPSHOT :instantanea"), {"instantanea": instantanea})
+
+        with open(ruta + ".csv", "wb") as destino:
+            for _ in _escribir_csv(_lotes_pendientes(db, id_desde, id_hasta), destino):
+                pass
+        for _ in _escribir_xlsx(_lotes_pendientes(db, id_desde, id_hasta), ruta + ".xlsx"):
+            pass
+    return ruta
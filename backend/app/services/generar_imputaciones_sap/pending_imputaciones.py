@@ -1,8 +1,9 @@
 # PATH: backend/app/services/generar_imputaciones_sap/pending_imputaciones.py
 
-from sqlalchemy.orm import Session
-from sqlalchemy.sql import or_
-from app.models.models import Imputaciones, TablaCentral
+from sqlalchemy import func, select, exists
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql import or_, and_
+from app.models.models import Imputaciones, TablaCentral, SapOrders, ProjectsDictionary
 
 def get_imputaciones_pendientes_count(db: Session) -> int:
     return db.query(Imputaciones).outerjoin(TablaCentral).filter(
@@ -12,16 +13,87 @@ def get_imputaciones_pendientes_count(db: Session) -> int:
         )
     ).count()
 
-def get_imputaciones_pendientes(db: Session):
+def get_imputaciones_pendientes_modelos(db: Session, solo_requieren_asignacion: bool = False):
     """
-    Devuelve las imputaciones que no tienen entrada en Tabla_Central o las que tienen Cargado_SAP = False.
+    Devuelve los objetos Imputaciones que no tienen entrada en Tabla_Central o las que tienen Cargado_SAP = False.
+    Con `solo_requieren_asignacion`, solo las que hay que (re)resolver (ver filtro_requiere_asignacion).
     """
-    results = db.query(Imputaciones).outerjoin(TablaCentral).filter(
+    query = db.query(Imputaciones).outerjoin(TablaCentral).filter(
         or_(
             TablaCentral.ID == None,
             TablaCentral.Cargado_SAP == False
         )
-    ).all()
+    )
+    if solo_requieren_asignacion:
+        query = query.filter(filtro_requiere_asignacion())
+    return query.all()
+
+def get_version_sap_orders(db: Session) -> int:
+    """
+    Versión actual de la carga de SapOrders: su mayor ID. Sap_Orders solo recibe
+    inserciones (cargar_datos_sap_en_db), así que una orden con ID mayor que la
+    versión guardada en una imputación es una orden que no se consideró al resolverla.
+    """
+    return db.query(func.max(SapOrders.ID)).scalar() or 0
+
+def filtro_requiere_asignacion():
+    """
+    Condición sobre Imputaciones: nunca resuelta (SapOrdersVersion NULL) o con alguna
+    SapOrder activa posterior a su versión que podría cambiar el resultado:
+      - misma TipoIndirecto + TipoMotivo (coincidencia GG),
+      - Operation = Tarea, NULL con NULL como en el motor en memoria (resolución
+        de operation/operationActivity),
+      - Project = ProyectoSap de la imputación (match exacto).
+    Es un superconjunto de las afectadas: reprocesar de más no cambia el resultado.
+    Los cambios en Areas, Projects_Dictionary y Extraciclos no se detectan; para
+    ellos está el recálculo completo.
+    """
+    proyecto_sap = (
+        select(ProjectsDictionary.ProyectoSap)
+        .where(ProjectsDictionary.ProyectoBaan == Imputaciones.Proyecto)
+        .correlate(Imputaciones)
+        .scalar_subquery()
+    )
+
+    def hay_nuevas(condicion):
+        nuevas = aliased(SapOrders)
+        return exists().where(
+            condicion(nuevas),
+            nuevas.ID > Imputaciones.SapOrdersVersion,
+            nuevas.ActiveOrder == True,
+        )
+
+    # Un EXISTS por condición (no un OR dentro de uno): cada uno es un rango
+    # (clave, ID > versión) en su índice parcial (ix_sap_orders_gg / _operation / _proyecto),
+    # sin recorrer todas las SapOrders posteriores a la versión. Tarea NULL va aparte con
+    # IS NULL: IS NOT DISTINCT FROM no admite ese rango en el índice
+    return or_(
+        Imputaciones.SapOrdersVersion == None,
+        hay_nuevas(lambda so: and_(so.TipoIndirecto == Imputaciones.TipoIndirecto, so.TipoMotivo == Imputaciones.TipoMotivo)),
+        hay_nuevas(lambda so: so.Operation == Imputaciones.Tarea),
+        hay_nuevas(lambda so: and_(Imputaciones.Tarea == None, so.Operation == None)),
+        hay_nuevas(lambda so: so.Project == proyecto_sap),
+    )
+
+def marcar_version_pendientes(db: Session, version: int) -> int:
+    """
+    Guarda `version` en todas las imputaciones pendientes (sin fila en Tabla_Central
+    con Cargado_SAP = True): las recién resueltas y las que no necesitaban reprocesarse.
+    """
+    cargada = exists().where(
+        TablaCentral.imputacion_id == Imputaciones.ID,
+        TablaCentral.Cargado_SAP == True
+    )
+    return db.query(Imputaciones).filter(
+        or_(Imputaciones.SapOrdersVersion == None, Imputaciones.SapOrdersVersion < version),
+        ~cargada
+    ).update({Imputaciones.SapOrdersVersion: version}, synchronize_session=False)
+
+def get_imputaciones_pendientes(db: Session):
+    """
+    Devuelve las imputaciones que no tienen entrada en Tabla_Central o las que tienen Cargado_SAP = False.
+    """
+    results = get_imputaciones_pendientes_modelos(db)
 
     imputaciones_list = []
     for imp in results:
@@ -1,22 +1,17 @@
 # PATH: backend/app/services/generar_imputaciones_sap/utils/_assign_sap_orders.py
 
-from typing import List, Tuple, Optional
-from sqlalchemy.orm import Session
-from sqlalchemy import desc
-from app.models.models import (
-    Imputaciones, SapOrders, Areas, Extraciclos, ProjectsDictionary
-)
-
+from typing import Tuple, Optional
+from app.core.registro_progreso import RegistroProgreso
 from app.models.models import Imputaciones
+from ._indice_sap_orders import IndiceSapOrders, SapOrderRef
 
 # -------------------------------------------------------------------------------------
-# FUNCIONES DE TRADUCCIÓN (copiadas tal cual, con leves retoques de import)
+# FUNCIONES DE TRADUCCIÓN (resueltas contra los índices en memoria de la ejecución)
 # -------------------------------------------------------------------------------------
-def obtener_operation_via_db(
+def obtener_operation(
     imp: Imputaciones,
-    db: Session,
-    extraciclos: List[Extraciclos],
-    logs: List[str]
+    indice: IndiceSapOrders,
+    logs: RegistroProgreso
 ) -> Tuple[Optional[str], Optional[str]]:
     """
     1) Si TareaAsoc => buscar extraciclos
@@ -24,60 +19,40 @@ def obtener_operation_via_db(
     """
     # 1) TareaAsoc => ver extraciclos
     if imp.TareaAsoc:
-        extraciclo_correspondiente = next(
-            (c for c in extraciclos if c.AreaTarea == imp.AreaTarea), None
-        )
+        extraciclo_correspondiente = indice.extraciclos.get(imp.AreaTarea)
         if extraciclo_correspondiente and extraciclo_correspondiente.OASAP:
             partes = extraciclo_correspondiente.OASAP.split('-')
             return (partes[0], extraciclo_correspondiente.OASAP)
 
     # 2) Buscar por imp.Tarea directamente
-    so2 = (
-        db.query(SapOrders)
-        .filter(
-            SapOrders.ActiveOrder == True,
-            SapOrders.Operation == imp.Tarea
-        )
-        .order_by(desc(SapOrders.TimestampInput))
-        .first()
-    )
+    so2 = indice.orden_por_operation(imp.Tarea)
     if so2:
         return (so2.Operation, so2.OperationActivity)
 
     return (None, None)
 
 
-def obtener_proyecto_sap(proyecto_baan: str, db: Session) -> str:
+def obtener_proyecto_sap(proyecto_baan: str, indice: IndiceSapOrders) -> str:
     """
     Retorna el ProyectoSap correspondiente, si existe.
     """
-    project_dict_entry = db.query(ProjectsDictionary).filter(
-        ProjectsDictionary.ProyectoBaan == proyecto_baan
-    ).first()
-    return project_dict_entry.ProyectoSap if project_dict_entry else None
+    return indice.proyecto_sap.get(proyecto_baan)
 
 # -------------------------------------------------------------------------------------
 # OBTENER SAP_ORDER => con coincidencias EXACTAS y picking la de mayor TimestampInput
 # -------------------------------------------------------------------------------------
-def obtener_sap_order_id_y_production_order_via_db(
-    db: Session,
+def obtener_sap_order_id_y_production_order(
+    indice: IndiceSapOrders,
     proyecto_sap: str,
     imp: Imputaciones,
     operation_activity: str,
-    logs: List[str]
+    logs: RegistroProgreso
 ):
-    coincidencia = (
-        db.query(SapOrders)
-        .filter(
-            SapOrders.ActiveOrder == True,
-            SapOrders.Project == proyecto_sap,
-            SapOrders.Vertice == imp.TipoCoche,
-            SapOrders.CarNumber == imp.NumCoche,
-            SapOrders.OperationActivity == operation_activity
-        )
-        .order_by(desc(SapOrders.TimestampInput))
-        .first()
-    )
+    # Se compara la clave tipada NumCocheInt con SapOrders.CarNumber; un NumCoche
+    # informado pero no numérico no coincide con ninguna orden
+    if imp.NumCoche is not None and imp.NumCocheInt is None:
+        return None, None
+    coincidencia = indice.orden_exacta(proyecto_sap, imp.TipoCoche, imp.NumCocheInt, operation_activity)
 
     if coincidencia:
         return coincidencia.ID, coincidencia.Order
@@ -86,36 +61,20 @@ def obtener_sap_order_id_y_production_order_via_db(
 
 def obtener_sap_order_gg(
     imp: Imputaciones,
-    db: Session,
-    logs: List[str]
-) -> Optional[SapOrders]:
+    indice: IndiceSapOrders,
+    logs: RegistroProgreso
+) -> Optional[SapOrderRef]:
     """
     Devuelve la SapOrder coincidente si hay TipoMotivo + TipoIndirecto
     y la Operation esperada desde Areas (OpGG), sin ceros a la izquierda.
     """
     if imp.TipoMotivo and imp.TipoIndirecto:
-        area_relacionada = db.query(Areas).filter(
-            Areas.CentroTrabajo == imp.CentroTrabajo
-        ).first()
-
-        opgg = area_relacionada.OpGG if area_relacionada and area_relacionada.OpGG else None
+        opgg = indice.opgg_por_centro.get(imp.CentroTrabajo)
 
         if opgg:
-            so = (
-                db.query(SapOrders)
-                .filter(
-                    SapOrders.ActiveOrder == True,
-                    SapOrders.TipoIndirecto == imp.TipoIndirecto,
-                    SapOrders.TipoMotivo == imp.TipoMotivo,
-                    SapOrders.Operation == opgg
-                )
-                .order_by(desc(SapOrders.TimestampInput))
-                .first()
-            )
+            so = indice.orden_gg(imp.TipoIndirecto, imp.TipoMotivo, opgg)
             if so:
-                logs.append(f"✅ Coincidencia por TipoIndirecto/Motivo con Operation='{opgg}' encontrada.")
+                logs.detalle(f"✅ Coincidencia por TipoIndirecto/Motivo con Operation='{opgg}' encontrada.")
                 return so
 
     return None
-
-
@@ -0,0 +1,84 @@
+# PATH: backend/app/services/generar_imputaciones_sap/utils/_indice_sap_orders.py
+
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from app.models.models import SapOrders, Areas, ProjectsDictionary
+from app.services.utils.extraciclos_cache import extraciclos_cache, Extraciclo
+
+
+class SapOrderRef(NamedTuple):
+    """Campos de SapOrders que necesita la asignación (copia sin sesión)."""
+    ID: int
+    Order: Optional[str]
+    Operation: Optional[str]
+    OperationActivity: Optional[str]
+
+
+class IndiceSapOrders:
+    """
+    Índices en memoria de las tablas maestras usadas en la asignación, cargados una
+    vez por ejecución. Cada índice guarda, por clave, la SapOrder activa que
+    devolvería `ORDER BY TimestampInput DESC LIMIT 1` (NULL primero, como en
+    PostgreSQL; a igualdad de TimestampInput, la de mayor ID).
+    Para la clave exacta basta la fila vigente (IsCurrent), que ya es la ganadora
+    de su clave lógica; Operation y GG siguen eligiendo entre todas las activas.
+    Las claves se comparan igual que el `==` de SQLAlchemy: None equivale a IS NULL.
+    """
+
+    def __init__(self):
+        # Operation -> orden (búsqueda por imp.Tarea)
+        self.por_operation: Dict[Optional[str], SapOrderRef] = {}
+        # (TipoIndirecto, TipoMotivo, Operation) -> orden (GG)
+        self.por_gg: Dict[Tuple, SapOrderRef] = {}
+        # (Project, Vertice, CarNumber, OperationActivity) -> orden (match exacto)
+        self.por_clave_exacta: Dict[Tuple, SapOrderRef] = {}
+        # CentroTrabajo -> OpGG
+        self.opgg_por_centro: Dict[str, Optional[str]] = {}
+        # ProyectoBaan -> ProyectoSap
+        self.proyecto_sap: Dict[str, Optional[str]] = {}
+        # AreaTarea -> Extraciclo
+        self.extraciclos: Dict[str, Extraciclo] = {}
+
+    @classmethod
+    def cargar(cls, db: Session) -> "IndiceSapOrders":
+        indice = cls()
+
+        filas = db.query(
+            SapOrders.ID,
+            SapOrders.Order,
+            SapOrders.Operation,
+            SapOrders.OperationActivity,
+            SapOrders.Project,
+            SapOrders.Vertice,
+            SapOrders.CarNumber,
+            SapOrders.TipoIndirecto,
+            SapOrders.TipoMotivo,
+            SapOrders.TimestampInput,
+            SapOrders.IsCurrent,
+        ).filter(SapOrders.ActiveOrder == True).all()
+
+        # De menos a más reciente: la última escrita en cada clave es la que gana
+        filas.sort(key=lambda f: (f.TimestampInput is None, f.TimestampInput or datetime.min, f.ID))
+        for f in filas:
+            ref = SapOrderRef(f.ID, f.Order, f.Operation, f.OperationActivity)
+            indice.por_operation[f.Operation] = ref
+            indice.por_gg[(f.TipoIndirecto, f.TipoMotivo, f.Operation)] = ref
+            if f.IsCurrent:
+                indice.por_clave_exacta[(f.Project, f.Vertice, f.CarNumber, f.OperationActivity)] = ref
+
+        indice.opgg_por_centro = dict(db.query(Areas.CentroTrabajo, Areas.OpGG).all())
+        indice.proyecto_sap = dict(db.query(ProjectsDictionary.ProyectoBaan, ProjectsDictionary.ProyectoSap).all())
+        indice.extraciclos = {e.AreaTarea: e for e in extraciclos_cache.todos(db)}
+        return indice
+
+    def orden_por_operation(self, operation: Optional[str]) -> Optional[SapOrderRef]:
+        return self.por_operation.get(operation)
+
+    def orden_gg(self, tipo_indirecto: str, tipo_motivo: str, operation: str) -> Optional[SapOrderRef]:
+        return self.por_gg.get((tipo_indirecto, tipo_motivo, operation))
+
+    def orden_exacta(self, proyecto_sap: str, vertice: Optional[str], car_number: Optional[int], operation_activity: str) -> Optional[SapOrderRef]:
+        return self.por_clave_exacta.get((proyecto_sap, vertice, car_number, operation_activity))
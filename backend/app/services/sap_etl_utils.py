@@ -2,8 +2,46 @@
 
 import pandas as pd
 from app.models.models import SapOrders
+from sqlalchemy import func, text
 from sqlalchemy.orm import Session
 from app.core.sse_manager import sse_manager
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado, SIN_CANCELACION
+from app.db.bloqueos import CLAVE_CARGA_SAP_ORDERS, bloquear_transaccion
+
+# Filas por bulk_insert_mappings entre comprobaciones de cancelación
+TAMANO_LOTE_INSERCION = 5000
+
+# Fila vigente (IsCurrent) de cada clave lógica (Project, Vertice, CarNumber, OperationActivity):
+# la activa más reciente, con el mismo orden que usaban las búsquedas
+# (TimestampInput DESC, NULL primero; a igualdad, mayor ID). Solo se recalculan las
+# claves con filas de ID > :desde_id (las recién insertadas; 0 = todas).
+# La clave se compara como el texto de ROW(...): NULL coincide con NULL (como el índice
+# NULLS NOT DISTINCT) y el filtro de claves es un hash semi-join, no un nested loop
+# sobre IS NOT DISTINCT FROM.
+_SQL_VIGENCIA = '''
+WITH claves AS (
+    SELECT DISTINCT ROW("Project", "Vertice", "CarNumber", "OperationActivity")::text AS clave
+    FROM "Sap_Orders"
+    WHERE "ID" > :desde_id
+),
+vigencia AS (
+    SELECT "ID",
+           "ActiveOrder" IS TRUE AND row_number() OVER (
+               PARTITION BY clave
+               ORDER BY "ActiveOrder" IS TRUE DESC, "TimestampInput" DESC, "ID" DESC
+           ) = 1 AS vigente
+    FROM (
+        SELECT "ID", "ActiveOrder", "TimestampInput",
+               ROW("Project", "Vertice", "CarNumber", "OperationActivity")::text AS clave
+        FROM "Sap_Orders"
+    ) so
+    WHERE clave IN (SELECT clave FROM claves)
+)
+UPDATE "Sap_Orders" so
+SET "IsCurrent" = v.vigente
+FROM vigencia v
+WHERE so."ID" = v."ID" AND v.vigente = :vigente AND so."IsCurrent" <> v.vigente
+'''
 
 def verificar_columnas_excel(df: pd.DataFrame, columnas_necesarias: list):
     """
@@ -51,7 +89,17 @@ def transformar_datos_sap(df: pd.DataFrame) -> pd.DataFrame:
     ]
     return df[columnas_modelo]
 
-def cargar_datos_sap_en_db(df: pd.DataFrame, db_session: Session, process_id: str) -> int:
+def cargar_datos_sap_en_db(df: pd.DataFrame, db_session: Session, process_id: str,
+                           cancelacion: TokenCancelacion = SIN_CANCELACION) -> int:
+    """
+    Inserta en SapOrders las filas cuya combinación (OA, Effectivity, Order) no exista
+    y actualiza IsCurrent en las claves afectadas (actualizar_vigencia_sap_orders).
+    Todo se confirma en un único commit: si se cancela entre lotes, se deshace la
+    inserción completa y se lanza ProcesoCancelado. Las cargas concurrentes se
+    serializan con un advisory lock.
+    """
+    bloquear_transaccion(db_session, CLAVE_CARGA_SAP_ORDERS)
+    id_previo = db_session.query(func.max(SapOrders.ID)).scalar() or 0
     df['Order'] = df['Order'].astype(str)
 
     existentes = db_session.query(
@@ -74,11 +122,28 @@ def cargar_datos_sap_en_db(df: pd.DataFrame, db_session: Session, process_id: st
             nuevos_registros.append(clean_row)
 
     if nuevos_registros:
-        db_session.bulk_insert_mappings(SapOrders, nuevos_registros)
-        db_session.commit()
+        try:
+            for inicio in range(0, len(nuevos_registros), TAMANO_LOTE_INSERCION):
+                cancelacion.comprobar()
+                db_session.bulk_insert_mappings(SapOrders, nuevos_registros[inicio:inicio + TAMANO_LOTE_INSERCION])
+            cancelacion.comprobar()
+            actualizar_vigencia_sap_orders(db_session, id_previo)
+            db_session.commit()
+        except ProcesoCancelado:
+            db_session.rollback()
+            raise
         return len(nuevos_registros)
     else:
         sse_manager.send_message(process_id, "🟡 No hay registros nuevos para insertar.")
         return 0
 
 
+def actualizar_vigencia_sap_orders(db_session: Session, desde_id: int = 0):
+    """
+    Recalcula IsCurrent en las claves lógicas con filas de ID > `desde_id`
+    (0 = todas; útil si se cambia ActiveOrder a mano). No hace commit.
+    Primero se desmarcan las que dejan de ser vigentes y después se marcan las
+    nuevas, para no chocar con el índice único parcial uq_sap_orders_vigente.
+    """
+    for vigente in (False, True):
+        db_session.execute(text(_SQL_VIGENCIA), {"desde_id": desde_id, "vigente": vigente})
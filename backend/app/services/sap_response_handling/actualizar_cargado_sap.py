@@ -1,11 +1,15 @@
 # PATH: backend/app/services/sap_response_handling/actualizar_cargado_sap.py
 
 from __future__ import annotations
+import io
 import pandas as pd
 
+from app.core.metricas import MedidorEtapas
+from app.core.cancelacion import TokenCancelacion, ProcesoCancelado, SIN_CANCELACION
 from app.db.session import database_session
-from app.models.models import TablaCentral, Imputaciones
-from sqlalchemy import or_, func, true, false
+from app.services.utils.imputaciones_utils import horas_centesimas
+from sqlalchemy import text
+from sqlalchemy.orm import Session
 
 def _clean_str(value) -> str | None:
     if pd.isna(value):
@@ -13,16 +17,6 @@ def _clean_str(value) -> str | None:
     return str(value).strip()
 
 
-def _safe_float(value) -> float | None:
-    """
-    Convierte a float; devuelve None si NaN o conversion imposible.
-    """
-    try:
-        return round(float(value), 2)
-    except Exception:
-        return None
-
-
 def leer_datos_excel(path: str):
     try:
         df = pd.read_excel(path, engine="openpyxl", dtype=str)
@@ -31,13 +25,121 @@ def leer_datos_excel(path: str):
         print(f"[leer_datos_excel] Error: {e}")
         return None, False
 
+# --------------------------------------------------------------------------
+#                     CONCILIACIÓN EN BLOQUE
+# --------------------------------------------------------------------------
+# Las filas del Excel se cargan con COPY en una tabla temporal (se borra al confirmar)
+# y se cruzan con las pendientes de Tabla_Central en una sola sentencia.
+_SQL_STAGING = text("""
+CREATE TEMP TABLE respuesta_sap_staging (
+    n                  integer,
+    employee_number    varchar,
+    fecha              date,
+    production_order   bigint,
+    operation_activity varchar,
+    hours_cent         integer,
+    success            boolean
+) ON COMMIT DROP
+""")
+
+_SQL_COPY_STAGING = (
+    "COPY respuesta_sap_staging (n, employee_number, fecha, production_order, "
+    "operation_activity, hours_cent, success) FROM STDIN"
+)
+
+# Misma semántica que el bucle fila a fila anterior:
+#   - Cada fila Success marca como mucho una fila pendiente con su misma clave
+#     (Employee_Number, Date, ProductionOrder, OperationActivity, HoursCent); las
+#     filas repetidas del Excel marcan filas distintas. Para eso se numeran las
+#     repeticiones de cada clave en los dos lados y se cruzan (clave, orden).
+#   - NULL coincide con NULL (antes `== None` → IS NULL): la clave se compara como el
+#     texto de ROW(...), que distingue NULL de '' y permite un hash join.
+# El UPDATE va en una CTE; el SELECT final devuelve los tres conteos en la misma ida.
+_SQL_CONCILIACION = text("""
+WITH
+excel AS (
+    SELECT clave, row_number() OVER (PARTITION BY clave ORDER BY n) AS orden
+    FROM (
+        SELECT n, ROW(employee_number, fecha, production_order, operation_activity, hours_cent)::text AS clave
+        FROM respuesta_sap_staging
+        WHERE success
+    ) s
+),
+pendientes AS (
+    SELECT "ID", clave, row_number() OVER (PARTITION BY clave ORDER BY "ID") AS orden
+    FROM (
+        SELECT tc."ID",
+               ROW(tc."Employee_Number", tc."Date", tc."ProductionOrder",
+                   tc."OperationActivity", tc."HoursCent")::text AS clave
+        FROM "Tabla_Central" tc
+        WHERE tc."Cargado_SAP" = false
+    ) t
+    WHERE clave IN (SELECT clave FROM excel)
+),
+actualizadas AS (
+    UPDATE "Tabla_Central" tc
+    SET "Cargado_SAP" = true
+    FROM pendientes p
+    JOIN excel e ON e.clave = p.clave AND e.orden = p.orden
+    WHERE tc."ID" = p."ID"
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM respuesta_sap_staging) AS total,
+    (SELECT count(*) FROM respuesta_sap_staging WHERE success) AS success,
+    (SELECT count(*) FROM actualizadas) AS actualizados
+""")
+
+_ESCAPES_COPY = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _valor_copy(valor) -> str:
+    """Valor en el formato text de COPY (\\N para nulos)."""
+    if valor is None or pd.isna(valor):
+        return "\\N"
+    return str(valor).translate(_ESCAPES_COPY)
+
+
+def _cargar_staging(db: Session, df: pd.DataFrame) -> None:
+    """Crea la tabla temporal y vuelca en ella el Excel ya normalizado con un único COPY."""
+    db.execute(_SQL_STAGING)
+    columnas = (
+        range(len(df)),
+        df.iloc[:, 0],   # Employee_Number
+        df.iloc[:, 1],   # Date
+        df.iloc[:, 7].astype("Int64"),   # ProductionOrder
+        df.iloc[:, 9],                   # OperationActivity
+        df.iloc[:, 10].astype("Int64"),  # HoursCent (con algún nulo, pandas lo deja en float)
+        df.iloc[:, 12] == "Success",
+    )
+    datos = io.StringIO()
+    for fila in zip(*columnas):
+        datos.write("\t".join(map(_valor_copy, fila)))
+        datos.write("\n")
+    datos.seek(0)
+    # COPY por el cursor de psycopg2 de la conexión de la sesión (misma transacción)
+    with db.connection().connection.cursor() as cursor:
+        cursor.copy_expert(_SQL_COPY_STAGING, datos)
+
+
 # --------------------------------------------------------------------------
 #                     FUNCIONES PRINCIPALES
 # --------------------------------------------------------------------------
-def actualizar_cargado_sap(df: pd.DataFrame) -> bool:
+def actualizar_cargado_sap(
+    df: pd.DataFrame,
+    resumen: dict | None = None,
+    cancelacion: TokenCancelacion = SIN_CANCELACION,
+    db: Session | None = None,
+) -> bool:
     """
     Marca `Cargado_SAP = True` para filas con estado **Success**.
     Las conversiones se adaptan a los tipos de la BD.
+    El Excel se carga con COPY en una tabla temporal y se concilia con una única
+    sentencia UPDATE ... FROM (ver _SQL_CONCILIACION) que devuelve a la vez
+    total / success / actualizados; si se pasa `resumen`, se rellenan en él.
+    Todas las marcas se confirman en un único commit; si se cancela antes,
+    se deshacen y se lanza ProcesoCancelado.
+    Con `db`, las marcas quedan en su transacción sin confirmar (las confirma quien llama).
     """
     # ---------- Normalizaciones seguras ----------
     # dtype=str hace que las columnas sean StringDtype; convertir a object
@@ -47,86 +149,125 @@ def actualizar_cargado_sap(df: pd.DataFrame) -> bool:
     df.iloc[:, 1]  = pd.to_datetime(df.iloc[:, 1], dayfirst=True, errors="coerce").dt.date  # Date
     df.iloc[:, 7]  = pd.to_numeric(df.iloc[:, 7], errors="coerce").astype("Int64")  # BIGINT
     df.iloc[:, 9]  = df.iloc[:, 9].apply(_clean_str)          # OperationActivity → str
-    df.iloc[:, 10] = df.iloc[:, 10].apply(_safe_float)        # Hours
+    df.iloc[:, 10] = df.iloc[:, 10].apply(horas_centesimas)   # Hours → centésimas (HoursCent)
 
-    total = success = actualizados = 0
+    if db is None:
+        with database_session as db:
+            ok = actualizar_cargado_sap(df, resumen, cancelacion, db)
+            db.commit()
+        return ok
 
-    with database_session as db:
-        for _, fila in df.iterrows():
-            total += 1
-            if fila.iloc[12] != "Success":
-                continue
-
-            success += 1
-
-            query = (
-                db.query(TablaCentral)
-                .filter(
-                    TablaCentral.Employee_Number   == fila.iloc[0],     # str
-                    TablaCentral.Date              == fila.iloc[1],     # date
-                    TablaCentral.ProductionOrder   == fila.iloc[7],     # BIGINT (int64)
-                    TablaCentral.OperationActivity == fila.iloc[9],     # str
-                    TablaCentral.Hours             == fila.iloc[10],    # float
-                    TablaCentral.Cargado_SAP       == False,
-                )
-                .first()
-            )
-
-            if query:
-                query.Cargado_SAP = True
-                db.commit()
-                actualizados += 1
+    try:
+        _cargar_staging(db, df)
+        cancelacion.comprobar()
+        conteos = db.execute(_SQL_CONCILIACION).one()
+        cancelacion.comprobar()
+    except ProcesoCancelado:
+        db.rollback()
+        raise
 
-    print(f"Total filas Excel           : {total}")
-    print(f"Filas con estado 'Success'  : {success}")
-    print(f"Registros actualizados en BD: {actualizados}")
+    print(f"Total filas Excel           : {conteos.total}")
+    print(f"Filas con estado 'Success'  : {conteos.success}")
+    print(f"Registros actualizados en BD: {conteos.actualizados}")
+    if resumen is not None:
+        resumen.update(total=conteos.total, success=conteos.success, actualizados=conteos.actualizados)
     return True
 
 
-def limpiar_registros() -> None:
-    with database_session as db:
-        # 1) borrar registros con Cargado_SAP = False
-        eliminados_tc = (
-            db.query(TablaCentral)
-            .filter(TablaCentral.Cargado_SAP.is_(False))    # ← aquí
-            .delete(synchronize_session="fetch")
-        )
-        print(f"Registros eliminados de Tabla_Central con Cargado_SAP=False: {eliminados_tc}")
-
-        # 2) borrar imputaciones huérfanas
-        subq = (
-            db.query(Imputaciones.ID)
-            .join(TablaCentral, Imputaciones.ID == TablaCentral.imputacion_id, isouter=True)
-            .filter(or_(TablaCentral.ID == None, TablaCentral.Cargado_SAP.is_not(True)))  # ← aquí
-            .group_by(Imputaciones.ID)
-            .having(func.count(TablaCentral.ID) == 0)
-            .subquery()
-        )
-
-        eliminados_imp = (
-            db.query(Imputaciones)
-            .filter(Imputaciones.ID.in_(subq))
-            .delete(synchronize_session="fetch")
-        )
-        print(f"Imputaciones eliminadas sin registro válido: {eliminados_imp}")
-
-        db.commit()
-
-
-def procesar_respuesta_sap(archivo_excel: str) -> bool:
+# Limpieza tras la respuesta, en una sola sentencia:
+#   1) se borran las filas de Tabla_Central que siguen con Cargado_SAP = False;
+#   2) se borran las imputaciones que se quedan sin ninguna fila en Tabla_Central.
+# Las dos CTE ven la tabla como estaba antes de la sentencia, así que "sin fila tras el
+# borrado" es "sin fila que no sea de las pendientes" (Cargado_SAP IS DISTINCT FROM false).
+# Las claves foráneas se comprueban al final de la sentencia, con ambas tablas ya borradas.
+_SQL_LIMPIEZA = """
+WITH
+borradas AS (
+    DELETE FROM "Tabla_Central"
+    WHERE "Cargado_SAP" = false
+    RETURNING imputacion_id
+),
+huerfanas AS (
+    DELETE FROM "Imputaciones" i
+    WHERE NOT EXISTS (
+        SELECT 1 FROM "Tabla_Central" tc
+        WHERE tc.imputacion_id = i."ID"
+          AND tc."Cargado_SAP" IS DISTINCT FROM false
+    )
+    {ambito}
+    RETURNING 1
+)
+SELECT
+    (SELECT count(*) FROM borradas) AS eliminados_tc,
+    (SELECT count(*) FROM huerfanas) AS eliminados_imp
+"""
+# Todas las imputaciones huérfanas, o solo las de las filas pendientes que se borran
+_SQL_LIMPIEZA_COMPLETA = text(_SQL_LIMPIEZA.format(ambito=""))
+_SQL_LIMPIEZA_AFECTADAS = text(_SQL_LIMPIEZA.format(
+    ambito='AND i."ID" IN (SELECT imputacion_id FROM borradas)'
+))
+
+
+def limpiar_registros(db: Session | None = None, solo_afectadas: bool = False) -> None:
+    """
+    Borra las filas de Tabla_Central con Cargado_SAP = False y las imputaciones que se
+    quedan sin ninguna fila en Tabla_Central (DELETE ... WHERE NOT EXISTS, sin
+    sincronizar la sesión del ORM).
+    Con `solo_afectadas`, solo se miran las imputaciones de las filas borradas (las de
+    este ciclo de carga), no toda la tabla Imputaciones.
+    Con `db`, se ejecuta dentro de su transacción y no confirma; sin ella, abre su
+    propia sesión y confirma.
+    """
+    if db is None:
+        with database_session as db:
+            limpiar_registros(db, solo_afectadas)
+            db.commit()
+        return
+
+    sql = _SQL_LIMPIEZA_AFECTADAS if solo_afectadas else _SQL_LIMPIEZA_COMPLETA
+    eliminados = db.execute(sql).one()
+    print(f"Registros eliminados de Tabla_Central con Cargado_SAP=False: {eliminados.eliminados_tc}")
+    print(f"Imputaciones eliminadas sin registro válido: {eliminados.eliminados_imp}")
+
+
+def procesar_respuesta_sap(
+    archivo_excel: str,
+    medidor: MedidorEtapas | None = None,
+    cancelacion: TokenCancelacion = SIN_CANCELACION,
+    solo_afectadas: bool = False,
+) -> bool:
     """
     Punto de entrada único usado por la ruta SSE.  
     Devuelve *True* si todo fue bien, *False* en caso contrario.
+    Los tiempos de cada etapa se acumulan en `medidor`.
+    Conciliación y limpieza (ver `limpiar_registros` para `solo_afectadas`) van en la
+    misma transacción: o se aplican las dos o ninguna.
+    La cancelación se atiende durante la lectura y la actualización (sin cambios en BD);
+    una vez hecha la conciliación, la limpieza se completa siempre.
     """
-    registros_excel, ok = leer_datos_excel(archivo_excel)
+    if medidor is None:
+        medidor = MedidorEtapas("respuesta_sap")
+
+    with medidor.etapa("lectura_excel") as etapa:
+        registros_excel, ok = leer_datos_excel(archivo_excel)
+        etapa.filas_salida = len(registros_excel) if ok else 0
     if not ok:
         print("Error al cargar el archivo de Excel.")
         return False
 
-    if actualizar_cargado_sap(registros_excel):
-        limpiar_registros()
-        print("Proceso completado correctamente.")
-        return True
+    cancelacion.comprobar()
+    resumen = {}
+    with database_session as db:
+        with medidor.etapa("actualizacion_bd", filas_entrada=len(registros_excel)) as etapa:
+            ok = actualizar_cargado_sap(registros_excel, resumen, cancelacion, db)
+            etapa.filas_salida = resumen.get("actualizados")
+
+        if ok:
+            with medidor.etapa("limpieza_bd"):
+                limpiar_registros(db, solo_afectadas)
+                db.commit()
+            print("Proceso completado correctamente.")
+            return True
 
     print("Error en la actualización de datos.")
     return False
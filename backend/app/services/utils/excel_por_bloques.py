@@ -0,0 +1,108 @@
+# PATH: backend/app/services/utils/excel_por_bloques.py
+
+from typing import Iterator, List, Optional
+
+import pandas as pd
+from openpyxl import load_workbook
+
+# Textos que pd.read_excel trata como nulos por defecto (na_values)
+VALORES_NULOS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan',
+    '1.#IND', '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a',
+    'nan', 'null',
+}
+
+
+def _celda_a_str(cell) -> Optional[str]:
+    """
+    Convierte una celda de openpyxl igual que pd.read_excel(dtype=str):
+    números enteros sin '.0', fechas como 'YYYY-MM-DD HH:MM:SS' y nulos como None.
+    """
+    valor = cell.value
+    if valor is None or cell.data_type == 'e':
+        return None
+    if cell.data_type == 'n' and isinstance(valor, float) and valor.is_integer():
+        valor = int(valor)
+    texto = str(valor)
+    return None if texto in VALORES_NULOS else texto
+
+
+def _nombres_columnas(cabecera) -> List[str]:
+    nombres, vistos = [], {}
+    for i, valor in enumerate(cabecera):
+        nombre = f"Unnamed: {i}" if valor is None else str(valor)
+        if nombre in vistos:
+            vistos[nombre] += 1
+            nombre = f"{nombre}.{vistos[nombre]}"
+        else:
+            vistos[nombre] = 0
+        nombres.append(nombre)
+    return nombres
+
+
+def leer_cabecera_excel(path: str, filas_muestra: int = 1):
+    """
+    Devuelve (columnas, nº de filas con datos entre las `filas_muestra` primeras)
+    sin cargar la hoja entera en memoria.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        filas = wb.active.iter_rows(values_only=True)
+        cabecera = next(filas, None)
+        if cabecera is None:
+            return [], 0
+        con_datos = 0
+        for fila in filas:
+            if any(v is not None for v in fila):
+                con_datos += 1
+                if con_datos >= filas_muestra:
+                    break
+        return _nombres_columnas(cabecera), con_datos
+    finally:
+        wb.close()
+
+
+def contar_filas_excel(path: str) -> Optional[int]:
+    """Nº de filas de datos según la dimensión declarada en la hoja (None si no consta)."""
+    wb = load_workbook(path, read_only=True)
+    try:
+        max_row = wb.active.max_row
+        return max_row - 1 if max_row else None
+    finally:
+        wb.close()
+
+
+def iterar_bloques_excel(path: str, filas_por_bloque: int) -> Iterator[pd.DataFrame]:
+    """
+    Recorre la hoja activa en modo read-only y devuelve DataFrames de como mucho
+    `filas_por_bloque` filas, con los mismos valores (str / None) que daría
+    pd.read_excel(dtype=str). Las filas totalmente vacías se omiten.
+
+    El índice de cada bloque es el nº de fila de la hoja menos 2 (el de pd.read_excel
+    sobre la hoja completa), así que `índice + 2` sigue siendo la fila del Excel en
+    cualquier bloque y aunque haya filas vacías intermedias.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        filas = wb.active.iter_rows()
+        cabecera = next(filas, None)
+        if cabecera is None:
+            return
+        columnas = _nombres_columnas([c.value for c in cabecera])
+        n_columnas = len(columnas)
+
+        bloque, indice = [], []
+        for n_fila, fila in enumerate(filas, start=2):
+            valores = [_celda_a_str(c) for c in fila[:n_columnas]]
+            if all(v is None for v in valores):
+                continue
+            valores.extend([None] * (n_columnas - len(valores)))
+            bloque.append(valores)
+            indice.append(n_fila - 2)
+            if len(bloque) >= filas_por_bloque:
+                yield pd.DataFrame(bloque, columns=columnas, index=indice, dtype=object)
+                bloque, indice = [], []
+        if bloque:
+            yield pd.DataFrame(bloque, columns=columnas, index=indice, dtype=object)
+    finally:
+        wb.close()
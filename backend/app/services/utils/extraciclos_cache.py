@@ -0,0 +1,109 @@
+# PATH: backend/app/services/utils/extraciclos_cache.py
+
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.core.config import get_config
+from app.db.session import database_session
+from app.models.models import Extraciclos
+
+
+class Extraciclo(NamedTuple):
+    """Copia inmutable de una fila de Extraciclos (no ligada a ninguna sesión)."""
+    AreaTarea: str
+    CentroTrabajo: str
+    TareaBaan: str
+    TipoCNC: Optional[str]
+    OASAP: Optional[str]
+
+
+class ExtraciclosCache:
+    """
+    Caché de proceso de la tabla Extraciclos.
+    - Índices en memoria por AreaTarea y por (CentroTrabajo, TareaBaan).
+    - Se invalida al confirmar cualquier escritura ORM sobre Extraciclos
+      y, como red de seguridad, caduca tras `ttl` segundos.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (cargado_en, por_area_tarea, por_centro_tarea) se sustituye de una vez
+        self._snapshot = None
+
+    def invalidar(self):
+        """Fuerza la recarga en el próximo acceso."""
+        self._snapshot = None
+
+    def _cargar(self, db: Session):
+        filas = db.query(
+            Extraciclos.AreaTarea,
+            Extraciclos.CentroTrabajo,
+            Extraciclos.TareaBaan,
+            Extraciclos.TipoCNC,
+            Extraciclos.OASAP,
+        ).all()
+        entradas = [Extraciclo(*fila) for fila in filas]
+        por_area_tarea = {e.AreaTarea: e for e in entradas}
+        por_centro_tarea = {(e.CentroTrabajo, e.TareaBaan): e for e in entradas}
+        return time.monotonic(), por_area_tarea, por_centro_tarea
+
+    def _obtener(self, db: Optional[Session] = None) -> Tuple[float, Dict[str, Extraciclo], Dict[Tuple[str, str], Extraciclo]]:
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - snapshot[0] < self.ttl:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or time.monotonic() - snapshot[0] >= self.ttl:
+                if db is not None:
+                    snapshot = self._cargar(db)
+                else:
+                    with database_session as nueva_db:
+                        snapshot = self._cargar(nueva_db)
+                self._snapshot = snapshot
+            return snapshot
+
+    def todos(self, db: Optional[Session] = None) -> List[Extraciclo]:
+        return list(self._obtener(db)[1].values())
+
+    def por_area_tarea(self, area_tarea: Optional[str], db: Optional[Session] = None) -> Optional[Extraciclo]:
+        return self._obtener(db)[1].get(area_tarea)
+
+    def existe_combinacion(self, centro_trabajo: Optional[str], tarea: Optional[str], db: Optional[Session] = None) -> bool:
+        return (centro_trabajo, tarea) in self._obtener(db)[2]
+
+
+# Instancia global de ExtraciclosCache
+extraciclos_cache = ExtraciclosCache(ttl=get_config().EXTRACICLOS_CACHE_TTL)
+
+
+# ---------- Invalidación al escribir ----------
+@event.listens_for(Session, "after_flush")
+def _marcar_cambios_extraciclos(session, flush_context):
+    if any(isinstance(obj, Extraciclos) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info["extraciclos_modificados"] = True
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _marcar_escrituras_en_bloque(orm_execute_state):
+    # query(Extraciclos).update()/delete() e insert/update/delete(Extraciclos) no pasan por el flush
+    mapper = orm_execute_state.bind_mapper
+    es_escritura = orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete
+    if es_escritura and mapper is not None and mapper.class_ is Extraciclos:
+        orm_execute_state.session.info["extraciclos_modificados"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidar_tras_commit(session):
+    if session.info.pop("extraciclos_modificados", False):
+        extraciclos_cache.invalidar()
+
+
+@event.listens_for(Session, "after_rollback")
+def _descartar_marca(session):
+    session.info.pop("extraciclos_modificados", None)
@@ -0,0 +1,104 @@
+# PATH: backend/app/services/utils/imputaciones_utils.py
+
+import hashlib
+import json
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import Optional
+
+import pandas as pd
+
+# Columnas que forman la huella (fingerprint) de una imputación.
+# Son las que comparten la detección de duplicados y la búsqueda del feedback.
+COLUMNAS_FINGERPRINT = [
+    'FechaImp', 'CodEmpleado', 'Timpu', 'Proyecto', 'TipoCoche',
+    'NumCoche', 'CentroTrabajo', 'Tarea', 'TareaAsoc', 'Horas'
+]
+
+
+def _normalizar_valor(columna, valor):
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    if columna == 'FechaImp':
+        if isinstance(valor, datetime):
+            valor = valor.date()
+        return valor.isoformat() if isinstance(valor, date) else str(valor)
+    if columna == 'Horas':
+        # +0.0 evita que -0.0 y 0.0 den huellas distintas
+        return f"{round(float(valor), 2) + 0.0:.2f}"
+    return str(valor)
+
+
+def calcular_fingerprint(datos) -> str:
+    """
+    SHA-256 de la clave natural de una imputación (COLUMNAS_FINGERPRINT).
+    `datos` es cualquier objeto con .get() (dict, pd.Series).
+    Distingue NULL de cadenas como 'None' y redondea Horas a 2 decimales.
+    """
+    valores = [_normalizar_valor(col, datos.get(col)) for col in COLUMNAS_FINGERPRINT]
+    serializado = json.dumps(valores, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(serializado.encode('utf-8')).hexdigest()
+
+
+# Mismo patrón que la migración de backfill de Imputaciones.NumCocheInt (cabe en BIGINT)
+_RE_NUM_COCHE = re.compile(r'[+-]?[0-9]{1,18}')
+
+
+def num_coche_entero(valor) -> Optional[int]:
+    """
+    NumCoche (texto) como entero, para compararlo con SapOrders.CarNumber
+    ('0012' → 12). None si está vacío o no es un entero.
+    """
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    texto = str(valor).strip()
+    return int(texto) if _RE_NUM_COCHE.fullmatch(texto) else None
+
+
+def horas_centesimas(valor) -> Optional[int]:
+    """
+    Horas en centésimas enteras (8.25 → 825), redondeando la mitad hacia arriba
+    como round(numeric) de PostgreSQL. None si no es un número finito.
+    """
+    if valor is None or (not isinstance(valor, str) and pd.isna(valor)):
+        return None
+    try:
+        return int(Decimal(str(float(valor))).scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except (TypeError, ValueError, InvalidOperation):
+        return None
+
+
+def intercambiar_tareas(
+    df: pd.DataFrame,
+    espacios_como_vacio: bool = False,
+    texto_nan_como_nulo: bool = False,
+    quitar_decimal: bool = False,
+) -> pd.DataFrame:
+    """
+    Intercambia 'Tarea' y 'TareaAsoc' en las filas con TareaAsoc informada
+    (no nula y distinta de ''), de forma vectorizada.
+
+    - espacios_como_vacio: una TareaAsoc solo con espacios cuenta como vacía.
+    - texto_nan_como_nulo: el texto 'nan' (sin distinguir mayúsculas ni espacios) cuenta como nulo.
+    - quitar_decimal: la TareaAsoc se pasa a str y se eliminan los '.0' antes de moverla a 'Tarea'.
+    """
+    asoc = df['TareaAsoc']
+    informada = asoc.notna().to_numpy(copy=True)
+    texto = asoc[informada].astype(str)
+
+    comparada = texto.str.strip() if espacios_como_vacio else texto
+    valida = (comparada != '').to_numpy()
+    if texto_nan_como_nulo:
+        valida = valida & (texto.str.strip().str.lower() != 'nan').to_numpy()
+
+    mask = informada.copy()
+    mask[informada] = valida
+    if not mask.any():
+        return df
+
+    nueva_tarea = texto[valida].str.replace('.0', '', regex=False) if quitar_decimal else asoc[mask]
+    tarea_original = df.loc[mask, 'Tarea'].to_numpy(copy=True)
+    df.loc[mask, 'Tarea'] = nueva_tarea.to_numpy()
+    df.loc[mask, 'TareaAsoc'] = tarea_original
+    return df
@@ -0,0 +1,62 @@
+# PATH: backend/app/services/utils/uploads_procesados.py
+
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from app.db.session import database_session
+from app.models.models import UploadsProcesados
+
+# Pipelines que registran sus ficheros procesados
+PIPELINE_TAREAS_SAP = "tareas_sap"
+PIPELINE_IMPUTACIONES = "imputaciones"
+PIPELINE_RESPUESTA_SAP = "respuesta_sap"
+
+
+def buscar_upload_procesado(pipeline: str, sha256: str) -> Optional[dict]:
+    """
+    Devuelve {filename, summary, processed_at} del último procesamiento de un
+    fichero con esa huella en el pipeline, o None si nunca se procesó.
+    """
+    with database_session as db:
+        registro = (
+            db.query(UploadsProcesados)
+            .filter(UploadsProcesados.Pipeline == pipeline, UploadsProcesados.Hash == sha256)
+            .first()
+        )
+        if registro is None:
+            return None
+        return {
+            "filename": registro.Filename,
+            "summary": registro.Summary or {},
+            "processed_at": registro.TimestampInput.isoformat() if registro.TimestampInput else None,
+        }
+
+
+def registrar_upload_procesado(pipeline: str, sha256: str, filename: Optional[str], summary: dict):
+    """Guarda (o actualiza, si se forzó el reproceso) el resultado de procesar el fichero."""
+    with database_session as db:
+        registro = (
+            db.query(UploadsProcesados)
+            .filter(UploadsProcesados.Pipeline == pipeline, UploadsProcesados.Hash == sha256)
+            .first()
+        )
+        if registro is None:
+            registro = UploadsProcesados(Pipeline=pipeline, Hash=sha256)
+            db.add(registro)
+        registro.Filename = filename
+        registro.Summary = summary
+        registro.TimestampInput = datetime.now(timezone.utc)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Otra ejecución registró el mismo fichero a la vez: nos quedamos con la suya
+            db.rollback()
+
+
+def mensaje_upload_repetido(previo: dict) -> str:
+    """Mensaje SSE final cuando se reutiliza el resultado de un fichero ya procesado."""
+    fecha = previo.get("processed_at") or "una ejecución anterior"
+    mensaje_anterior = previo.get("summary", {}).get("mensaje", "")
+    return f"♻️ Archivo ya procesado ({fecha}); no se vuelve a cargar. Resultado anterior: {mensaje_anterior}".rstrip()
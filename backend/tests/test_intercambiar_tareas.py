@@ -0,0 +1,106 @@
+# PATH: backend/tests/test_intercambiar_tareas.py
+
+# /backend/tests/test_intercambiar_tareas.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.services.etl_inmemory import _load_datos_excel
+from app.services.feedback import _utils as feedback_utils
+from app.services.feedback._utils import is_null
+from app.services.utils.imputaciones_utils import intercambiar_tareas
+
+
+# ---------- Bucles originales (referencia) ----------
+
+def _legacy_transformar(df):
+    for index, row in df.iterrows():
+        if row['TareaAsoc'] is not None and str(row['TareaAsoc']).strip() != '':
+            old_tarea = row['Tarea']
+            df.at[index, 'Tarea'] = row['TareaAsoc']
+            df.at[index, 'TareaAsoc'] = old_tarea
+    return df
+
+
+def _legacy_load(df):
+    for index, row in df.iterrows():
+        if pd.notna(row['TareaAsoc']) and row['TareaAsoc'] != '':
+            tarea_asoc_str = str(row['TareaAsoc'])
+            tarea_asoc_str = tarea_asoc_str.replace('.0', '')
+            row['TareaAsoc'] = tarea_asoc_str
+            df.at[index, 'Tarea'], df.at[index, 'TareaAsoc'] = row['TareaAsoc'], row['Tarea']
+    return df
+
+
+def _legacy_feedback(df):
+    for index, row in df.iterrows():
+        if not is_null(row['TareaAsoc']) and row['TareaAsoc'] != '':
+            df.at[index, 'Tarea'], df.at[index, 'TareaAsoc'] = row['TareaAsoc'], row['Tarea']
+    return df
+
+
+def _nulos_como_none(df):
+    # iterrows convierte a veces None en NaN al construir la fila; ambos son "nulo"
+    # para el resto del pipeline, así que se comparan normalizados
+    return df.astype(object).where(df.notna(), None)
+
+
+def _assert_mismo_resultado(obtenido, esperado):
+    pd.testing.assert_frame_equal(_nulos_como_none(obtenido), _nulos_como_none(esperado))
+
+
+# ---------- Fixtures ----------
+
+def _df_transformado():
+    # Tras la limpieza de transformar_datos_excel_inmemory los nulos ya son None
+    return pd.DataFrame({
+        'Tarea':     ['3060', '3060', None, '100', '200', '300', '400', '500'],
+        'TareaAsoc': ['12',   None,   '7',  '',    '   ', ' 8 ', '13.0', '10.05'],
+        'Otra':      [1, 2, 3, 4, 5, 6, 7, 8],
+    }, index=[3, 5, 8, 9, 10, 20, 21, 22], dtype=object)
+
+
+def _df_crudo():
+    # Mezcla de tipos como los que llegan de Excel sin normalizar
+    return pd.DataFrame({
+        'Tarea':     ['1', '2', '3', '4', None, '6', '7', '8', '9'],
+        'TareaAsoc': [np.nan, 12.0, '13.0', '', '5', 'nan', ' NaN ', '  ', '10.05'],
+    }, dtype=object)
+
+
+def _df_feedback():
+    # Como llega de read_excel(dtype=str)
+    return pd.DataFrame({
+        'Tarea':     ['1', '2', '3', '4', '5', np.nan],
+        'TareaAsoc': [np.nan, '20', 'nan', ' NAN', '', '60'],
+    }, dtype=str)
+
+
+def test_transformar_igual_que_bucle():
+    """El intercambio de la transformación coincide con el bucle original."""
+    esperado = _legacy_transformar(_df_transformado())
+    obtenido = intercambiar_tareas(_df_transformado(), espacios_como_vacio=True)
+    _assert_mismo_resultado(obtenido, esperado)
+
+
+@pytest.mark.parametrize("fixture", [_df_transformado, _df_crudo])
+def test_load_igual_que_bucle(fixture):
+    """La variante con limpieza de '.0' coincide con el bucle original."""
+    esperado = _legacy_load(fixture())
+    obtenido = _load_datos_excel.intercambiar_tareas(fixture())
+    _assert_mismo_resultado(obtenido, esperado)
+
+
+@pytest.mark.parametrize("fixture", [_df_transformado, _df_crudo, _df_feedback])
+def test_feedback_igual_que_bucle(fixture):
+    """La variante del feedback ('nan' como nulo) coincide con el bucle original."""
+    esperado = _legacy_feedback(fixture())
+    obtenido = feedback_utils.intercambiar_tareas(fixture())
+    _assert_mismo_resultado(obtenido, esperado)
+
+
+def test_sin_filas_a_intercambiar():
+    """Si ninguna TareaAsoc está informada el DataFrame no cambia."""
+    df = pd.DataFrame({'Tarea': ['1', '2'], 'TareaAsoc': [None, '']})
+    pd.testing.assert_frame_equal(intercambiar_tareas(df.copy()), df)
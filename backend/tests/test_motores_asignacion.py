@@ -0,0 +1,120 @@
+# PATH: backend/tests/test_motores_asignacion.py
+
+# Paridad entre los motores de asignación SAP (en memoria y SQL) sobre un caso sembrado
+# a mano, con las claves NULL / vacías que cada motor compara a su manera. Usa el mismo
+# PostgreSQL de pruebas que test_query_plans (QUERY_PLANS_DATABASE_URL); sin esa variable
+# o sin conexión, se salta. Todo se crea en un esquema propio que se borra al terminar.
+
+import os
+import uuid
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session
+
+from app.core.registro_progreso import RegistroProgreso
+from app.models.models import Base, Imputaciones, ProjectsDictionary, SapOrders, TablaCentral
+from app.services.utils.extraciclos_cache import extraciclos_cache
+from app.services.generar_imputaciones_sap.assign_sap_orders import run_assign_sap_orders_inmemory
+from app.services.generar_imputaciones_sap.assign_sap_orders_sql import run_assign_sap_orders_sql
+from app.services.generar_imputaciones_sap.pending_imputaciones import filtro_requiere_asignacion
+
+CONTADORES = ("asignadas", "sin_operation", "sin_proyecto", "sin_match")
+
+
+# ---------- Fixtures ----------
+
+@pytest.fixture(scope="module")
+def engine():
+    url = os.getenv("QUERY_PLANS_DATABASE_URL")
+    if not url:
+        pytest.skip("QUERY_PLANS_DATABASE_URL no definida: sin PostgreSQL de pruebas")
+    esquema = f"motores_{uuid.uuid4().hex[:8]}"
+    motor = create_engine(url, connect_args={"connect_timeout": 3, "options": f"-csearch_path={esquema}"})
+    try:
+        with motor.begin() as conn:
+            conn.execute(text(f'CREATE SCHEMA "{esquema}"'))
+    except OperationalError:
+        motor.dispose()
+        pytest.skip("PostgreSQL no disponible para comparar los motores de asignación")
+    try:
+        Base.metadata.create_all(bind=motor)
+        yield motor
+    finally:
+        with motor.begin() as conn:
+            conn.execute(text(f'DROP SCHEMA "{esquema}" CASCADE'))
+        motor.dispose()
+
+
+def _sembrar(db):
+    for modelo in (TablaCentral, Imputaciones, SapOrders, ProjectsDictionary):
+        db.query(modelo).delete()
+    db.add(ProjectsDictionary(ProyectoBaan="P1", ProyectoSap="S1"))
+    db.flush()
+
+    def orden(id_, operation, oa, timestamp):
+        return SapOrders(ID=id_, Order=str(2000000000 + id_), Operation=operation, OperationActivity=oa,
+                         Project="S1", Vertice="A", CarNumber=1, ActiveOrder=True, IsCurrent=True,
+                         TimestampInput=timestamp)
+
+    db.add_all([
+        # Orden activa con Operation NULL: la encuentra una imputación con Tarea NULL
+        orden(1, None, "OA-NULA", datetime(2025, 1, 1)),
+        orden(2, "3060", "3060-A", datetime(2025, 1, 1)),
+        orden(3, "", "VACIA-A", datetime(2025, 1, 1)),
+    ])
+    db.flush()
+
+    def imputacion(id_, tarea):
+        return Imputaciones(ID=id_, FechaImp=date(2025, 1, 2), CodEmpleado="E1", Horas=8.0, Proyecto="P1",
+                            TipoCoche="A", NumCoche="1", NumCocheInt=1, Tarea=tarea)
+
+    db.add_all([imputacion(1, None), imputacion(2, "3060"), imputacion(3, ""), imputacion(4, "9999")])
+    db.commit()
+
+
+def _ejecutar(engine, motor):
+    extraciclos_cache.invalidar()
+    with Session(engine) as db:
+        _sembrar(db)
+        logs = RegistroProgreso("test")
+        motor(db, logs, completo=True)
+        filas = sorted(
+            (tc.imputacion_id, tc.sap_order_id, tc.ProductionOrder, tc.Operation, tc.OperationActivity)
+            for tc in db.query(TablaCentral)
+        )
+        _, todos = logs.snapshot_contadores()
+        contadores = {c: todos.get(c, 0) for c in CONTADORES}
+    return filas, contadores
+
+
+# ---------- Tests ----------
+
+def test_paridad_motores_claves_nulas(engine):
+    """
+    Tarea NULL con una orden activa de Operation NULL: los dos motores la cruzan (NULL
+    coincide con NULL, como en el diccionario en memoria) y la descartan por quedar sin
+    Operation; una Tarea '' solo coincide con Operation ''.
+    """
+    en_memoria = _ejecutar(engine, run_assign_sap_orders_inmemory)
+    en_sql = _ejecutar(engine, run_assign_sap_orders_sql)
+    assert en_sql == en_memoria
+    filas, contadores = en_sql
+    assert filas == [(2, 2, 2000000002, "3060", "3060-A"), (3, 3, 2000000003, "", "VACIA-A")]
+    assert contadores == {"asignadas": 2, "sin_operation": 2, "sin_proyecto": 0, "sin_match": 0}
+
+
+def test_incremental_detecta_operation_nula(engine):
+    """
+    Una orden activa nueva con Operation NULL vuelve a marcar para asignar la imputación
+    con Tarea NULL (el motor en memoria la cruzaría), y solo a ella.
+    """
+    _ejecutar(engine, run_assign_sap_orders_inmemory)
+    with Session(engine) as db:
+        assert db.scalars(select(Imputaciones.ID).where(filtro_requiere_asignacion())).all() == []
+        db.add(SapOrders(ID=4, Order="2000000004", Operation=None, OperationActivity="OA-NUEVA", Project="S9",
+                         ActiveOrder=True, IsCurrent=True, TimestampInput=datetime(2025, 2, 1)))
+        db.commit()
+        assert db.scalars(select(Imputaciones.ID).where(filtro_requiere_asignacion())).all() == [1]
@@ -0,0 +1,208 @@
+# PATH: backend/tests/test_query_plans.py
+
+# Comprueba con EXPLAIN que las consultas calientes de los servicios usan los índices
+# de las migraciones e5b1c8d24f63 / 0b7e3d5a9c12 y no recorren secuencialmente las tablas grandes.
+# Necesita un PostgreSQL de pruebas en QUERY_PLANS_DATABASE_URL (nunca se usa la BD de
+# la aplicación: se siembran ~500k filas). Sin esa variable o sin conexión, se salta.
+# Todo se crea en un esquema propio que se borra al terminar.
+
+import importlib.util
+import json
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.exc import OperationalError
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from app.models.models import Base, Imputaciones, TablaCentral
+from app.services.generar_imputaciones_sap.pending_imputaciones import filtro_requiere_asignacion
+from app.services.sap_etl_utils import _SQL_VIGENCIA
+from app.services.sap_response_handling.actualizar_cargado_sap import _SQL_CONCILIACION, _SQL_STAGING
+
+RUTAS_MIGRACIONES = [
+    os.path.join(os.path.dirname(__file__), "..", "alembic", "versions", nombre)
+    for nombre in ("e5b1c8d24f63_indices_consultas_calientes.py", "0b7e3d5a9c12_quitar_indice_respuesta_sap.py")
+]
+
+N_IMPUTACIONES = 200_000
+N_SAP_ORDERS = 100_000
+N_PROYECTOS = 200
+CADA_PENDIENTE = 50        # 1 de cada 50 filas de Tabla_Central sin cargar en SAP
+CADA_SIN_VERSION = 1000    # 1 de cada 1000 imputaciones nunca resuelta
+VERSION_RESUELTAS = N_SAP_ORDERS // 2   # media Sap_Orders cargada después de la última asignación
+
+
+# ---------- Fixtures ----------
+
+def _cargar_migracion(ruta):
+    spec = importlib.util.spec_from_file_location("migracion_indices", ruta)
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+def _sembrar(conn):
+    """Datos sintéticos con la forma de producción (generate_series, sin pasar por Python)."""
+    conn.execute(text("""
+        INSERT INTO "Projects_Dictionary" ("ProyectoBaan", "ProyectoSap")
+        SELECT 'PB' || g, 'PS' || g FROM generate_series(1, :n) g
+    """), {"n": N_PROYECTOS})
+    conn.execute(text("""
+        INSERT INTO "Sap_Orders" ("ID", "Order", "Operation", "OperationActivity", "Project",
+                                  "Vertice", "CarNumber", "TipoIndirecto", "TipoMotivo",
+                                  "ActiveOrder", "IsCurrent", "TimestampInput")
+        SELECT g, (2000000000 + g)::text, 'OP' || (g % 5000), 'OP' || (g % 5000) || '-' || (g % 7),
+               'PS' || (g % :proyectos + 1), 'V' || (g % 3), g % 100, 'TI' || (g % 20), 'TM' || (g % 30),
+               g % 10 <> 0, g % 10 <> 0, timestamp '2025-01-01' + g * interval '1 minute'
+        FROM generate_series(1, :n) g
+    """), {"n": N_SAP_ORDERS, "proyectos": N_PROYECTOS})
+    conn.execute(text("""
+        INSERT INTO "Imputaciones" ("ID", "FechaImp", "CodEmpleado", "Horas", "Proyecto", "TipoCoche",
+                                    "NumCoche", "NumCocheInt", "Tarea", "TipoIndirecto", "TipoMotivo",
+                                    "SapOrdersVersion")
+        SELECT g, date '2025-01-01' + g % 365, 'E' || (g % 3000), 8, 'PB' || (g % :proyectos + 1),
+               'V' || (g % 3), (g % 100)::text, g % 100, 'OP' || (g % 5000), 'TI' || (g % 20), 'TM' || (g % 30),
+               CASE WHEN g % :sin_version = 0 THEN NULL ELSE :version END
+        FROM generate_series(1, :n) g
+    """), {"n": N_IMPUTACIONES, "proyectos": N_PROYECTOS, "sin_version": CADA_SIN_VERSION,
+           "version": VERSION_RESUELTAS})
+    conn.execute(text("""
+        INSERT INTO "Tabla_Central" ("ID", imputacion_id, sap_order_id, "Employee_Number", "Date", "HourType",
+                                     "ProductionOrder", "Operation", "OperationActivity", "Hours",
+                                     "HoursCent", "Cargado_SAP")
+        SELECT g, g, g % :ordenes + 1, 'E' || (g % 3000), date '2025-01-01' + g % 365,
+               'Production Direct Hour', 2000000000 + g % :ordenes + 1, 'OP' || (g % 5000),
+               'OP' || (g % 5000) || '-' || (g % 7), 8, 800, g % :cada_pendiente <> 0
+        FROM generate_series(1, :n) g
+    """), {"n": N_IMPUTACIONES, "ordenes": N_SAP_ORDERS, "cada_pendiente": CADA_PENDIENTE})
+    conn.execute(text('ANALYZE "Projects_Dictionary", "Sap_Orders", "Imputaciones", "Tabla_Central"'))
+
+
+@pytest.fixture(scope="module")
+def conn():
+    url = os.getenv("QUERY_PLANS_DATABASE_URL")
+    if not url:
+        pytest.skip("QUERY_PLANS_DATABASE_URL no definida: sin PostgreSQL de pruebas para los planes")
+    engine = create_engine(url, connect_args={"connect_timeout": 3})
+    try:
+        conexion = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    except OperationalError:
+        engine.dispose()
+        pytest.skip("PostgreSQL no disponible para comprobar los planes de ejecución")
+
+    esquema = f"planes_{uuid.uuid4().hex[:8]}"
+    conexion.execute(text(f'CREATE SCHEMA "{esquema}"'))
+    try:
+        conexion.execute(text(f'SET search_path TO "{esquema}"'))
+        Base.metadata.create_all(bind=conexion)
+        with Operations.context(MigrationContext.configure(conexion)):
+            for ruta in RUTAS_MIGRACIONES:
+                _cargar_migracion(ruta).upgrade()
+        _sembrar(conexion)
+        yield conexion
+    finally:
+        conexion.execute(text(f'DROP SCHEMA "{esquema}" CASCADE'))
+        conexion.close()
+        engine.dispose()
+
+
+# ---------- Utilidades ----------
+
+def _nodos(plan):
+    yield plan
+    for hijo in plan.get("Plans", []):
+        yield from _nodos(hijo)
+
+
+def _plan(conn, consulta):
+    compilada = consulta.compile(dialect=conn.dialect)
+    fila = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compilada}", compilada.params).scalar()
+    plan = fila if isinstance(fila, list) else json.loads(fila)
+    return plan[0]["Plan"]
+
+
+def _assert_sin_seq_scan(conn, consulta, tabla, indice):
+    nodos = list(_nodos(_plan(conn, consulta)))
+    seq_scans = [n for n in nodos if n["Node Type"] == "Seq Scan" and n.get("Relation Name") == tabla]
+    indices = {n.get("Index Name") for n in nodos}
+    assert not seq_scans, f"Seq Scan sobre {tabla}: {json.dumps(nodos[0], indent=1)}"
+    assert indice in indices, f"No se usa {indice} (índices usados: {indices - {None}})"
+
+
+# ---------- Tests ----------
+
+def test_plan_feedback_tabla_central_por_imputacion(conn):
+    """feedback_processor: fila de Tabla_Central de una imputación."""
+    consulta = select(TablaCentral).where(TablaCentral.imputacion_id == 12345).limit(1)
+    _assert_sin_seq_scan(conn, consulta, "Tabla_Central", "ix_tabla_central_imputacion_id")
+
+
+def test_plan_respuesta_sap_conciliacion(conn):
+    """
+    actualizar_cargado_sap: el Excel (tabla de staging) se cruza con las pendientes por hash
+    sobre la clave ROW(...)::text, y las pendientes se leen con el índice parcial.
+    """
+    # La staging es ON COMMIT DROP: se crea y se explica dentro de una transacción propia
+    # (la conexión del fixture es AUTOCOMMIT) que se deshace al terminar
+    esquema = conn.execute(text("SHOW search_path")).scalar()
+    with conn.engine.connect() as transaccion:
+        transaccion.execute(text(f"SET LOCAL search_path TO {esquema}"))
+        transaccion.execute(_SQL_STAGING)
+        transaccion.execute(text("""
+            INSERT INTO respuesta_sap_staging
+            SELECT row_number() OVER (), "Employee_Number", "Date", "ProductionOrder",
+                   "OperationActivity", "HoursCent", true
+            FROM "Tabla_Central" WHERE "Cargado_SAP" = false LIMIT 2000
+        """))
+        transaccion.execute(text("ANALYZE respuesta_sap_staging"))
+        nodos = list(_nodos(_plan(transaccion, _SQL_CONCILIACION)))
+        transaccion.rollback()
+
+    seq_scans = [n for n in nodos if n["Node Type"] == "Seq Scan" and n.get("Relation Name") == "Tabla_Central"]
+    indices = {n.get("Index Name") for n in nodos}
+    assert not seq_scans, f"Seq Scan sobre Tabla_Central: {json.dumps(nodos[0], indent=1)}"
+    assert "ix_tabla_central_pendientes" in indices, f"No se usa ix_tabla_central_pendientes ({indices - {None}})"
+    assert any("ROW(" in n.get("Hash Cond", "") for n in nodos), "La clave del Excel no se cruza por hash"
+
+
+def test_plan_conteo_pendientes_tabla_central(conn):
+    """/start y limpieza de la asignación: filas con Cargado_SAP = False."""
+    consulta = select(func.count()).select_from(TablaCentral).where(TablaCentral.Cargado_SAP == False)
+    _assert_sin_seq_scan(conn, consulta, "Tabla_Central", "ix_tabla_central_pendientes")
+
+
+def test_plan_imputaciones_por_proyecto(conn):
+    """routes/proyectos: número de imputaciones de un proyecto."""
+    consulta = select(func.count()).select_from(Imputaciones).where(Imputaciones.Proyecto == "PB17")
+    _assert_sin_seq_scan(conn, consulta, "Imputaciones", "ix_imputaciones_proyecto")
+
+
+def test_plan_filtro_incremental_sap_orders(conn):
+    """
+    Asignación incremental: la búsqueda de SapOrders nuevas que afectan a cada
+    imputación es un rango en índice, no un recorrido de todas las posteriores a la versión.
+    """
+    consulta = select(Imputaciones.ID).where(filtro_requiere_asignacion())
+    _assert_sin_seq_scan(conn, consulta, "Sap_Orders", "ix_sap_orders_operation")
+    _assert_sin_seq_scan(conn, consulta, "Sap_Orders", "ix_sap_orders_gg")
+    _assert_sin_seq_scan(conn, consulta, "Sap_Orders", "ix_sap_orders_proyecto")
+    # Tarea NULL frente a Operation NULL: también un rango (IS NULL, ID > versión) en el índice
+    conds = [n.get("Index Cond", "") for n in _nodos(_plan(conn, consulta)) if n.get("Index Name") == "ix_sap_orders_operation"]
+    assert any('"Operation" IS NULL' in c for c in conds), f"Sin rango IS NULL en ix_sap_orders_operation: {conds}"
+
+
+def test_plan_vigencia_sap_orders(conn):
+    """
+    Carga de SapOrders (actualizar_vigencia_sap_orders): las claves tocadas se cruzan con
+    Sap_Orders por hash, sin nested loop (con IS NOT DISTINCT FROM era cuadrático).
+    """
+    for desde_id in (0, N_SAP_ORDERS - 100):
+        consulta = text(_SQL_VIGENCIA).bindparams(desde_id=desde_id, vigente=True)
+        nodos = list(_nodos(_plan(conn, consulta)))
+        bucles = [n for n in nodos if n["Node Type"] == "Nested Loop"]
+        assert not bucles, f"Nested Loop con desde_id={desde_id}: {json.dumps(nodos[0], indent=1)}"
+        assert any("ROW(" in n.get("Hash Cond", "") for n in nodos), \
+            f"Las claves no se cruzan por hash con desde_id={desde_id}"